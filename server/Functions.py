@@ -1,43 +1,97 @@
-# Module imports
-from collections import defaultdict
-from spacy.util import compile_infix_regex
-from itertools import combinations
+# Module imports (torch, transformers and spaCy are imported where they are used, so importing this module stays cheap)
+from collections import deque
+from itertools import groupby
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
 import os
-import requests
+import time
 import fitz  # PyMuPDF
-import spacy
 import pandas as pd
-import pymongo
-import matplotlib.pyplot as plt
-import seaborn as sns
-import pdfplumber
-import re
-import spacy
-import pandas as pd
-import requests
-import torch
 import re
 import hashlib
-from typing import List, Dict
-from spacy.tokens import Doc
-from spacy.language import Language
-from transformers import pipeline
-from datasets import Dataset
-from torch.utils.data import DataLoader
-from transformers import Trainer, TrainingArguments
-from sklearn.metrics import accuracy_score
+from resources import registry
+from columnar_store import read_table, write_table
+from metrics import record_items, record_stage, trace, tracing
+
+# PDF extraction settings
+PDF_ENGINE = os.getenv("PDF_ENGINE", "pymupdf")  # "pymupdf" or "pdfplumber"
+PDF_FALLBACK_ENGINE = "pdfplumber"
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", os.cpu_count() or 1))
+PDF_PAGE_FANOUT_THRESHOLD = int(os.getenv("PDF_PAGE_FANOUT_THRESHOLD", 200))  # Larger PDFs are split across workers by page
+PDF_PAGE_CHUNK_SIZE = int(os.getenv("PDF_PAGE_CHUNK_SIZE", 50))
+
+# REBEL relation extraction settings
+REBEL_MODEL = "Babelscape/rebel-large"
+REBEL_BACKEND = os.getenv("REBEL_BACKEND", "torch")  # "torch" (fp32), "int8" or "onnx", see rebel_backends.py
+REBEL_WORKERS = int(os.getenv("REBEL_WORKERS", 1))  # > 1 shards relation prediction across model processes
+REBEL_THREADS = int(os.getenv("REBEL_THREADS", 0))  # Threads per REBEL worker process, 0 = cores / REBEL_WORKERS
+REBEL_BATCH_SIZE = int(os.getenv("REBEL_BATCH_SIZE", 16))
+REBEL_MAX_LENGTH = 512
+
+# NER settings
+NER_EXCLUDED_PIPES = ["tagger", "parser", "attribute_ruler", "lemmatizer"]  # NER only needs tok2vec + ner
+NER_BATCH_SIZE = int(os.getenv("NER_BATCH_SIZE", 32))
+NER_N_PROCESS = int(os.getenv("NER_N_PROCESS", 1))
+# Longer documents are tagged in chunks, so memory does not grow with the document (and no Doc comes near spaCy's
+# max_length); each chunk repeats the end of the previous one, at least the pairing windows and NER_CHUNK_OVERLAP
+NER_CHUNK_CHARS = int(os.getenv("NER_CHUNK_CHARS", 100000))
+NER_CHUNK_OVERLAP = int(os.getenv("NER_CHUNK_OVERLAP", 2000))
+
+# Entity pair candidate settings
+PAIR_SENTENCE_WINDOW = int(os.getenv("PAIR_SENTENCE_WINDOW", 0))  # 0 = same sentence only, 1 = also adjacent sentences, ...
+PAIR_TOKEN_WINDOW = int(os.getenv("PAIR_TOKEN_WINDOW", 0))  # Also pair mentions at most this many tokens apart (0 = off)
+PAIR_FALLBACK_TOKEN_WINDOW = 40  # Token window used when the pipeline sets no sentence boundaries
+PAIR_EVIDENCE_MAX_TOKENS = int(os.getenv("PAIR_EVIDENCE_MAX_TOKENS", 200))  # Longer evidence is narrowed around the pair
+ENTITY_COLUMNS = ["File Name", "Entity", "Label", "Mentions", "Canonical ID", "Aliases"]
+PAIR_COLUMNS = ["Entity 1", "Type 1", "Entity 2", "Type 2", "Relationship", "File Name", "Co-occurrences", "Evidence"]
 
 # Helper functions
-# 1. Helper Function to extract text from a single PDF file
-def extract_text_from_pdf(pdf_path):
-    text = ""
+# 1. Helper Function to extract the text of pages [start, stop) of a PDF, one string per page
+def _extract_pages_pymupdf(pdf_path, start=0, stop=None):
+    with fitz.open(pdf_path) as pdf:
+        stop = len(pdf) if stop is None else min(stop, len(pdf))
+        return [pdf[page_number].get_text() for page_number in range(start, stop)]
+
+def _extract_pages_pdfplumber(pdf_path, start=0, stop=None):
+    import pdfplumber  # Only needed for the fallback engine
     with pdfplumber.open(pdf_path) as pdf:
-        for page in pdf.pages:
-            text += page.extract_text() + "\n"  # Preserve line breaks
-    return text
+        return [page.extract_text() or "" for page in pdf.pages[start:stop]]  # extract_text() is None on empty pages
+
+PDF_ENGINES = {
+    "pymupdf": _extract_pages_pymupdf,
+    "pdfplumber": _extract_pages_pdfplumber,
+}
+
+def extract_pages_from_pdf(pdf_path, start=0, stop=None, engine=PDF_ENGINE):
+    """Returns the text of each page, falling back to pdfplumber if the selected engine fails."""
+    try:
+        return PDF_ENGINES[engine](pdf_path, start, stop)
+    except Exception as e:
+        if engine == PDF_FALLBACK_ENGINE:
+            raise
+        print(f"{engine} failed on {pdf_path} ({e}), falling back to {PDF_FALLBACK_ENGINE}")
+        return PDF_ENGINES[PDF_FALLBACK_ENGINE](pdf_path, start, stop)
+
+def extract_text_from_pdf(pdf_path, engine=PDF_ENGINE):
+    started = time.perf_counter()
+    pages = extract_pages_from_pdf(pdf_path, engine=engine)
+    record_stage("extract_text_from_pdf", time.perf_counter() - started, documents=1, pages=len(pages))
+    return "\n".join(pages)  # Preserve line breaks, joined in one pass
+
+def count_pdf_pages(pdf_path):
+    with fitz.open(pdf_path) as pdf:
+        return len(pdf)
 
 # 2. Helper Function to clean up extracted text
 def clean_extracted_text(text):
+    started = time.perf_counter()
+    cleaned_text = _clean_text(text)
+    record_stage("clean_extracted_text", time.perf_counter() - started, characters=len(text))
+    return cleaned_text
+
+def _clean_text(text):
     # Remove unwanted "K" characters (use a regex to remove K's in inappropriate places)
     cleaned_text = re.sub(r'K+', ' ', text)  # Replace multiple 'K's with a single space
     # Normalize spaces (e.g., remove extra spaces)
@@ -71,209 +125,598 @@ def is_valid_entity(entity_text, label):
         return False
     return True
 
+# 4. Helper Function to normalise a spaCy entity span, returns None for unwanted entities
+def normalize_entity(ent):
+    entity_text = ent.text.replace('\n', ' ').strip()
+    entity_text = entity_text.title()  # Normalize capitalisation; spellings of one name are merged by canonicalize.py
+    if not is_valid_entity(entity_text, ent.label_):
+        return None
+    return entity_text
+
+# 5. Helper Function to stream (text, filename) tuples for every .txt file in a folder (or only the given filenames)
+def iter_text_files(folder_path, filenames=None):
+    if filenames is None:
+        filenames = sorted(os.listdir(folder_path))
+    for filename in filenames:
+        if filename.endswith(".txt"):
+            with open(os.path.join(folder_path, filename), "r", encoding="utf-8") as file:
+                yield file.read(), filename
+
+def _token_at(doc, char):
+    """Token of doc that contains (or is the first after) the character offset char"""
+    starts = [token.idx for token in doc]
+    return doc[max(0, bisect_right(starts, char) - 1)]
+
+def _outside_entities(doc, char):
+    """char, moved back to the start of the entity it falls inside, if any"""
+    for ent in reversed(doc.ents):
+        if ent.start_char < char < ent.end_char:
+            return ent.start_char
+    return char
+
+def _chunk_boundary(doc, owned_from, token_window=PAIR_TOKEN_WINDOW, max_tokens=PAIR_EVIDENCE_MAX_TOKENS):
+    """Where the mentions a chunk is trusted with end: its last sentence may be cut short, so before that sentence;
+    inside a sentence longer than the chunk, far enough from the cut that no mention, token window or narrowed
+    evidence window of a mention before it reaches the cut, and never inside an entity. None when that leaves
+    nothing after owned_from (the chunk needs more text)."""
+    if doc.has_annotation("SENT_START"):
+        last_sentence = doc[[token.i for token in doc if token.is_sent_start][-1]] if len(doc) else None
+        if last_sentence is not None and last_sentence.idx > owned_from:
+            return last_sentence.idx
+    else:
+        token_window = token_window or PAIR_FALLBACK_TOKEN_WINDOW
+    margin = max(max_tokens, token_window)
+    if len(doc) <= margin:
+        return None
+    boundary = _outside_entities(doc, doc[len(doc) - margin].idx)
+    return boundary if boundary > owned_from else None
+
+def _chunk_restart(doc, boundary, sentence_window=PAIR_SENTENCE_WINDOW, token_window=PAIR_TOKEN_WINDOW,
+                   overlap_chars=NER_CHUNK_OVERLAP):
+    """Where the chunk after boundary starts: early enough to hold every sentence and token window a mention after
+    boundary can pair in (with its evidence) and overlap_chars of context, at a sentence start, outside entities"""
+    has_sentences = doc.has_annotation("SENT_START")
+    first = _token_at(doc, boundary)
+    context = _token_at(doc, max(0, boundary - overlap_chars))
+    restart = context.sent.start_char if has_sentences else context.idx
+    if has_sentences:
+        sentence_starts = [token.i for token in doc if token.is_sent_start]
+        sentence = bisect_right(sentence_starts, first.i) - 1
+        restart = min(restart, doc[sentence_starts[max(0, sentence - sentence_window)]].idx)
+    token_window = token_window or (0 if has_sentences else PAIR_FALLBACK_TOKEN_WINDOW)
+    if token_window:
+        restart = min(restart, doc[max(0, first.i - token_window - 1)].idx)
+    for ent in doc.ents:  # A mention the boundary cuts belongs to the next chunk, whole
+        if ent.start_char < boundary < ent.end_char:
+            restart = min(restart, ent.start_char)
+    return _outside_entities(doc, restart)
+
+# 5b. Helper Function to tag one long text file in chunks, each trusted with the mentions up to its boundary
+def iter_document_chunks(nlp, path, chunk_chars=NER_CHUNK_CHARS, overlap_chars=NER_CHUNK_OVERLAP,
+                         sentence_window=PAIR_SENTENCE_WINDOW, token_window=PAIR_TOKEN_WINDOW):
+    """Yields (doc, owned_from, owned_to) per chunk of the file, reading about chunk_chars at a time. The chunk owns
+    the mentions that end in (owned_from, owned_to] (character offsets in the chunk) and the pairs whose second
+    mention it owns; everything those mentions pair with is inside the chunk, with the same sentences, windows and
+    evidence as in the whole document. The text before owned_from repeats the previous chunk as context. A chunk only
+    grows past chunk_chars while one sentence (or token window) is longer than the chunk."""
+    with open(path, "r", encoding="utf-8") as file:
+        text, owned_from = "", 0
+        while True:
+            wanted = max(chunk_chars - len(text), chunk_chars // 2)
+            block = file.read(wanted)
+            text += block
+            doc = nlp(text)
+            if len(block) < wanted:  # End of the file
+                yield doc, owned_from, len(text)
+                return
+            boundary = _chunk_boundary(doc, owned_from, token_window)
+            if boundary is None:
+                continue  # Read on: nothing in this chunk is far enough from the cut yet
+            yield doc, owned_from, boundary
+            restart = _chunk_restart(doc, boundary, sentence_window, token_window, overlap_chars)
+            text, owned_from = text[restart:], boundary - restart
+
+# 6. Helper Function to load spaCy with only the components NER and sentence-windowed pairing need
+def load_ner_model(model_name="en_core_web_sm"):
+    """Loads a new pipeline; use registry.get("ner") for the process-wide shared one"""
+    import spacy
+    nlp = spacy.load(model_name, exclude=NER_EXCLUDED_PIPES)
+    # Sentence boundaries without the parser: the model's statistical senter if it ships one, else the rule-based one
+    if "senter" in nlp.disabled:
+        nlp.enable_pipe("senter")
+    elif not nlp.has_pipe("senter"):
+        nlp.add_pipe("sentencizer", first=True)
+    return nlp
+
+# 7. Helper Function to find the entity pairs that co-occur within a sentence/token window of one Doc
+def pair_evidence(doc, start, end, span_1, span_2, max_tokens=PAIR_EVIDENCE_MAX_TOKENS):
+    """Text of doc[start:end], narrowed to max_tokens around the two mentions when it is longer: REBEL reads at most
+    REBEL_MAX_LENGTH subword tokens and would silently drop whatever follows"""
+    if end - start > max_tokens:
+        margin = max(0, max_tokens - (span_2.end - span_1.start)) // 2
+        start, end = max(start, span_1.start - margin), min(end, span_2.end + margin)
+    return " ".join(doc[start:end].text.split())
+
+def cooccurring_pairs(doc, mentions, sentence_window=PAIR_SENTENCE_WINDOW, token_window=PAIR_TOKEN_WINDOW, owned_from=0,
+                      first_seen=None):
+    """mentions: [(key, span)] in document order. Two mentions pair up when their sentences are at most
+    sentence_window apart, or at most token_window tokens separate them. Returns {(key 1, key 2): [count, evidence]}
+    with key 1 the entity mentioned first in the document, count the number of co-occurring mention pairs and
+    evidence the text of the first window (by where it ends) they co-occur in.
+    For a chunk of a longer document (see iter_document_chunks): only mention pairs whose second mention ends after
+    the character owned_from are counted, the earlier ones belong to the previous chunk, and first_seen
+    ({key: order of first mention}) is the document's, shared by all its chunks."""
+    has_sentences = doc.has_annotation("SENT_START")
+    if has_sentences:
+        sentences = list(doc.sents)
+        sentence_starts = [sentence.start for sentence in sentences]
+        located = [(key, span, bisect_right(sentence_starts, span.start) - 1) for key, span in mentions]
+    else:
+        token_window = token_window or PAIR_FALLBACK_TOKEN_WINDOW
+        located = [(key, span, None) for key, span in mentions]
+
+    first_seen = {} if first_seen is None else first_seen
+    for key, _, _ in located:
+        first_seen.setdefault(key, len(first_seen))
+
+    pairs = {}
+    # By second mention, so a chunk adds its pairs in the order the whole document would
+    for j, (key_j, span_j, sentence_j) in enumerate(located):
+        if span_j.end_char <= owned_from:
+            continue
+        for key_i, span_i, sentence_i in reversed(located[:j]):
+            in_sentence_window = has_sentences and sentence_j - sentence_i <= sentence_window
+            in_token_window = token_window and span_j.start - span_i.end <= token_window
+            if not (in_sentence_window or in_token_window):
+                break  # Earlier mentions are even further away
+            if key_i == key_j:
+                continue
+            pair = tuple(sorted((key_i, key_j), key=first_seen.get))
+            if pair in pairs:
+                pairs[pair][0] += 1
+                continue
+            if in_sentence_window:
+                evidence = pair_evidence(doc, sentences[sentence_i].start, sentences[sentence_j].end, span_i, span_j)
+            else:
+                evidence = pair_evidence(doc, span_i.start, span_j.end, span_i, span_j)
+            pairs[pair] = [1, evidence]
+    return pairs
+
 # Main functions
 # 1. Main Function to extract text from all PDFs in a directory
-def extract_text_from_directory(directory_path, output_folder):
+def _extract_pdf_task(pdf_path, start, stop, engine):
+    """Process pool task: extracts and cleans pages [start, stop) of one PDF.
+    Returns (cleaned text, pages, extraction seconds, cleaning seconds); the caller records the metrics, since
+    a pool worker's own metrics never reach the server."""
+    started = time.perf_counter()
+    pages = extract_pages_from_pdf(pdf_path, start, stop, engine)
+    extracted = time.perf_counter()
+    cleaned_text = _clean_text("\n".join(pages))
+    return cleaned_text, len(pages), extracted - started, time.perf_counter() - extracted
+
+def _plan_pdf_tasks(pdf_path, page_fanout_threshold, page_chunk_size):
+    """Splits very large PDFs into page ranges, smaller ones are a single task."""
+    num_pages = count_pdf_pages(pdf_path)
+    if num_pages <= page_fanout_threshold:
+        return [(0, None)]
+    return [(start, start + page_chunk_size) for start in range(0, num_pages, page_chunk_size)]
+
+class _TextFileWriter:
+    """Writes a document's cleaned page ranges to its .txt file in page order, whatever order they finish in"""
+
+    def __init__(self, path, starts):
+        self.path = path
+        self.file = open(path, "w", encoding="utf-8")
+        self.next_starts = deque(sorted(starts))
+        self.waiting = {}  # start -> cleaned text finished before an earlier range
+        self.pages = self.tasks = self.characters = 0
+        self.extract_seconds = self.clean_seconds = 0.0
+
+    def add(self, start, cleaned_text, pages, extract_seconds, clean_seconds):
+        self.tasks += 1
+        self.pages += pages
+        self.extract_seconds += extract_seconds
+        self.clean_seconds += clean_seconds
+        self.waiting[start] = cleaned_text
+        while self.next_starts and self.next_starts[0] in self.waiting:
+            text = self.waiting.pop(self.next_starts.popleft())
+            if text:
+                if self.characters:
+                    self.file.write(" ")  # Page ranges are joined like the pages within one
+                    self.characters += 1
+                self.file.write(text)
+                self.characters += len(text)
+
+    def close(self):
+        self.file.close()
+
+def pdf_process_pool(workers=PDF_WORKERS):
+    """Process pool for the PDF tasks, started with forkserver instead of fork (the Linux default): the server calls
+    extract_text_from_directory from an ingestion thread of a process that already runs torch, spaCy and the MongoDB
+    client's threads, and a forked child can deadlock on a lock one of those threads held at the time of the fork.
+    The fork server only imports this module, the workers are forked from it (and import the main module, as spawned
+    processes do)."""
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["Functions"])
+    return ProcessPoolExecutor(max_workers=workers, mp_context=context)
+
+def extract_text_from_directory(directory_path, output_folder, pdf_files=None, engine=PDF_ENGINE, workers=PDF_WORKERS,
+                                page_fanout_threshold=PDF_PAGE_FANOUT_THRESHOLD, page_chunk_size=PDF_PAGE_CHUNK_SIZE):
+    """Extracts and cleans every PDF into output_folder/<name>.txt and returns per-file timings."""
     if not os.path.exists(output_folder):  # Create output folder if it doesn't exist
         os.makedirs(output_folder)
-    pdf_files = [f for f in os.listdir(directory_path) if f.endswith(".pdf")]
+    if pdf_files is None:
+        pdf_files = [f for f in os.listdir(directory_path) if f.endswith(".pdf")]
     if not pdf_files:
         print("No PDF files found in the directory.")
-        return
+        return []
+
+    # One task per file, or one per page range for very large files
+    tasks, writers = [], {}
     for pdf_file in pdf_files:
         pdf_path = os.path.join(directory_path, pdf_file)
-        print(f"Processing: {pdf_file}")
-        # Extract and clean the text
-        text = extract_text_from_pdf(pdf_path)
-        cleaned_text = clean_extracted_text(text)
-        # Save the cleaned text to a .txt file
+        ranges = _plan_pdf_tasks(pdf_path, page_fanout_threshold, page_chunk_size)
         output_file = os.path.join(output_folder, f"{os.path.splitext(pdf_file)[0]}.txt")
-        with open(output_file, "w", encoding="utf-8") as f:
-            f.write(cleaned_text)
-        print(f"Saved cleaned text to: {output_file}")
-
-# 2. Main Function to extract entities 
+        writers[pdf_file] = _TextFileWriter(output_file, [start for start, _ in ranges])
+        for start, stop in ranges:
+            tasks.append((pdf_file, start, (pdf_path, start, stop, engine)))
+
+    # Page ranges are written as soon as the ones before them are, so a long document is never held in memory whole
+    try:
+        if workers <= 1:
+            for pdf_file, start, args in tasks:
+                writers[pdf_file].add(start, *_extract_pdf_task(*args))
+        else:
+            shared = workers == PDF_WORKERS  # The process-wide pool, its workers are reused across uploads
+            executor = registry.get("pdf_workers") if shared else pdf_process_pool(workers)
+            try:
+                futures = {executor.submit(_extract_pdf_task, *args): (pdf_file, start) for pdf_file, start, args in tasks}
+                for future in as_completed(futures):
+                    pdf_file, start = futures[future]
+                    writers[pdf_file].add(start, *future.result())
+            except BrokenProcessPool:
+                if shared:
+                    registry.discard("pdf_workers")  # A worker died (e.g. on a malformed PDF): the next upload gets a new pool
+                raise
+            finally:
+                if not shared:
+                    executor.shutdown()
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    timings = []
+    for pdf_file in pdf_files:
+        writer = writers[pdf_file]
+        timing = {
+            "file": pdf_file,
+            "pages": writer.pages,
+            "tasks": writer.tasks,
+            "seconds": round(writer.extract_seconds + writer.clean_seconds, 4),
+        }
+        timings.append(timing)
+        record_stage("extract_text_from_pdf", writer.extract_seconds, documents=1, pages=timing["pages"])
+        record_stage("clean_extracted_text", writer.clean_seconds, characters=writer.characters)
+        trace("document_stage", stage="extract_text_from_pdf", file=pdf_file, pages=timing["pages"],
+              seconds=round(writer.extract_seconds, 4))
+        trace("document_stage", stage="clean_extracted_text", file=pdf_file, seconds=round(writer.clean_seconds, 4))
+        print(f"Saved cleaned text to: {writer.path} ({timing['pages']} pages in {timing['seconds']}s)")
+    return timings
+
+# 2. Main Function to extract entities and entity pairs in a single NER pass
+def extract_entities_and_pairs_from_text_files(folder_path, entities_csv_path=None, pairs_csv_path=None, filenames=None,
+                                               batch_size=NER_BATCH_SIZE, n_process=NER_N_PROCESS, nlp=None,
+                                               sentence_window=PAIR_SENTENCE_WINDOW, token_window=PAIR_TOKEN_WINDOW,
+                                               aliases=None, chunk_chars=NER_CHUNK_CHARS, chunk_overlap=NER_CHUNK_OVERLAP):
+    """Runs spaCy NER once per document and builds both the entity table and the pair candidates from the same Doc.
+    Every mention is mapped to its canonical entity (aliases, an AliasIndex, default registry.get("aliases")), so
+    "Khan" and "Ahmad Khan" are one entity and one side of a pair. The entity table has one row per (file, canonical
+    entity, label) with its number of mentions in that file, its canonical ID and the other spellings it was seen as.
+    Only entities co-occurring within the sentence/token window are paired, see cooccurring_pairs.
+    Documents longer than chunk_chars are tagged in overlapping chunks (iter_document_chunks), each counting only the
+    mentions and pairs it owns, so the tables are the same as from whole documents."""
+    from persistence import ALIAS_SEPARATOR
+    if nlp is None:
+        nlp = registry.get("ner")
+    if aliases is None:
+        aliases = registry.get("aliases")
+    mention_counts = {}  # (file, entity, label) -> mentions, in order of first mention
+    canonical_ids = {}  # (file, entity, label) -> canonical ID
+    spellings = {}  # (file, entity, label) -> spellings that are not the canonical name
+    entity_pairs_data = []
+    document = None  # Pairs and counts of the document being read: {"file", "pairs", "first_seen", "tokens", ...}
+
+    def finish(document):
+        for (entity1, entity2), (count, evidence) in document["pairs"].items():
+            entity_pairs_data.append([entity1[0], entity1[1], entity2[0], entity2[1], "Unknown", document["file"], count, evidence])
+        trace("document_stage", stage="ner", file=document["file"], tokens=document["tokens"], entities=document["entities"],
+              chunks=document["chunks"])
+        trace("document_stage", stage="pair_generation", file=document["file"], pairs=len(document["pairs"]),
+              seconds=round(document["pair_seconds"], 4))
+
+    def tagged():
+        """(doc, (filename, owned_from, owned_to)): runs of short documents go through spaCy in batches instead of
+        nlp(text) per file, a long one chunk by chunk (where the next chunk starts depends on the last one's Doc)"""
+        names = [name for name in (sorted(os.listdir(folder_path)) if filenames is None else filenames) if name.endswith(".txt")]
+        for long, group in groupby(names, key=lambda name: os.path.getsize(os.path.join(folder_path, name)) > chunk_chars):
+            if not long:
+                texts = ((text, (filename, 0, len(text))) for text, filename in iter_text_files(folder_path, list(group)))
+                yield from nlp.pipe(texts, as_tuples=True, batch_size=batch_size, n_process=n_process)
+                continue
+            for filename in group:
+                for doc, owned_from, owned_to in iter_document_chunks(nlp, os.path.join(folder_path, filename), chunk_chars,
+                                                                      chunk_overlap, sentence_window, token_window):
+                    yield doc, (filename, owned_from, owned_to)
+
+    documents, ner_seconds, pair_seconds = 0, 0.0, 0.0
+    started = time.perf_counter()
+    for doc, (filename, owned_from, owned_to) in tagged():
+        ner_seconds += time.perf_counter() - started  # Time spent in nlp.pipe (batched, so per chunk only roughly)
+        if document is None or document["file"] != filename:
+            if document is not None:
+                finish(document)
+            documents += 1
+            document = {"file": filename, "pairs": {}, "first_seen": {}, "tokens": 0, "entities": 0, "chunks": 0,
+                        "pair_seconds": 0.0}
+        document["chunks"] += 1
+        document["tokens"] += sum(owned_from <= token.idx < owned_to for token in doc)
+        mentions = []  # ((entity, label), span) in document order, the overlap with the previous chunk included
+        for ent in doc.ents:
+            if ent.end_char > owned_to:
+                break  # The next chunk's
+            spelling = normalize_entity(ent)
+            if spelling is None:
+                continue
+            canonical_id, entity_text = aliases.canonical(spelling, ent.label_)
+            mentions.append(((entity_text, ent.label_), ent))
+            if ent.end_char <= owned_from:
+                continue  # Counted with the previous chunk
+            key = (filename, entity_text, ent.label_)
+            mention_counts[key] = mention_counts.get(key, 0) + 1
+            canonical_ids[key] = canonical_id
+            if spelling != entity_text:
+                spellings.setdefault(key, set()).add(spelling)
+            document["entities"] += 1
+
+        # Generate entity pairs from the same Doc
+        pairs_started = time.perf_counter()
+        pairs = document["pairs"]
+        for pair, (count, evidence) in cooccurring_pairs(doc, mentions, sentence_window, token_window, owned_from,
+                                                         document["first_seen"]).items():
+            if pair in pairs:
+                pairs[pair][0] += count
+            else:
+                pairs[pair] = [count, evidence]
+        document["pair_seconds"] += time.perf_counter() - pairs_started
+        pair_seconds += time.perf_counter() - pairs_started
+        started = time.perf_counter()
+    if document is not None:
+        finish(document)
+    record_stage("ner", ner_seconds, documents=documents, entities=sum(mention_counts.values()))
+    record_stage("pair_generation", pair_seconds, pairs=len(entity_pairs_data))
+
+    df = pd.DataFrame([[*key, count, canonical_ids[key], ALIAS_SEPARATOR.join(sorted(spellings.get(key, ())))]
+                       for key, count in mention_counts.items()], columns=ENTITY_COLUMNS)
+    df_pairs = pd.DataFrame(entity_pairs_data, columns=PAIR_COLUMNS)
+
+    if entities_csv_path:
+        write_table(df, entities_csv_path)
+        print(f"Entities extracted and saved to {entities_csv_path}")
+    if pairs_csv_path:
+        write_table(df_pairs, pairs_csv_path)
+        print(f"Entity pairs extracted and saved to {pairs_csv_path}")
+    return df, df_pairs
+
+# Main function 2a to extract entities only (kept for existing callers)
 def extract_entities_from_text_files(folder_path, output_csv_path):
-    nlp = spacy.load("en_core_web_sm")
-    entity_data = []
-
-    # Loop through all files in the folder
-    for filename in os.listdir(folder_path):
-        if filename.endswith(".txt"):
-            file_path = os.path.join(folder_path, filename)
-
-            # Read the content of the file
-            with open(file_path, "r", encoding="utf-8") as file:
-                text = file.read()
-
-            # Process the text with spaCy NLP model
-            doc = nlp(text)
-
-            # Extract and store entities for the current file
-            for ent in doc.ents:
-                entity_text = ent.text.replace('\n', ' ').strip()
-                entity_text = entity_text.title()  # Normalize capitalisation
-                if ent.label_ == "PERSON":
-                    words = entity_text.split()
-                    if len(words) > 2:
-                        entity_text = " ".join(words[:2])
-                if is_valid_entity(entity_text, ent.label_):
-                    entity_data.append([filename, entity_text, ent.label_])
-
-    # Create a DataFrame to organize the extracted data
-    df = pd.DataFrame(entity_data, columns=["File Name", "Entity", "Label"])
-    df = df.drop_duplicates()
-    df.to_csv(output_csv_path, index=False)
-    print(f"Entities extracted and saved to {output_csv_path}")
+    df, _ = extract_entities_and_pairs_from_text_files(folder_path, entities_csv_path=output_csv_path)
     return df
 
-
-# Main function 3 to extract entity pairs
+# Main function 3 to extract entity pairs only (kept for existing callers)
 def extract_entity_pairs_from_text_files(folder_path, output_csv_path):
-    nlp = spacy.load("en_core_web_sm")
-    print(folder_path)
-    entity_pairs_data = []
-
-    # Loop through all files in the folder
-    for filename in os.listdir(folder_path):
-        if filename.endswith(".txt"):
-            file_path = os.path.join(folder_path, filename)
-            print(file_path)
-
-            # Read the content of the file
-            with open(file_path, "r", encoding="utf-8") as file:
-                text = file.read()
-
-            # Process the text with spaCy NLP model
-            doc = nlp(text)
-
-            unique_entities = set()
-            for ent in doc.ents:
-                entity_text = ent.text.replace('\n', ' ').strip()
-                entity_text = entity_text.title()
-                if ent.label_ == "PERSON":
-                    words = entity_text.split()
-                    if len(words) > 2:
-                        entity_text = " ".join(words[:2])
-                if is_valid_entity(entity_text, ent.label_) and entity_text not in unique_entities:
-                    unique_entities.add((entity_text, ent.label_))
-
-            # Generate entity pairs
-            entity_pairs = list(combinations(unique_entities, 2))
-
-            # Add entity pairs to the list
-            for entity1, entity2 in entity_pairs:
-                entity_pairs_data.append([ entity1[0],  entity1[1], entity2[0], entity2[1],  "Unknown"])
-
-    df_pairs = pd.DataFrame(entity_pairs_data, columns=[ "Entity 1", "Type 1",  "Entity 2", "Type 2", "Relationship"])
-    df_pairs.to_csv(output_csv_path, index=False)
-    print(f"Entity pairs extracted and saved to {output_csv_path}")
+    _, df_pairs = extract_entities_and_pairs_from_text_files(folder_path, pairs_csv_path=output_csv_path)
+    return df_pairs
+
+# Relation prediction (REBEL) helpers
+def load_rebel_pipeline(model_name=REBEL_MODEL, backend=REBEL_BACKEND):
+    """Loads a new pipeline on the given inference backend; use registry.get("rebel") for the process-wide shared one"""
+    from rebel_backends import load_rebel_backend
+    return load_rebel_backend(model_name, backend)
+
+def build_relation_queries(df):
+    """Vectorised "<Entity 1> (<Type 1>) and <Entity 2> (<Type 2>) relationship" prompts for a pairs DataFrame"""
+    return (df["Entity 1"].astype(str) + " (" + df["Type 1"].astype(str) + ") and " +
+            df["Entity 2"].astype(str) + " (" + df["Type 2"].astype(str) + ") relationship")
+
+def parse_rebel_output(generated_text):
+    """Takes the last 1-2 lowercase words of a REBEL generation as the relation, None if there is no entity or relation"""
+    words = generated_text.split()  # Split text into words
+    # Identify entity (words with capitalized first letter)
+    entity_parts = [word for word in words if word[0].isupper()]
+    relation_parts = [word for word in words if word[0].islower()]  # Everything else is relation
+    if entity_parts and relation_parts:  # Ensure both entity and relation exist
+        return " ".join(relation_parts[-2:])  # Take last 1-2 words as relation
+    return None
+
+def predict_relations(queries, rebel_pipeline, batch_size=REBEL_BATCH_SIZE):
+    """Runs each distinct query once through the HF pipeline in padded batches, returns {query: relation or None}"""
+    unique_queries = sorted(set(queries), key=len)  # Similar lengths per batch means less padding
+    if not unique_queries:
+        return {}
+    started = time.perf_counter()
+    outputs = rebel_pipeline(unique_queries, batch_size=batch_size, max_length=REBEL_MAX_LENGTH, truncation=True)
+    record_stage("rebel", time.perf_counter() - started, generations=len(unique_queries))
+    relations = {}
+    for query, output in zip(unique_queries, outputs):
+        output = output[0] if isinstance(output, list) else output
+        relations[query] = parse_rebel_output(output["generated_text"])
+    return relations
+
+def extract_triplets(generated_text):
+    """Parses REBEL's linearised "<triplet> head <subj> tail <obj> relation" output into (head, relation, tail) tuples"""
+    triplets = []
+    head, tail, relation, current = "", "", "", None
+    for token in generated_text.replace("<s>", "").replace("<pad>", "").replace("</s>", "").split():
+        if token == "<triplet>":
+            if relation:
+                triplets.append((head.strip(), relation.strip(), tail.strip()))
+            head, tail, relation, current = "", "", "", "head"
+        elif token == "<subj>":
+            if relation:
+                triplets.append((head.strip(), relation.strip(), tail.strip()))
+            tail, relation, current = "", "", "tail"
+        elif token == "<obj>":
+            relation, current = "", "relation"
+        elif current == "head":
+            head += " " + token
+        elif current == "tail":
+            tail += " " + token
+        elif current == "relation":
+            relation += " " + token
+    if head and tail and relation:
+        triplets.append((head.strip(), relation.strip(), tail.strip()))
+    return triplets
+
+def predict_triplets(texts, rebel_pipeline, batch_size=REBEL_BATCH_SIZE):
+    """Runs each distinct text once through REBEL, returns {text: [(head, relation, tail), ...]}"""
+    unique_texts = sorted(set(texts), key=len)  # Similar lengths per batch means less padding
+    if not unique_texts:
+        return {}
+    started = time.perf_counter()
+    outputs = rebel_pipeline(unique_texts, batch_size=batch_size, max_length=REBEL_MAX_LENGTH, truncation=True,
+                             return_tensors=True, return_text=False)
+    record_stage("rebel", time.perf_counter() - started, generations=len(unique_texts))
+    # The triplet markup tokens are special tokens, so decode without skipping them
+    token_ids = [(output[0] if isinstance(output, list) else output)["generated_token_ids"] for output in outputs]
+    decoded = rebel_pipeline.tokenizer.batch_decode(token_ids, skip_special_tokens=False)
+    return {text: extract_triplets(generated) for text, generated in zip(unique_texts, decoded)}
+
+def relation_between(triplets, entity1, entity2):
+    """Relation of the first triplet linking the two entities (either direction), None if REBEL found none"""
+    entity1, entity2 = entity1.casefold(), entity2.casefold()
+
+    def mentions(argument, entity):
+        argument = argument.casefold()
+        return entity in argument or argument in entity
+
+    for head, relation, tail in triplets:
+        if (mentions(head, entity1) and mentions(tail, entity2)) or (mentions(head, entity2) and mentions(tail, entity1)):
+            return relation
+    return None
+
+class RebelComponent:
+    """Optional spaCy wrapper: sets doc._.rel = {sha1(relation): relation}, batching REBEL calls in nlp.pipe"""
+
+    def __init__(self, rebel_pipeline, batch_size=REBEL_BATCH_SIZE):
+        self.rebel_pipeline = rebel_pipeline
+        self.batch_size = batch_size
+        from spacy.tokens import Doc
+        if not Doc.has_extension("rel"):
+            Doc.set_extension("rel", default={})
+
+    def __call__(self, doc):
+        return next(self.pipe([doc]))
+
+    def pipe(self, docs, batch_size=None):
+        batch_size = batch_size or self.batch_size
+        docs = list(docs)
+        relations = predict_relations([doc.text for doc in docs], self.rebel_pipeline, batch_size)
+        for doc in docs:
+            relation = relations.get(doc.text)
+            doc._.rel = {hashlib.sha1(relation.encode()).hexdigest(): relation} if relation else {}
+            yield doc
+
+def add_rebel_to_spacy(nlp, rebel_pipeline, batch_size=REBEL_BATCH_SIZE):
+    """Adds REBEL as the last component of a spaCy pipeline, for callers that want Doc._.rel"""
+    from spacy.language import Language
+    if "rebel" not in Language.factories:
+        Language.factory("rebel", default_config={"batch_size": REBEL_BATCH_SIZE},
+                         func=lambda nlp, name, batch_size: RebelComponent(None, batch_size))
+    component = nlp.add_pipe("rebel", last=True, config={"batch_size": batch_size})
+    component.rebel_pipeline = rebel_pipeline  # Models cannot go through the spaCy config
+    return nlp
+
+def relation_inputs(df):
+    """(Unknown mask, has-evidence mask, synthetic query of every Unknown pair without evidence) of a pairs DataFrame"""
+    unknown = df["Relationship"] == "Unknown"
+    if "Evidence" in df.columns:
+        has_evidence = unknown & df["Evidence"].fillna("").astype(str).str.strip().ne("")
+    else:
+        has_evidence = pd.Series(False, index=df.index)
+    return unknown, has_evidence, build_relation_queries(df[unknown & ~has_evidence])
+
+def predict_unknown_relations(df, rebel_pipeline, batch_size=REBEL_BATCH_SIZE):
+    """Relations REBEL finds for the pairs still marked Unknown, as (Series indexed like df holding only the pairs it
+    found one for, number of distinct generations). Pairs with an evidence sentence are read from that sentence (one
+    generation per distinct sentence), the others fall back to the synthetic "<Entity 1> and <Entity 2> relationship"
+    prompt."""
+    _, has_evidence, queries = relation_inputs(df)
+    relations = predict_relations(queries, rebel_pipeline, batch_size)
+    found = queries.map(relations)
+
+    evidence = df.loc[has_evidence].reindex(columns=["Entity 1", "Entity 2", "Evidence"])  # Older pair CSVs have no Evidence
+    triplets = predict_triplets(evidence["Evidence"], rebel_pipeline, batch_size)
+    found_in_evidence = pd.Series([relation_between(triplets[text], entity1, entity2) for entity1, entity2, text
+                                   in evidence.itertuples(index=False, name=None)], index=evidence.index, dtype=object)
+    found = pd.concat([found, found_in_evidence])
+    return found[found.notna()], len(relations) + len(triplets)
 
 # Main function 4 to predict relationships between entities
-def predict_relationships_from_entity_pairs(entity_pairs_csv, output_csv_path):
-    """Predict relationships from entity pairs using the REBEL model and save results to a CSV."""
-    # Define DEVICE variable
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    # Load Rebel model from Hugging Face
-    rebel_pipeline = pipeline("text2text-generation", model="Babelscape/rebel-large", device=0 if torch.cuda.is_available() else -1)
-    # Register custom spaCy extension
-    if not Doc.has_extension("rel"):
-        Doc.set_extension("rel", default={})
-
-    def call_wiki_api(item):
-        """Fetches Wikidata ID for an entity."""
-        try:
-            url = f"https://www.wikidata.org/w/api.php?action=wbsearchentities&search={item}&language=en&format=json"
-            data = requests.get(url).json()
-            return data['search'][0]['id']
-        except:
-            return 'id-less'
-
-    def set_annotations(doc: Doc, triplets: List[Dict]):
-        """Annotates document with extracted relationships."""
-        for triplet in triplets:
-            if triplet['head'] == triplet['tail']:
-                continue  # Remove self-loops
-            head_span = re.search(triplet["head"], doc.text)
-            tail_span = re.search(triplet["tail"], doc.text)
-            if not head_span or not tail_span:
-                continue
-            index = hashlib.sha1("".join([triplet['head'], triplet['tail'], triplet['type']]).encode('utf-8')).hexdigest()
-            if index not in doc._.rel:
-                doc._.rel[index] = {
-                    "relation": triplet["type"],
-                    "head_span": {'text': triplet['head'], 'id': call_wiki_api(triplet['head'])},
-                    "tail_span": {'text': triplet['tail'], 'id': call_wiki_api(triplet['tail'])}
-                }
-
-    # Load spaCy model
-    nlp = spacy.load('en_core_web_sm', disable=['ner', 'lemmatizer', 'attribute_rules', 'tagger'])
-
-    @Language.component("rebel")
-    def rebel_component(doc):
-        text = doc.text
-        results = rebel_pipeline(text, max_length=512, truncation=True)
-        
-        extracted_relations = {}
-
-        for result in results:
-            words = result["generated_text"].split()  # Split text into words
-
-            # Identify entity (words with capitalized first letter)
-            entity_parts = [word for word in words if word[0].isupper()]
-            relation_parts = [word for word in words if word[0].islower()]  # Everything else is relation
-
-            if entity_parts and relation_parts:  # Ensure both entity and relation exist
-                entity = " ".join(entity_parts)
-                relation = " ".join(relation_parts[-2:])  # Take last 1-2 words as relation
-
-                relation_hash = hashlib.sha1(relation.encode()).hexdigest()
-                extracted_relations[relation_hash] = relation
-                print(extracted_relations)
-
-        doc._.rel = extracted_relations # Store extracted relations in the spaCy doc
-        return doc
-
-    # Add the custom component to spaCy
-    nlp.add_pipe("rebel", last=True)
-
-    def load_csv(file_path):
-        """Loads entity pairs from a CSV file."""
-        df = pd.read_csv(file_path)
+def predict_relationships_from_entity_pairs(entity_pairs, output_path=None, rebel_pipeline=None, batch_size=REBEL_BATCH_SIZE,
+                                            workers=REBEL_WORKERS):
+    """Predict relationships from entity pairs (a DataFrame, or a CSV / columnar file of them) using the REBEL model,
+    and save the results to output_path if given (in the format of its extension, see columnar_store.py).
+    With workers > 1 (and no rebel_pipeline passed) the pairs are sharded across that many model processes."""
+
+    def load_pairs(pairs):
+        """Loads entity pairs from a file, or takes a copy of a DataFrame of them."""
+        df = read_table(pairs) if isinstance(pairs, str) else pairs.copy()
         print(f"Original columns: {df.columns.tolist()}")  # Debugging check
-        # Ensure we only have the correct 5 columns
+        # Ensure we only have the correct 5 columns (plus the source file and co-occurrence evidence, if the pairs carry them)
+        extra = [column for column in PAIR_COLUMNS[5:] if column in df.columns[5:]]
+        kept = df[extra]
         df = df.iloc[:, :5]
-        df.columns = ["Entity 1", "Type 1", "Entity 2", "Type 2", "Relationship"]
-        return df
+        df.columns = PAIR_COLUMNS[:5]
+        return pd.concat([df, kept], axis=1)
 
     def extract_relationships(df):
-        """Uses Rebel to extract relationships for given entity pairs."""
-        
-        for index, row in df.iterrows():
-            entity1, type1, entity2, type2, relationship = row["Entity 1"], row["Type 1"], row["Entity 2"], row["Type 2"], row["Relationship"]
-            
-            if relationship == "Unknown":
-                wiki_id1 = call_wiki_api(entity1)
-                wiki_id2 = call_wiki_api(entity2)
-                
-                query_text = f"{entity1} ({type1}) and {entity2} ({type2}) relationship"
-                doc = nlp(query_text)
-                
-                if doc._.rel:
-                    found_relationship = list(doc._.rel.values())[0]
-                    print(f"Found relation: {found_relationship}")
-                    
-                    # Update dataframe
-                    df.at[index, "Relationship"] = found_relationship  
-
+        """Uses Rebel to extract relationships for the pairs still marked Unknown: one batched run for all of them, or
+        shards of them across REBEL_WORKERS processes (see relation_workers.py)."""
+        started = time.perf_counter()
+        unknown, has_evidence, queries = relation_inputs(df)
+        sharded = workers > 1 and rebel_pipeline is None and unknown.any()
+        if sharded:
+            found, generations = registry.get("rebel_workers").predict(df, batch_size)
+        else:
+            found, generations = predict_unknown_relations(df, rebel_pipeline or registry.get("rebel"), batch_size)
+        df.loc[found.index, "Relationship"] = found  # Update dataframe
+
+        seconds = time.perf_counter() - started
+        record_items("rebel", pairs=int(unknown.sum()), relations=len(found))
+        if tracing() and "File Name" in df.columns:  # Which documents the generations were spent on
+            texts = queries.reindex(df.index)
+            if "Evidence" in df.columns:
+                texts = texts.fillna(df["Evidence"].where(has_evidence))
+            for filename, group in texts[unknown].groupby(df.loc[unknown, "File Name"]):
+                trace("document_stage", stage="rebel", file=filename, pairs=len(group), generations=group.nunique())
+        df.attrs["relation_stats"] = {
+            "pairs": int(unknown.sum()),
+            "unique_queries": generations,
+            "evidence_pairs": int(has_evidence.sum()),
+            "relations_found": len(found),
+            "workers": workers if sharded else 1,
+            "seconds": round(seconds, 4),
+            "pairs_per_second": round(int(unknown.sum()) / seconds, 2) if seconds else None,
+        }
+        print(f"Relation prediction: {df.attrs['relation_stats']}")
         return df
 
-
     # Load data and process relationships
-    df = load_csv(entity_pairs_csv)
+    df = load_pairs(entity_pairs)
     df = extract_relationships(df)
     print(df.head())
     # Save updated data
-    df.to_csv(output_csv_path, index=False)
-    print(f"Updated relationships saved to {output_csv_path}")
-    return df
\ No newline at end of file
+    if output_path:
+        write_table(df, output_path)
+        print(f"Updated relationships saved to {output_path}")
+    return df
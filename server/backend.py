@@ -1,41 +1,46 @@
 from bson import ObjectId
-from nanoid import generate
-from flask import Flask, request, jsonify
-import pandas as pd
+from flask import Flask, Response, g, request, jsonify
 from werkzeug.utils import secure_filename
-from pymongo import MongoClient
-from pymongo.server_api import ServerApi
 from dotenv import load_dotenv
 import os
 import fitz  # PyMuPDF
-import spacy
 import uuid
 from datetime import datetime
-from Functions import extract_entity_pairs_from_text_files, extract_text_from_directory, extract_entities_from_text_files, predict_relationships_from_entity_pairs
 import shutil
 from flask_cors import CORS
+from manifest import IngestionManifest, STAGES, hash_bytes
+from ingestion import run_ingestion
+from jobs import JobQueue
+from search_index import SORT_ORDERS, EntitySearchIndex
+from pagination import list_response
+from entity_linking import WikidataLinker
+from entity_stats import ensure_stats_indexes, update_entity_stats
+from persistence import ensure_indexes, entity_name_query, link_entities_and_relationships, persist_entries, relationships_by_entity_query
+from graph import RelationshipGraph
+from graph_view import ViewCache, build_view
+from resources import registry
+from metrics import CONTENT_TYPE, REQUEST_SECONDS, registry as metrics_registry
+from response_cache import DataVersion, ResponseCache
+import pymongo
+import argparse
+import threading
+import time
 
 # Load environment variables
 load_dotenv()
 app = Flask(__name__)
 CORS(app)  # <--- This allows cross-origin requests for all routes
 
-# MongoDB Setup
-MONGO_URI = os.getenv("MONGO_URI")
-client = MongoClient(MONGO_URI, server_api=ServerApi('1'))
-try:
-    client.admin.command('ping')
-    print("Pinged your deployment. You successfully connected to MongoDB!")
-except Exception as e:
-    print(e)
-
+# MongoDB Setup (the client connects in the background; the ping and index creation run in the startup thread below)
+client = registry.get("mongo")
 db = client["aka_datathon"]
 files_collection = db["PDFFiles"]
 entities_collection = db["Entities"]
 relationship_collection = db["Relationships"]
+entity_stats_collection = db["EntityStats"]  # Per-entity mention/document counts, see entity_stats.py
+cooccurrence_collection = db["EntityCooccurrences"]
 
-# NLP Model
-nlp = spacy.load("en_core_web_sm")
+# NLP models (spaCy NER, REBEL) are loaded from the resource registry on first use, or at startup with --preload
 
 # Define a base directory for storage
 BASE_DIR = os.path.abspath("./LocalDB")
@@ -43,34 +48,221 @@ BASE_DIR = os.path.abspath("./LocalDB")
 # Define folder paths
 UPLOAD_FOLDER = os.path.join(BASE_DIR, "uploads")
 OUTPUT_FOLDER_TXT = os.path.join(BASE_DIR, "output_txt")
+CACHE_FOLDER = os.path.join(BASE_DIR, "cache")  # Per-document stage results, keyed by content hash
+JOB_STATE_FOLDER = os.path.join(BASE_DIR, "job_state")  # Job status shared between server worker processes
+METRICS_FOLDER = os.path.join(BASE_DIR, "metrics")  # Metric values shared between server worker processes
+DATA_VERSION_PATH = os.path.join(BASE_DIR, "data_version.json")  # Change counters shared between server worker processes
 
 # Define file paths
-OUTPUT_FOLDER_CSV_ENTITIES = os.path.join(BASE_DIR, "entity.csv")
-OUTPUT_FOLDER_CSV_ENTITIES_PAIR = os.path.join(BASE_DIR, "entitypairs.csv")
-OUTPUT_FOLDER_CSV_COMPLETE = os.path.join(BASE_DIR, "entitypairsComplete.csv")
+MANIFEST_PATH = os.path.join(BASE_DIR, "manifest.sqlite3")
+WIKIDATA_CACHE_PATH = os.path.join(BASE_DIR, "wikidata_cache.sqlite3")
 
 # Ensure necessary folders exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(OUTPUT_FOLDER_TXT, exist_ok=True)
+os.makedirs(CACHE_FOLDER, exist_ok=True)
 
 # Configure Flask app paths
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
 app.config["OUTPUT_FOLDER_TXT"] = OUTPUT_FOLDER_TXT
+app.config["CACHE_FOLDER"] = CACHE_FOLDER
+
+# Ingestion manifest (content hash -> finished stages)
+manifest = IngestionManifest(MANIFEST_PATH)
+PIPELINE_FOLDERS = {
+    "uploads": UPLOAD_FOLDER,
+    "output_txt": OUTPUT_FOLDER_TXT,
+    "cache": CACHE_FOLDER,  # Stage results per document, in the columnar format of columnar_store.py
+}
+
+# Wikidata IDs of stored entities (set WIKIDATA_LINKING=0 to skip the lookups)
+WIKIDATA_LINKING = os.getenv("WIKIDATA_LINKING", "1") != "0"
+wikidata_linker = WikidataLinker(WIKIDATA_CACHE_PATH) if WIKIDATA_LINKING else None
+
+# Data version: counters of stored documents / uploaded files, shared by all server processes (see response_cache.py).
+# The read routes are cached per version, and a process rebuilds its search index and graph when another process
+# stored documents since it built them
+data_version = DataVersion(DATA_VERSION_PATH)
+response_cache = ResponseCache(data_version)
+indexes_version = None  # "documents" version the search index and graph reflect, None until they are first built
+index_lock = threading.Lock()  # An ingestion updating the in-memory indexes vs. rebuilt ones being swapped in
+index_refresh = threading.Lock()  # Held while a rebuild runs
+
+# Entity name search index, built from the Entities collection in the background and updated after each ingestion
+search_index = EntitySearchIndex()
+SEARCH_INDEX_FIELDS = {"_id": 0, "entity": 1, "label": 1, "file_id": 1, "frequency": 1}
+
+def check_mongo():
+    try:
+        client.admin.command('ping')
+        print("Pinged your deployment. You successfully connected to MongoDB!")
+    except Exception as e:
+        print(e)
+    try:
+        ensure_indexes(entities_collection, relationship_collection)
+        ensure_stats_indexes(entity_stats_collection, cooccurrence_collection)
+    except Exception as e:
+        print(f"Could not create indexes: {e}")
+
+search_index_ready = threading.Event()
+
+def build_search_index():
+    try:
+        count = search_index.build(entities_collection.find({}, SEARCH_INDEX_FIELDS))
+        print(f"Search index built with {count} entities")
+        search_index_ready.set()
+    except Exception as e:
+        print(f"Could not build search index: {e}")
+
+# Relationship graph (integer IDs + CSR adjacency), built from the Relationships collection and updated after each ingestion
+relationship_graph = RelationshipGraph()
+graph_ready = threading.Event()
+view_cache = ViewCache()  # Laid-out /graph/view responses
+GRAPH_FIELDS = {"_id": 0, "entity_1_name": 1, "entity_1_type": 1, "entity_2_name": 1, "entity_2_type": 1, "relationship": 1}
 
-def cleanup_folders(folders):
-    """Deletes all files in the specified folders"""
+def build_graph():
+    try:
+        edges = relationship_graph.build(relationship_collection.find({}, GRAPH_FIELDS))
+        print(f"Relationship graph built with {len(relationship_graph)} entities and {edges} edges")
+        graph_ready.set()
+    except Exception as e:
+        print(f"Could not build relationship graph: {e}")
+
+def startup():
+    global indexes_version
+    check_mongo()
+    version = data_version.current().get("documents", 0)  # Before reading, so documents stored meanwhile count as newer
+    build_search_index()
+    build_graph()
+    if search_index_ready.is_set() and graph_ready.is_set():
+        indexes_version = version
+
+def refresh_indexes(version):
+    """Rebuilds this process' search index and graph from MongoDB and swaps them in; runs in the background while
+    the current ones keep answering"""
+    global search_index, relationship_graph, indexes_version
+    try:
+        fresh_index, fresh_graph = EntitySearchIndex(), RelationshipGraph()
+        fresh_index.build(entities_collection.find({}, SEARCH_INDEX_FIELDS))
+        fresh_graph.version = relationship_graph.version  # Keeps /graph/view cache keys increasing
+        fresh_graph.build(relationship_collection.find({}, GRAPH_FIELDS))
+        with index_lock:
+            search_index, relationship_graph = fresh_index, fresh_graph
+            view_cache.clear()
+            indexes_version = version
+        print(f"Search index and relationship graph rebuilt at data version {version}")
+    except Exception as e:
+        print(f"Could not rebuild search index and graph: {e}")
+    finally:
+        index_refresh.release()
+
+threading.Thread(target=startup, daemon=True).start()
+
+# Background ingestion jobs
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", 2))
+job_queue = JobQueue(max_workers=JOB_CONCURRENCY, state_folder=JOB_STATE_FOLDER)
+in_flight = {}  # sha256 -> job_id of the job currently ingesting it
+in_flight_lock = threading.Lock()
+
+def cleanup_folders(folders, manifest=None):
+    """Deletes all files in the specified folders, except cached results the manifest still considers valid"""
+    keep = manifest.valid_paths() if manifest else set()
     for folder in folders:
         if os.path.exists(folder):
             for file in os.listdir(folder):
-                file_path = os.path.join(folder, file)
+                file_path = os.path.abspath(os.path.join(folder, file))
+                if file_path in keep:
+                    continue
                 try:
                     if os.path.isfile(file_path) or os.path.islink(file_path):
                         os.unlink(file_path)  # Delete file
                     elif os.path.isdir(file_path):
-                        shutil.rmtree(file_path)  # Delete folder
+                        if any(path.startswith(file_path + os.sep) for path in keep):
+                            cleanup_folders([file_path], manifest)  # Folder still holds valid results
+                        else:
+                            shutil.rmtree(file_path)  # Delete folder
                 except Exception as e:
                     print(f"Failed to delete {file_path}: {e}")
 
+def unique_upload_path(filename, sha256):
+    """Keeps an existing document's PDF when a different file is uploaded under the same name"""
+    existing = manifest.find_by_filename(filename)
+    if existing and existing["sha256"] != sha256:
+        stem, ext = os.path.splitext(filename)
+        filename = f"{stem}-{sha256[:8]}{ext}"
+    return os.path.join(app.config['UPLOAD_FOLDER'], filename)
+
+def store_document(document, entities, relationships):
+    """Saves one document's extracted entities and relationships in MongoDB"""
+    wikidata_ids = wikidata_linker.resolve(entities["Entity"]) if wikidata_linker else None
+    entity_entries, relationship_entries = link_entities_and_relationships(document, entities, relationships, wikidata_ids)
+    new_entity_ids = set()
+    summary = persist_entries(entity_entries, relationship_entries, entities_collection, relationship_collection,
+                              new_entity_ids=new_entity_ids)
+    # Counts only what this store added, so a document stored twice is not counted twice
+    new_entries = [entry for entry in entity_entries if entry["_id"] in new_entity_ids]
+    summary["stats"] = update_entity_stats(new_entries, relationships, entity_stats_collection, cooccurrence_collection)
+    global indexes_version
+    with index_lock:
+        relationship_graph.add_relationships(relationship_entries)
+        view_cache.clear()  # Views may now have new nodes, edges or file memberships
+        search_index.add_entities({"entity": entry["entity"], "label": entry["label"], "file_id": entry["file_id"],
+                                   "frequency": entry["frequency"] if entry["_id"] in new_entity_ids else 0}
+                                  for entry in entity_entries)
+        previous, current = data_version.bump("documents")  # Cached responses of every process are now stale
+        if indexes_version == previous:  # Nothing else was stored in between: this process' indexes are current
+            indexes_version = current
+    return summary
+
+# Metrics: pipeline stage timings, cache hit ratios and per-route latency, in the Prometheus text format on /metrics
+metrics_registry.share(METRICS_FOLDER)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.before_request
+def refresh_stale_indexes():
+    """Starts a background rebuild when another server process stored documents since this one built its indexes"""
+    version = data_version.current().get("documents", 0)
+    if indexes_version is not None and version != indexes_version and index_refresh.acquire(blocking=False):
+        threading.Thread(target=refresh_indexes, args=(version,), daemon=True).start()
+
+@app.after_request
+def record_request_latency(response):
+    """Latency per route pattern (not per URL, so /graph/neighbors/<entity> is one series); streamed bodies until the headers"""
+    started = g.pop("request_started", None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "<unmatched>"
+        REQUEST_SECONDS.observe(time.perf_counter() - started, method=request.method, route=route, status=response.status_code)
+    return response
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    return Response(metrics_registry.render(), content_type=CONTENT_TYPE)
+
+# Health checks: /healthz = the process is up, /readyz = it can serve requests
+READY_TIMEOUT = float(os.getenv("READY_TIMEOUT", 2))  # Seconds the Mongo ping may take
+PRELOAD_MODELS = [name for name in os.getenv("PRELOAD_MODELS", "").split(",") if name]  # Set by serve.py
+
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    return jsonify({"status": "ok"})
+
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    checks = {"search_index": search_index_ready.is_set(), "graph": graph_ready.is_set()}
+    try:
+        with pymongo.timeout(READY_TIMEOUT):
+            client.admin.command('ping')
+        checks["mongo"] = True
+    except Exception:
+        checks["mongo"] = False
+    for name in PRELOAD_MODELS:
+        checks[name] = registry.is_loaded(name)
+    ready = all(checks.values())
+    return jsonify({"ready": ready, "checks": checks, "resources": registry.status()}), 200 if ready else 503
+
 # API Endpoint: Upload PDF
 @app.route("/upload", methods=["POST"])
 def upload_file():
@@ -80,120 +272,128 @@ def upload_file():
     if not files:
         return jsonify({"error": "No selected files"}), 400
     uploaded_files_info = []
+    documents = []
     for file in files:
         if file.filename == "":
             continue
         filename = secure_filename(file.filename)
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(file_path)
-        # Extract text from PDF to get the number of pages
-        with fitz.open(file_path) as doc:
-            num_pages = len(doc)
-        # Save file info in MongoDB
-        file_id = str(uuid.uuid4())
-        file_entry = {
-            "_id": file_id,
-            "filename": filename,
-            "filepath": file_path,
-            "upload_time": datetime.now(),
-            "pages": num_pages
-        }
-        files_collection.insert_one(file_entry)
+        data = file.read()
+        sha256 = hash_bytes(data)
+        document = manifest.get_document(sha256)
+        if document is None:
+            file_path = unique_upload_path(filename, sha256)
+            with open(file_path, "wb") as f:
+                f.write(data)
+            # Extract text from PDF to get the number of pages
+            with fitz.open(file_path) as doc:
+                num_pages = len(doc)
+            # Save file info in MongoDB
+            file_id = str(uuid.uuid4())
+            file_entry = {
+                "_id": file_id,
+                "filename": filename,
+                "filepath": file_path,
+                "sha256": sha256,
+                "upload_time": datetime.now(),
+                "pages": num_pages
+            }
+            files_collection.insert_one(file_entry)
+            data_version.bump("files")
+            document = manifest.register_document(sha256, file_id, filename, file_path, num_pages)
+        elif not os.path.exists(document["pdf_path"]):
+            with open(document["pdf_path"], "wb") as f:  # Restore a known document whose PDF was removed
+                f.write(data)
         uploaded_files_info.append({
-            "file_id": file_id,
-            "filename": filename,
-            "pages": num_pages
+            "file_id": document["file_id"],
+            "filename": document["filename"],
+            "pages": document["pages"],
+            "sha256": sha256,
+            "already_ingested": manifest.is_complete(sha256),
+            "job_id": None
         })
-    # # Extract entities from uploaded files (ACTUAL - UNCOMMENT LATER)
-    # extract_text_from_directory(app.config['UPLOAD_FOLDER'], app.config['OUTPUT_FOLDER_TXT'])
-    # # Extract entities
-    # print(app.config['OUTPUT_FOLDER_TXT'])
-    # print(OUTPUT_FOLDER_CSV_ENTITIES)
-    # entities = extract_entities_from_text_files(app.config['OUTPUT_FOLDER_TXT'], OUTPUT_FOLDER_CSV_ENTITIES)
-    # extract_entity_pairs_from_text_files(app.config['OUTPUT_FOLDER_TXT'], OUTPUT_FOLDER_CSV_ENTITIES_PAIR)
-    # relationships = predict_relationships_from_entity_pairs(OUTPUT_FOLDER_CSV_ENTITIES_PAIR, OUTPUT_FOLDER_CSV_COMPLETE)
-    
-   #Use Preloaded CSV files (test)
-    entities = pd.read_csv(OUTPUT_FOLDER_CSV_ENTITIES)
-    relationships = pd.read_csv(OUTPUT_FOLDER_CSV_COMPLETE)
-
-    entities.head()
-    relationships.head()
-
-
-     # Save extracted entities in MongoDB
-    # Convert DataFrames to lists of dictionaries for easier processing
-    entities_list = entities.to_dict(orient="records")
-    relationships_list = relationships.to_dict(orient="records")
-
-    # Process entities and relationships
-    for entity in entities_list:
-        # Create a list to store relationship IDs for this entity
-        relationship_ids = []
-
-        # Iterate through all relationships to find those related to this entity
-        for relation in relationships_list:
-            # Check if the current entity is involved in the relationship (as Entity 1 or Entity 2)
-            if entity["Entity"] == relation["Entity 1"] or entity["Entity"] == relation["Entity 2"]:
-                # Generate a unique ID for the relationship
-                full_uuid = str(uuid.uuid4())
-                relationship_id = generate(size=8)  # Generate an 8-character ID  
-                relationship_ids.append(relationship_id)
-
-                # Insert the relationship entry into the relationship_collection
-                relationship_entry = {
-                    "_id": relationship_id,
-                    "entity_1_name": relation["Entity 1"],
-                    "entity_1_type": relation["Type 1"],
-                    "entity_2_name": relation["Entity 2"],
-                    "entity_2_type": relation["Type 2"],
-                    "relationship": relation["Relationship"]
-                }
-                relationship_collection.insert_one(relationship_entry)
-
-        # Create the entity_entry with the relationships array
-        entity_entry = {
-            "_id": str(uuid.uuid4()),
-            "file_id": file_id,
-            "file_name": entity["File Name"],
-            "entity": entity["Entity"],
-            "label": entity["Label"],
-            "frequency": 0,  # You can calculate frequency later if needed
-            "relationships": relationship_ids  # Array of relationship IDs
-        }
-
-        # Insert the entity_entry into the entities_collection
-        entities_collection.insert_one(entity_entry)
-    
+        if not uploaded_files_info[-1]["already_ingested"] and all(d["sha256"] != sha256 for d in documents):
+            documents.append(document)
+
+    # Queue the new documents; ones another job is already ingesting are reported with that job instead
+    job_id = None
+    with in_flight_lock:
+        queued = [d for d in documents if d["sha256"] not in in_flight]
+        if queued:
+            job_id = job_queue.submit(ingest_documents, queued, stages=STAGES,
+                                      metadata={"files": [d["filename"] for d in queued]})
+            for document in queued:
+                in_flight[document["sha256"]] = job_id
+        for info in uploaded_files_info:
+            if not info["already_ingested"]:
+                info["job_id"] = in_flight.get(info["sha256"], job_id)
+
     return jsonify({
         "message": "Files uploaded successfully",
-        "files": uploaded_files_info
-    })
+        "files": uploaded_files_info,
+        "job_id": job_id
+    }), 202 if job_id else 200
+
+def ingest_documents(documents, progress=None):
+    """Job body: runs the pipeline for the documents; stages only write the partitions of these documents"""
+    try:
+        return run_ingestion(documents, manifest, PIPELINE_FOLDERS, store_document, nlp=registry.get("ner"),
+                             progress=progress)
+    finally:
+        with in_flight_lock:
+            for document in documents:
+                in_flight.pop(document["sha256"], None)
+
+# API Endpoint: Get an ingestion job's progress
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({"error": f"No job found with ID '{job_id}'"}), 404
+    return jsonify({"job": job})
+
+# API Endpoint: List recent ingestion jobs (optionally ?status=running)
+@app.route("/jobs", methods=["GET"])
+def list_jobs():
+    return jsonify({"jobs": job_queue.list(request.args.get("status"))})
 
 # API Endpoint: Get Extracted Entities by file_id
 @app.route("/entities/file/<file_id>", methods=["GET"])
+@response_cache.cached
 def get_entities_by_file_id(file_id):
     entities = list(entities_collection.find({"file_id": file_id}, {"_id": 0}))
     return jsonify({"file_id": file_id, "entities": entities})
 
-# API Endpoint: Get all people entities
+# API Endpoint: Get all people entities (paginated with ?after=&limit=, see pagination.py)
+# ?sort=frequency lists one aggregate EntityStats document per person instead, most mentioned first
 @app.route("/entities/people", methods=["GET"])
+@response_cache.cached
 def get_people_entities():
-    people_entities = list(entities_collection.find({"label": "PERSON"}, {"_id": 0}))
-    return jsonify({"people_entities": people_entities})
+    if request.args.get("sort") == "frequency":
+        return list_response(entity_stats_collection, {"label": "PERSON"}, "people_entities", sort_field="mentions")
+    return list_response(entities_collection, {"label": "PERSON"}, "people_entities")
+
+# API Endpoint: Aggregate stats of an entity (mentions, documents, first/last seen, top co-occurring), one per label
+@app.route("/entities/stats/<entity_name>", methods=["GET"])
+@response_cache.cached
+def get_entity_stats(entity_name):
+    stats = list(entity_stats_collection.find(entity_name_query(entity_name), {"_id": 0}).sort("mentions", -1))
+    if not stats:
+        return jsonify({"message": f"No stats found for '{entity_name}'"}), 404
+    return jsonify({"entity_name": entity_name, "stats": stats})
 
 @app.route("/entities", methods=["GET"])
+@response_cache.cached
 def get_entities():
-    entities = list(entities_collection.find({}, {"_id": 0}))
-    return jsonify({"entities": entities})
+    return list_response(entities_collection, {}, "entities")
 
 @app.route("/entities/name/<entity_name>", methods=["GET"])
+@response_cache.cached
 def get_entities_by_entity_name(entity_name):
     if not entity_name:
         return jsonify({"error": "Entity name is required"}), 400
     try:
         entities = list(entities_collection.find(
-            {"entity": {"$regex": f"^{entity_name}$", "$options": "i"}},  # Case-insensitive search
+            entity_name_query(entity_name),  # Case-insensitive exact match on the indexed entity_norm key
             {"_id": 0}
         ))
         if not entities:
@@ -204,12 +404,13 @@ def get_entities_by_entity_name(entity_name):
 
 # API Endpoint: List Uploaded Files
 @app.route("/files", methods=["GET"])
+@response_cache.cached
 def list_files():
-    files = list(files_collection.find({}, {"_id": 0, "text": 0}))
-    return jsonify({"files": files})
+    return list_response(files_collection, {}, "files", excluded_fields=("text",))
 
 # API Endpoint: Get file by File_name
 @app.route("/files/<file_name>", methods=["GET"])
+@response_cache.cached
 def get_file_by_file_name(file_name):
     file = files_collection.find_one({"filename": file_name}, {"_id": 0, "text": 0})
     if file:
@@ -217,29 +418,42 @@ def get_file_by_file_name(file_name):
     else:
         return jsonify({"error": "File not found"}), 404
 
+def int_arg(name, default, low, high):
+    """Integer query parameter clamped to [low, high]; raises ValueError when it is not an integer"""
+    return max(low, min(int(request.args.get(name, default)), high))
+
+SEARCH_MAX_LIMIT = 100
+SEARCH_MAX_OFFSET = 10000  # Deeper pages would rank offset + limit candidates per request
+
 # API Endpoint: search for specific entities across all files
 @app.route("/api/entities/search", methods=["GET"])
 def search_entities():
-    """Search for specific entities in the database based on a query term."""
+    """Search for specific entities based on a query term (prefix, substring or close spelling), ranked by match
+    quality then frequency, or by frequency alone with ?sort=frequency."""
     query = request.args.get("query", "").strip()
     if not query:
         return jsonify({"error": "Query parameter is required"}), 400
-    # Case-insensitive search for entities containing the query
-    results = list(entities_collection.find(
-        {"entity_text": {"$regex": query, "$options": "i"}},  # Case-insensitive regex search
-        {"_id": 0, "file_id": 1, "filename": 1, "entity_text": 1, "label": 1, "frequency": 1}
-    ))
-    return jsonify({"query": query, "results": results})
+    try:
+        limit = int_arg("limit", 20, 1, SEARCH_MAX_LIMIT)
+        offset = int_arg("offset", 0, 0, SEARCH_MAX_OFFSET)
+    except ValueError:
+        return jsonify({"error": "limit and offset must be integers"}), 400
+    sort = request.args.get("sort", "relevance")
+    if sort not in SORT_ORDERS:
+        return jsonify({"error": f"sort must be one of {', '.join(SORT_ORDERS)}"}), 400
+    results = search_index.search(query, limit=limit, offset=offset, label=request.args.get("label"), sort=sort)
+    return jsonify({"query": query, "limit": limit, "offset": offset, "sort": sort, "results": results})
 
 # Get all relationships (new)
 @app.route("/relationships", methods=["GET"])
+@response_cache.cached
 def get_all_relationships():
-    # Fetch all relationships from the relationships collection
-    relationships = list(relationship_collection.find({}, {"_id": 0}))  
-    return jsonify({"relationships": relationships})
+    # Stream or page through the relationships collection
+    return list_response(relationship_collection, {}, "relationships")
 
 # Get relationships by relationship ID (new)
 @app.route("/relationships/<relationship_id>", methods=["GET"])
+@response_cache.cached
 def get_relationship_by_id(relationship_id):
     if not relationship_id:
         return jsonify({"error": "Relationship ID is required"}), 400
@@ -258,18 +472,14 @@ def get_relationship_by_id(relationship_id):
 
 # Get relationships if its in entity 1 or 2 (new) 
 @app.route("/relationships/entity/<entity_name>", methods=["GET"])
+@response_cache.cached
 def get_relationships_by_entity(entity_name):
     if not entity_name:
         return jsonify({"error": "Entity name is required"}), 400
     try:
         # Find relationships where the entity appears in either 'entity_1' or 'entity_2'
         relationships = list(relationship_collection.find(
-            {
-                "$or": [
-                    {"entity_1_name": {"$regex": f"^{entity_name}$", "$options": "i"}},  # Case-insensitive search for entity_1
-                    {"entity_2_name": {"$regex": f"^{entity_name}$", "$options": "i"}}   # Case-insensitive search for entity_2
-                ]
-            },
+            relationships_by_entity_query(entity_name),  # Indexed, case-insensitive match on entity_1_norm / entity_2_norm
             {"_id": 0}  # Exclude the _id field in the response
         ))
         if not relationships:
@@ -278,5 +488,108 @@ def get_relationships_by_entity(entity_name):
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# Graph queries, answered from the in-memory relationship graph
+GRAPH_MAX_HOPS = 3
+GRAPH_MAX_NODES = 2000
+GRAPH_MAX_PATH_HOPS = 10
+
+@app.route("/graph/neighbors/<entity_name>", methods=["GET"])
+def get_graph_neighbors(entity_name):
+    """Entities within ?hops= (1-3) edges of an entity, closest first, with the edges among them"""
+    graph = relationship_graph  # A rebuilt graph may be swapped in meanwhile, this request stays on one
+    try:
+        hops = int_arg("hops", 1, 1, GRAPH_MAX_HOPS)
+        limit = int_arg("limit", 200, 1, GRAPH_MAX_NODES)
+    except ValueError:
+        return jsonify({"error": "hops and limit must be integers"}), 400
+    neighborhood = graph.k_hop(entity_name, hops=hops, limit=limit)
+    if neighborhood is None:
+        return jsonify({"message": f"No relationships found for entity '{entity_name}'"}), 404
+    return jsonify({"entity_name": entity_name, "hops": hops, **neighborhood})
+
+@app.route("/graph/path", methods=["GET"])
+def get_graph_path():
+    """Shortest chain of relationships between ?source= and ?target="""
+    graph = relationship_graph
+    source, target = request.args.get("source", "").strip(), request.args.get("target", "").strip()
+    if not source or not target:
+        return jsonify({"error": "source and target are required"}), 400
+    try:
+        max_hops = int_arg("max_hops", 6, 1, GRAPH_MAX_PATH_HOPS)
+    except ValueError:
+        return jsonify({"error": "max_hops must be an integer"}), 400
+    path = graph.shortest_path(source, target, max_hops=max_hops)
+    if path is None:
+        return jsonify({"message": f"No path found between '{source}' and '{target}' within {max_hops} hops"}), 404
+    return jsonify({"source": source, "target": target, **path})
+
+@app.route("/graph/ranking", methods=["GET"])
+def get_graph_ranking():
+    """Most connected entities: ?by=degree (default) or pagerank, optional ?label=PERSON|ORG"""
+    graph = relationship_graph
+    by = request.args.get("by", "degree")
+    if by not in ("degree", "pagerank"):
+        return jsonify({"error": "by must be 'degree' or 'pagerank'"}), 400
+    try:
+        limit = int_arg("limit", 20, 1, 100)
+        offset = int_arg("offset", 0, 0, 10 ** 9)
+    except ValueError:
+        return jsonify({"error": "limit and offset must be integers"}), 400
+    results = graph.ranking(by=by, label=request.args.get("label"), limit=limit, offset=offset)
+    return jsonify({"by": by, "limit": limit, "offset": offset, "results": results})
+
+GRAPH_VIEW_MAX_NODES = 500
+
+def list_arg(name):
+    """Values of a repeatable and/or comma-separated query parameter, e.g. ?label=PERSON,ORG or ?label=PERSON&label=ORG"""
+    return [value.strip() for values in request.args.getlist(name) for value in values.split(",") if value.strip()]
+
+@app.route("/graph/view", methods=["GET"])
+def get_graph_view():
+    """Bounded, laid-out subgraph around ?focus= entities for the network view (x/y in [0, 1] on every node)"""
+    graph = relationship_graph  # Node IDs are only valid on the graph they were looked up on, keep one per request
+    focus_names = list_arg("focus")
+    if not focus_names:
+        return jsonify({"error": "focus is required"}), 400
+    try:
+        hops = int_arg("hops", 1, 1, 2)
+        max_nodes = int_arg("max_nodes", 150, 1, GRAPH_VIEW_MAX_NODES)
+        leaf_degree = int_arg("leaf_degree", 1, 0, 3)
+    except ValueError:
+        return jsonify({"error": "hops, max_nodes and leaf_degree must be integers"}), 400
+    rank_by = request.args.get("rank", "degree")
+    if rank_by not in ("degree", "weight"):
+        return jsonify({"error": "rank must be 'degree' or 'weight'"}), 400
+    labels, files = sorted(set(list_arg("label"))), sorted(set(list_arg("file")))
+
+    focus = sorted({node for node in map(graph.node_id, focus_names) if node is not None})
+    if not focus:
+        return jsonify({"message": f"No relationships found for {', '.join(focus_names)}"}), 404
+    key = (graph.version, tuple(focus), hops, max_nodes, leaf_degree, rank_by, tuple(labels), tuple(files))
+    view = view_cache.get(key)
+    if view is None:
+        allowed_nodes = None
+        if files:
+            allowed_nodes = {node for node in (graph.node_id(entity["entity"]) for entity in
+                                               entities_collection.find({"file_id": {"$in": files}}, {"_id": 0, "entity": 1}))
+                             if node is not None}
+        view = build_view(graph, focus, hops=hops, max_nodes=max_nodes, rank_by=rank_by,
+                          labels=labels, allowed_nodes=allowed_nodes, leaf_degree=leaf_degree)
+        view_cache.put(key, view)
+        cached = False
+    else:
+        cached = True
+    return jsonify({"focus": focus_names, "hops": hops, "rank": rank_by, "cached": cached, **view})
+
+@app.route("/graph/stats", methods=["GET"])
+def get_graph_stats():
+    return jsonify(relationship_graph.stats())
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--preload", action="store_true", help="load the NLP models at startup instead of on the first upload")
+    args = parser.parse_args()
+    # With debug=True the reloader re-runs this file in a child process that serves the requests; only that one preloads
+    if args.preload and os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        registry.preload(["ner", "rebel"])
     app.run(debug=True)
\ No newline at end of file
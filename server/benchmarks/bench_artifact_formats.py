@@ -0,0 +1,137 @@
+"""Size and load time of the stage tables as CSV against per-document Arrow and Parquet partitions (columnar_store.py).
+
+Usage (from server/):
+    python benchmarks/bench_artifact_formats.py [Dataset/*.csv] [--pairs-from Dataset/extracted_entities_cleaned_v2.csv]
+                                                [--repeat 5] [--output results.json]
+
+Every table is measured as one CSV file (how the stages used to hand it over) and as one partition per "File Name"
+in each columnar format:
+    bytes           on disk
+    load_seconds    pd.read_csv of the CSV / read_partitions of every partition
+    one_document    rows of one document: the whole CSV parsed and filtered / that document's partition only
+    append_seconds  adding one more document: the CSV rewritten in full / one new partition written
+Times are the best of --repeat runs. Besides the Dataset CSVs, --pairs-from builds the quadratic table the relation
+stage works on: every pair of entities of the same document, with types, relation, co-occurrences and an evidence
+sentence, as extract_entities_and_pairs_from_text_files and predict_relationships_from_entity_pairs produce it.
+"""
+import argparse
+import glob
+import itertools
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+
+import pandas as pd
+from Functions import PAIR_COLUMNS
+from columnar_store import PARTITION_COLUMN, read_partitions, read_table, write_partitions, write_table
+
+FORMATS = ("arrow", "parquet")
+RELATIONS = ["Unknown", "Unknown", "Unknown", "employer", "member of", "located in", "participant"]
+
+
+def quadratic_pairs(entities_csv):
+    """Relationships table of every entity pair within each document of an entity table"""
+    entities = pd.read_csv(entities_csv).dropna(subset=["Entity"])
+    rows = []
+    for filename, group in entities.groupby(PARTITION_COLUMN, sort=False):
+        for (entity1, type1), (entity2, type2) in itertools.combinations(zip(group["Entity"], group["Label"]), 2):
+            rows.append((entity1, type1, entity2, type2, RELATIONS[len(rows) % len(RELATIONS)], filename,
+                         1 + len(rows) % 4, f"{entity1} met {entity2} on {len(rows) % 28 + 1} March, the report said."))
+    return pd.DataFrame(rows, columns=PAIR_COLUMNS)
+
+
+def csv_document(csv_path, document):
+    rows = pd.read_csv(csv_path)
+    return rows[rows[PARTITION_COLUMN] == document]
+
+
+def best_of(repeat, function, *args):
+    seconds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function(*args)
+        seconds.append(time.perf_counter() - started)
+    return round(min(seconds), 5)
+
+
+def folder_bytes(folder):
+    return sum(os.path.getsize(os.path.join(folder, name)) for name in os.listdir(folder))
+
+
+def measure(name, df, workdir, repeat):
+    """CSV against each columnar format for one table; the last document stands in for a new upload"""
+    documents = df[PARTITION_COLUMN].drop_duplicates().tolist()
+    first, last = documents[0], documents[-1]
+    existing, new = df[df[PARTITION_COLUMN] != last], df[df[PARTITION_COLUMN] == last]
+    csv_path = os.path.join(workdir, name + ".csv")
+    df.to_csv(csv_path, index=False)
+    csv_loaded = pd.read_csv(csv_path)
+    result = {"rows": len(df), "documents": len(documents), "csv": {
+        "bytes": os.path.getsize(csv_path),
+        "load_seconds": best_of(repeat, pd.read_csv, csv_path),
+        "one_document_seconds": best_of(repeat, csv_document, csv_path, first),
+        "append_seconds": best_of(repeat, lambda: pd.concat([existing, new]).to_csv(csv_path, index=False)),
+    }}
+    for format in FORMATS:
+        folder = os.path.join(workdir, f"{name}.{format}")
+        write_partitions(existing, folder, format)
+        paths = write_partitions(new, folder, format)
+        loaded = read_partitions(folder)
+        same = loaded.sort_values(list(df.columns)).reset_index(drop=True).astype(str).equals(
+            csv_loaded.sort_values(list(df.columns)).reset_index(drop=True).astype(str))
+        result[format] = {
+            "bytes": folder_bytes(folder),
+            "load_seconds": best_of(repeat, read_partitions, folder),
+            "one_document_seconds": best_of(repeat, read_partitions, folder, [first]),
+            "append_seconds": best_of(repeat, write_table, new, paths[last]),
+            "same_rows_as_csv": bool(same),
+        }
+        result[format]["size_vs_csv"] = round(result[format]["bytes"] / result["csv"]["bytes"], 3)
+        result[format]["load_speedup"] = round(result["csv"]["load_seconds"] / result[format]["load_seconds"], 2)
+        result[format]["one_document_speedup"] = round(result["csv"]["one_document_seconds"]
+                                                       / result[format]["one_document_seconds"], 2)
+    if "Entity 1" in df.columns:  # Memory-mapped partition read with the name columns left dictionary-encoded
+        path = next(iter(write_partitions(new, os.path.join(workdir, name + ".categorical"), "arrow").values()))
+        result["arrow"]["one_document_categorical_seconds"] = best_of(repeat, read_table, path, None, False)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("csv", nargs="*", default=sorted(glob.glob(os.path.join(SERVER_DIR, "Dataset", "*.csv"))))
+    parser.add_argument("--pairs-from", default=os.path.join(SERVER_DIR, "Dataset", "extracted_entities_cleaned_v2.csv"),
+                        help="entity table to build the quadratic pairs table from ('' to skip it)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", default=None, help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    tables = {os.path.splitext(os.path.basename(path))[0]: pd.read_csv(path) for path in args.csv}
+    tables = {name: df for name, df in tables.items() if PARTITION_COLUMN in df.columns}
+    if args.pairs_from:
+        tables["relationships (all pairs per document)"] = quadratic_pairs(args.pairs_from)
+    workdir = tempfile.mkdtemp(prefix="bench_artifact_formats_")
+    report = {"repeat": args.repeat, "tables": {}}
+    try:
+        for index, (name, df) in enumerate(tables.items()):
+            folder = os.path.join(workdir, str(index))  # Table names need not be valid file names
+            os.makedirs(folder)
+            report["tables"][name] = result = measure("table", df, folder, args.repeat)
+            print(f"{name}: {len(df)} rows, CSV {result['csv']['bytes'] / 1024:.0f} KiB / {result['csv']['load_seconds']}s"
+                  + "".join(f", {format} {result[format]['bytes'] / 1024:.0f} KiB / {result[format]['load_seconds']}s"
+                            for format in FORMATS), file=sys.stderr)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Benchmark: Wikidata ID resolution against a local stub of the wbsearchentities API.
+
+Usage (from server/):
+    python benchmarks/bench_entity_linking.py [--latency-ms 50] [--workers 8] [--limit 2000]
+
+Resolves the entity names of Dataset/extracted_entities_cleaned_v2.csv three ways: one sequential request per
+name (the old call_wiki_api), a cold WikidataLinker (deduplicated, concurrent) and a warm one (all cache hits).
+The stub answers "no match" for roughly a third of the names so negative caching is exercised too.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+from entity_linking import WikidataLinker
+
+DATASET_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Dataset")
+
+
+def start_stub_server(latency):
+    """wbsearchentities stub on a free local port; returns (server, api_url)"""
+    class Handler(BaseHTTPRequestHandler):
+        requests_served = 0
+
+        def do_GET(self):
+            Handler.requests_served += 1
+            time.sleep(latency)
+            search = parse_qs(urlparse(self.path).query).get("search", [""])[0]
+            found = sum(map(ord, search)) % 3 != 0
+            body = json.dumps({"search": [{"id": f"Q{abs(hash(search.lower())) % 10 ** 7}"}] if found else []}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.handler = Handler
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/w/api.php"
+
+
+def sequential(names, api_url):
+    """The old behaviour: one un-pooled request per name, duplicates included"""
+    ids = {}
+    for name in names:
+        try:
+            ids[name] = requests.get(f"{api_url}?action=wbsearchentities&search={name}&language=en&format=json").json()["search"][0]["id"]
+        except Exception:
+            ids[name] = "id-less"
+    return ids
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, round(time.perf_counter() - started, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency-ms", type=float, default=50, help="simulated API response time")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--limit", type=int, default=2000, help="entity rows to resolve")
+    args = parser.parse_args()
+
+    with open(os.path.join(DATASET_DIR, "extracted_entities_cleaned_v2.csv"), encoding="utf-8") as f:
+        names = [row["Entity"] for row in csv.DictReader(f)][:args.limit]
+
+    server, api_url = start_stub_server(args.latency_ms / 1000)
+    results = {"names": len(names), "distinct_names": len(set(names)), "latency_ms": args.latency_ms, "workers": args.workers}
+
+    _, results["sequential_seconds"] = timed(sequential, names, api_url)
+    results["sequential_requests"] = server.handler.requests_served
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        linker = WikidataLinker(os.path.join(cache_dir, "wikidata_cache.sqlite3"), api_url=api_url, max_workers=args.workers)
+        server.handler.requests_served = 0
+        ids, results["cold_seconds"] = timed(linker.resolve, names)
+        results["cold_requests"] = server.handler.requests_served
+        _, results["warm_seconds"] = timed(linker.resolve, names)
+        results["warm_requests"] = server.handler.requests_served - results["cold_requests"]
+        results["resolved"] = sum(1 for wiki_id in ids.values() if wiki_id)
+        results["linker_stats"] = linker.stats
+        linker.close()
+
+    server.shutdown()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""Benchmark: RelationshipGraph memory and query latency against a dict-of-strings adjacency.
+
+Usage (from server/):
+    python benchmarks/bench_graph.py [--edges 1000000] [--entities 200000] [--queries 2000] [--seed 0]
+
+Generates Relationships-shaped documents over synthetic entity names (power-law degrees), then compares:
+- memory: RelationshipGraph vs {name: {neighbour name: {relationship, ...}}}, both measured with tracemalloc
+- neighbour lookups, 2-hop neighbourhoods, shortest paths and degree/PageRank rankings
+- incremental add_relationships of one ingestion's worth of edges
+Shortest-path hop counts are cross-checked against a plain BFS over the dict adjacency.
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from collections import deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from graph import RelationshipGraph
+
+RELATIONSHIPS = ["Unknown", "employer", "member of", "spouse", "founded by", "country of citizenship", "subsidiary",
+                 "position held", "owned by", "sibling"]
+
+
+def synthetic_relationships(edges, entities, rng):
+    names = [f"{rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ')}{i:07d} {rng.choice(['Khan', 'Smith', 'Tan', 'Corp'])}"
+             for i in range(entities)]
+    labels = [rng.choice(("PERSON", "ORG")) for _ in range(entities)]
+    weights = [1 / (i + 1) ** 0.8 for i in range(entities)]  # A few hubs, a long tail
+    sources = rng.choices(range(entities), weights=weights, k=edges)
+    targets = rng.choices(range(entities), weights=weights, k=edges)
+    return [{"entity_1_name": names[a], "entity_1_type": labels[a], "entity_2_name": names[b], "entity_2_type": labels[b],
+             "relationship": rng.choice(RELATIONSHIPS)} for a, b in zip(sources, targets) if a != b]
+
+
+def dict_adjacency(relationships):
+    adjacency = {}
+    for relation in relationships:
+        a, b, kind = relation["entity_1_name"], relation["entity_2_name"], relation["relationship"]
+        adjacency.setdefault(a, {}).setdefault(b, set()).add(kind)
+        adjacency.setdefault(b, {}).setdefault(a, set()).add(kind)
+    return adjacency
+
+
+def bfs_hops(adjacency, source, target, max_hops):
+    seen, frontier = {source}, deque([(source, 0)])
+    while frontier:
+        node, hops = frontier.popleft()
+        if node == target:
+            return hops
+        if hops < max_hops:
+            for neighbor in adjacency.get(node, ()):
+                if neighbor not in seen:
+                    seen.add(neighbor)
+                    frontier.append((neighbor, hops + 1))
+    return None
+
+
+def measured(build):
+    """(result, bytes allocated by build and still alive)"""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+def latency_us(fn, args_list):
+    latencies = []
+    for args in args_list:
+        started = time.perf_counter()
+        fn(*args)
+        latencies.append((time.perf_counter() - started) * 1e6)
+    latencies.sort()
+    return {"mean": round(statistics.mean(latencies), 1), "p50": round(latencies[len(latencies) // 2], 1),
+            "p99": round(latencies[int(len(latencies) * 0.99)], 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--edges", type=int, default=1000000)
+    parser.add_argument("--entities", type=int, default=200000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    relationships = synthetic_relationships(args.edges, args.entities, rng)
+    update, relationships = relationships[:2000], relationships[2000:]
+
+    def build_graph():
+        graph = RelationshipGraph()
+        graph.build(relationships)
+        return graph
+
+    adjacency, dict_bytes = measured(lambda: dict_adjacency(relationships))
+    started = time.perf_counter()
+    graph, graph_bytes = measured(build_graph)
+    build_seconds = time.perf_counter() - started
+
+    names = list(adjacency)
+    sample = [rng.choice(names) for _ in range(args.queries)]
+    node_ids = [(graph.node_id(name),) for name in sample]
+    pairs = [(rng.choice(names), rng.choice(names)) for _ in range(min(200, args.queries))]
+    mismatches = 0
+    for source, target in pairs[:50]:
+        path = graph.shortest_path(source, target, max_hops=6)
+        if (path["hops"] if path else None) != bfs_hops(adjacency, source, target, 6):
+            mismatches += 1
+
+    started = time.perf_counter()
+    added = graph.add_relationships(update)
+    update_ms = (time.perf_counter() - started) * 1000
+
+    print(json.dumps({
+        "edges": graph.edge_count(),
+        "entities": len(graph),
+        "build_seconds": round(build_seconds, 2),
+        "memory_mb": {"dict_of_strings": round(dict_bytes / 2 ** 20, 1), "graph_total": round(graph_bytes / 2 ** 20, 1),
+                      "graph_csr_arrays": round(graph.nbytes() / 2 ** 20, 1),
+                      "reduction": round(dict_bytes / graph_bytes, 1)},
+        "incremental_update": {"edges": added, "ms": round(update_ms, 2)},
+        "latency_us": {
+            "neighbors": latency_us(graph.neighbors, node_ids),
+            "dict_neighbors": latency_us(lambda name: list(adjacency[name].items()), [(name,) for name in sample]),
+            "two_hop_limit_200": latency_us(lambda name: graph.k_hop(name, hops=2, limit=200), [(name,) for name in sample[:200]]),
+            "shortest_path": latency_us(graph.shortest_path, pairs),
+            "ranking_degree_top20": latency_us(lambda: graph.ranking("degree"), [()] * 20),
+            "ranking_pagerank_top20_cached": latency_us(lambda: graph.ranking("pagerank"), [()] * 20),
+        },
+        "path_mismatches_vs_bfs": mismatches,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Benchmark: cold import time of the backend, from `python -X importtime`.
+
+Usage (from server/):
+    python benchmarks/bench_import_time.py [--module backend] [--runs 3] [--top 15]
+
+Imports the module in fresh interpreters, reports the median total import time and the slowest top-level
+imports, and exits non-zero if any of the heavy ML/plotting packages was imported (they should only load
+on first use, through the resource registry).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ["torch", "transformers", "datasets", "sklearn", "matplotlib", "seaborn", "pdfplumber", "spacy"]
+
+
+def import_times(module):
+    """[(nesting level, module name, cumulative microseconds)] of one cold import"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=SERVER_DIR,
+                            capture_output=True, text=True, env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"})
+    if result.returncode:
+        raise RuntimeError(result.stderr[-2000:])
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        level = (len(name) - len(name.lstrip()) - 1) // 2  # Two spaces of indentation per nesting level
+        times.append((level, name.strip(), int(cumulative)))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="backend")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    runs = [import_times(args.module) for _ in range(args.runs)]
+    totals = [next(us for level, name, us in times if level == 0 and name == args.module) for times in runs]
+    direct = {name: us for level, name, us in runs[-1] if level == 1}  # Imported by the module itself
+    heavy = sorted({name.split(".")[0] for times in runs for _, name, _ in times if name.split(".")[0] in HEAVY_MODULES})
+    print(json.dumps({
+        "module": args.module,
+        "runs": args.runs,
+        "import_seconds_median": round(statistics.median(totals) / 1e6, 3),
+        "slowest_imports_ms": {name: round(us / 1000, 1) for name, us in
+                               sorted(direct.items(), key=lambda item: -item[1])[:args.top]},
+        "heavy_modules_imported": heavy,
+    }, indent=2))
+    sys.exit(1 if heavy else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Peak memory of the text and NER stages on one very long synthetic PDF.
+
+Usage (from server/):
+    python benchmarks/bench_long_document.py [--pages 2000] [--entities-per-page 20] [--seed 0] [--output results.json]
+
+Writes one --pages page PDF with synthetic_pdfs.py, then runs each stage in a fresh process of its own, so its peak
+RSS is that of the stage and nothing else: text (extract_text_from_directory, in-process) and ner
+(extract_entities_and_pairs_from_text_files with a rule-based gazetteer of the corpus names, so no model download is
+needed). rss_before_mb is the process after imports and model loading, stage_peak_mb the peak on top of it.
+
+NER raises the model's max_length to the document length first: a whole-document Doc needs it (spaCy refuses texts
+over 1,000,000 characters by default), chunked NER never gets near the limit.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_rebel_backends import current_rss_mb
+
+
+def peak_rss_mb():
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def run_stage(stage, workdir):
+    """Worker process: one stage on the PDF in workdir/pdf, returns its timings and memory"""
+    from Functions import extract_entities_and_pairs_from_text_files, extract_text_from_directory
+    pdf_folder, text_folder = os.path.join(workdir, "pdf"), os.path.join(workdir, "txt")
+    if stage == "text":
+        rss_before = current_rss_mb()
+        started = time.perf_counter()
+        timings = extract_text_from_directory(pdf_folder, text_folder, workers=1)
+        result = {"pages": timings[0]["pages"], "characters": os.path.getsize(os.path.join(text_folder, os.listdir(text_folder)[0]))}
+    else:
+        from bench_pipeline import gazetteer_model
+        from canonicalize import AliasIndex
+        with open(os.path.join(workdir, "corpus.json"), encoding="utf-8") as f:
+            nlp = gazetteer_model(json.load(f))
+        nlp.max_length = max(nlp.max_length, *(os.path.getsize(os.path.join(text_folder, name)) + 1
+                                                for name in os.listdir(text_folder)))
+        rss_before = current_rss_mb()
+        started = time.perf_counter()
+        entities, pairs = extract_entities_and_pairs_from_text_files(text_folder, nlp=nlp, aliases=AliasIndex())
+        result = {"entities": len(entities), "mentions": int(entities["Mentions"].sum()), "pairs": len(pairs),
+                  "co_occurrences": int(pairs["Co-occurrences"].sum())}
+    seconds = time.perf_counter() - started
+    peak = peak_rss_mb()
+    return {"stage": stage, "seconds": round(seconds, 2), "rss_before_mb": rss_before, "peak_rss_mb": peak,
+            "stage_peak_mb": round(peak - rss_before, 1), **result}
+
+
+def in_subprocess(*arguments):
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), *arguments], capture_output=True, text=True,
+                            cwd=SERVER_DIR)
+    if result.returncode:
+        raise RuntimeError(f"{' '.join(arguments[:2])} failed:\n{result.stderr[-3000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=2000)
+    parser.add_argument("--entities-per-page", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="also write the results to this JSON file")
+    parser.add_argument("--stage", choices=["text", "ner"], default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.stage:
+        print(json.dumps(run_stage(args.stage, args.workdir)))
+        return
+
+    from synthetic_pdfs import generate_corpus
+    workdir = tempfile.mkdtemp(prefix="bench_long_document_")
+    started = time.perf_counter()
+    corpus = generate_corpus(os.path.join(workdir, "pdf"), documents=1, pages=args.pages,
+                             entities_per_page=args.entities_per_page, seed=args.seed)
+    with open(os.path.join(workdir, "corpus.json"), "w", encoding="utf-8") as f:
+        json.dump({"people": corpus["people"], "organisations": corpus["organisations"]}, f)
+    print(f"Generated {args.pages} pages in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    report = {"pages": args.pages, "entities_per_page": args.entities_per_page,
+              "pdf_mb": round(os.path.getsize(corpus["files"][0]) / 2 ** 20, 1), "stages": {}}
+    for stage in ("text", "ner"):
+        report["stages"][stage] = in_subprocess("--stage", stage, "--workdir", workdir)
+        print(f"{stage}: {report['stages'][stage]['seconds']}s, peak RSS {report['stages'][stage]['peak_rss_mb']} MB",
+              file=sys.stderr)
+    import shutil
+    shutil.rmtree(workdir, ignore_errors=True)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Benchmark: nested-loop linking with insert_one per document vs the indexed, batched persistence stage.
+
+Usage (from server/):
+    python benchmarks/bench_persistence.py [--rtt-ms 1.0] [--batch-size 1000] [--mongo-uri mongodb://localhost:27017]
+
+Without --mongo-uri the writes go to an in-memory collection that sleeps --rtt-ms per round trip.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+from nanoid import generate
+from persistence import persist_document
+
+DATASET_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Dataset")
+
+
+class RecordingCollection:
+    """In-memory stand-in for a pymongo collection that counts round trips and simulates their latency"""
+
+    def __init__(self, rtt_ms):
+        self.rtt = rtt_ms / 1000
+        self.round_trips = 0
+        self.documents = 0
+
+    def insert_one(self, entry):
+        self.round_trips += 1
+        self.documents += 1
+        time.sleep(self.rtt)
+
+    def insert_many(self, entries, ordered=True):
+        self.round_trips += 1
+        self.documents += len(entries)
+        time.sleep(self.rtt)
+
+    def bulk_write(self, operations, ordered=True):
+        self.round_trips += 1
+        self.documents += len(operations)
+        time.sleep(self.rtt)
+
+
+def load_dataset():
+    entities = pd.read_csv(os.path.join(DATASET_DIR, "extracted_entities_cleaned_v2.csv"))
+    raw = pd.read_csv(os.path.join(DATASET_DIR, "final_entity_relationships.csv"))
+    labels = dict(zip(entities["Entity"], entities["Label"]))
+    relationships = pd.DataFrame({
+        "Entity 1": raw["Entity1"],
+        "Type 1": raw["Entity1"].map(labels).fillna("UNKNOWN"),
+        "Entity 2": raw["Entity2"],
+        "Type 2": raw["Entity2"].map(labels).fillna("UNKNOWN"),
+        "Relationship": raw["Predicted_Relation"],
+    })
+    return entities, relationships
+
+
+def legacy_persist(document, entities, relationships, entities_collection, relationship_collection):
+    """The original upload_file loop: E x R comparisons and one insert_one per match and per entity"""
+    entities_list = entities.to_dict(orient="records")
+    relationships_list = relationships.to_dict(orient="records")
+    comparisons = 0
+    for entity in entities_list:
+        relationship_ids = []
+        for relation in relationships_list:
+            comparisons += 1
+            if entity["Entity"] == relation["Entity 1"] or entity["Entity"] == relation["Entity 2"]:
+                relationship_id = generate(size=8)
+                relationship_ids.append(relationship_id)
+                relationship_collection.insert_one({
+                    "_id": relationship_id,
+                    "entity_1_name": relation["Entity 1"],
+                    "entity_1_type": relation["Type 1"],
+                    "entity_2_name": relation["Entity 2"],
+                    "entity_2_type": relation["Type 2"],
+                    "relationship": relation["Relationship"]
+                })
+        entities_collection.insert_one({
+            "_id": str(uuid.uuid4()),
+            "file_id": document["file_id"],
+            "file_name": entity["File Name"],
+            "entity": entity["Entity"],
+            "label": entity["Label"],
+            "frequency": 0,
+            "relationships": relationship_ids
+        })
+    return comparisons
+
+
+def make_collections(args, name):
+    if args.mongo_uri:
+        from pymongo import MongoClient
+        db = MongoClient(args.mongo_uri)["aka_benchmark"]
+        db.drop_collection(f"{name}_entities")
+        db.drop_collection(f"{name}_relationships")
+        return db[f"{name}_entities"], db[f"{name}_relationships"]
+    return RecordingCollection(args.rtt_ms), RecordingCollection(args.rtt_ms)
+
+
+def run(label, fn, args, entities, relationships):
+    entities_collection, relationship_collection = make_collections(args, label)
+    document = {"file_id": "benchmark"}
+    started = time.perf_counter()
+    fn(document, entities, relationships, entities_collection, relationship_collection)
+    result = {"seconds": round(time.perf_counter() - started, 3)}
+    if isinstance(entities_collection, RecordingCollection):
+        result["round_trips"] = entities_collection.round_trips + relationship_collection.round_trips
+        result["documents"] = entities_collection.documents + relationship_collection.documents
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rtt-ms", type=float, default=1.0, help="simulated round trip latency without --mongo-uri")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--mongo-uri", default=None)
+    args = parser.parse_args()
+
+    entities, relationships = load_dataset()
+    results = {
+        "entities": len(entities),
+        "relationships": len(relationships),
+        "legacy": run("legacy", legacy_persist, args, entities, relationships),
+        "batched": run("batched", lambda *a: persist_document(*a, batch_size=args.batch_size), args, entities, relationships),
+    }
+    results["speedup"] = round(results["legacy"]["seconds"] / max(results["batched"]["seconds"], 1e-9), 1)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+"""Benchmark: every ingestion stage timed on its own, plus the full /upload round trip, on a synthetic PDF corpus.
+
+Usage (from server/):
+    python benchmarks/bench_pipeline.py [--documents 5] [--pages 10] [--entities-per-page 20] [--seed 0]
+                                        [--model en_core_web_sm | --gazetteer] [--mongo-uri mongodb://localhost:27017]
+                                        [--output results.json] [--baseline benchmarks/baselines/pipeline.json]
+                                        [--tolerance 0.25] [--save-baseline]
+
+Stages: extraction (extract_text_from_pdf), cleaning (clean_extracted_text), ner and pairs (one call of
+extract_entities_and_pairs_from_text_files on the cleaned .txt files, as the pipeline runs it: chunked NER, alias
+canonicalization and windowed pairing; each stage is the time the function itself records for it), relations
+(predict_relationships_from_entity_pairs), persistence (persist_document) and upload (POST /upload through the
+Flask test client, polled until its job finishes).
+
+Relations run on a tiny randomly initialised BART with REBEL's triplet markup tokens instead of rebel-large, so the
+stage measures the batching/decoding code around the model rather than the model itself. --gazetteer tags the
+corpus' own names with a rule-based matcher instead of a statistical model. Without --mongo-uri persistence and the
+upload go to mongomock.
+
+Results are printed and optionally written as JSON. --baseline compares the stage timings against a stored result
+and exits with status 1 when a stage is more than --tolerance slower; --save-baseline overwrites the baseline.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from Functions import clean_extracted_text, count_pdf_pages, extract_entities_and_pairs_from_text_files, \
+    extract_text_from_pdf, load_ner_model, predict_relationships_from_entity_pairs
+from canonicalize import AliasIndex
+from metrics import STAGE_SECONDS
+from persistence import persist_document
+from synthetic_pdfs import FILLER, TEMPLATES, generate_corpus
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "pipeline.json")
+STANDIN_MAX_NEW_TOKENS = 24  # Roughly one REBEL triplet
+UPLOAD_TIMEOUT = 600
+
+
+def gazetteer_model(corpus):
+    import spacy
+    nlp = spacy.blank("en")
+    nlp.add_pipe("sentencizer")
+    ruler = nlp.add_pipe("entity_ruler")
+    ruler.add_patterns([{"label": "PERSON", "pattern": name} for name in corpus["people"]] +
+                       [{"label": "ORG", "pattern": name} for name in corpus["organisations"]])
+    return nlp
+
+
+def standin_rebel_pipeline(corpus, d_model=64, layers=2, init_std=0.02):
+    """text2text-generation pipeline around a small random BART (default 2+2 layers, d_model=64) with a word-level
+    vocabulary of the corpus"""
+    from tokenizers import Tokenizer, models, pre_tokenizers, processors
+    from transformers import BartConfig, BartForConditionalGeneration, PreTrainedTokenizerFast, pipeline
+    special = ["<s>", "<pad>", "</s>", "<unk>", "<mask>", "<triplet>", "<subj>", "<obj>"]
+    words = {word for text in TEMPLATES + FILLER + corpus["people"] + corpus["organisations"]
+             for word, _ in pre_tokenizers.Whitespace().pre_tokenize_str(text)}
+    words |= {"(", ")", "and", "relationship", "PERSON", "ORG"}
+    vocab = {token: i for i, token in enumerate(special + sorted(words - set(special)))}
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="<unk>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    tokenizer.post_processor = processors.TemplateProcessing(single="<s> $A </s>", special_tokens=[("<s>", 0), ("</s>", 2)])
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=tokenizer, bos_token="<s>", pad_token="<pad>", eos_token="</s>",
+                                        unk_token="<unk>", mask_token="<mask>", model_max_length=1024,
+                                        additional_special_tokens=["<triplet>", "<subj>", "<obj>"])
+    heads = max(2, d_model // 64)
+    config = BartConfig(vocab_size=len(vocab), d_model=d_model, encoder_layers=layers, decoder_layers=layers,
+                        encoder_attention_heads=heads, decoder_attention_heads=heads, encoder_ffn_dim=2 * d_model,
+                        decoder_ffn_dim=2 * d_model, max_position_embeddings=1024, init_std=init_std,
+                        pad_token_id=1, bos_token_id=0, eos_token_id=2, decoder_start_token_id=2, forced_bos_token_id=0)
+    import torch
+    torch.manual_seed(0)
+    model = BartForConditionalGeneration(config).eval()
+    # max_new_tokens takes precedence over the max_length=REBEL_MAX_LENGTH of each call
+    return pipeline("text2text-generation", model=model, tokenizer=tokenizer, device=-1, max_new_tokens=STANDIN_MAX_NEW_TOKENS)
+
+
+def timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def stage_result(seconds, **counts):
+    return {"seconds": round(seconds, 4), **counts}
+
+
+def recorded_seconds(stage):
+    """Total seconds record_stage has recorded for a stage in this process"""
+    return STAGE_SECONDS.values().get((stage,), [0.0])[-1]
+
+
+def mongo_client(mongo_uri):
+    if mongo_uri:
+        from pymongo import MongoClient
+        return MongoClient(mongo_uri)
+    import mongomock
+    return mongomock.MongoClient()
+
+
+def run_stages(corpus, nlp, rebel_pipeline, client, workdir):
+    stages = {}
+    files = corpus["files"]
+    pages = sum(count_pdf_pages(path) for path in files)
+
+    texts, seconds = timed(lambda: [extract_text_from_pdf(path) for path in files])
+    stages["extraction"] = stage_result(seconds, pages=pages, pages_per_second=round(pages / seconds, 1))
+
+    cleaned, seconds = timed(lambda: [clean_extracted_text(text) for text in texts])
+    characters = sum(len(text) for text in cleaned)
+    stages["cleaning"] = stage_result(seconds, characters=characters, mb_per_second=round(characters / seconds / 2 ** 20, 2))
+
+    text_folder = os.path.join(workdir, "txt")
+    os.makedirs(text_folder, exist_ok=True)
+    filenames = [f"{os.path.splitext(os.path.basename(path))[0]}.txt" for path in files]
+    for filename, text in zip(filenames, cleaned):
+        with open(os.path.join(text_folder, filename), "w", encoding="utf-8") as f:
+            f.write(text)
+    ner_before, pairs_before = recorded_seconds("ner"), recorded_seconds("pair_generation")
+    (entities, pairs), seconds = timed(extract_entities_and_pairs_from_text_files, text_folder, filenames=filenames,
+                                       nlp=nlp, aliases=AliasIndex())
+    ner_seconds = recorded_seconds("ner") - ner_before
+    stages["ner"] = stage_result(ner_seconds, mentions=int(entities["Mentions"].sum()),
+                                 pages_per_second=round(pages / ner_seconds, 1), call_seconds=round(seconds, 4))
+    stages["pairs"] = stage_result(recorded_seconds("pair_generation") - pairs_before, entities=len(entities),
+                                   pairs=len(pairs))
+
+    if rebel_pipeline is None:
+        stages["relations"] = {"skipped": "torch/transformers not installed"}
+        relationships = pairs
+    else:
+        pairs_csv, complete_csv = os.path.join(workdir, "entitypairs.csv"), os.path.join(workdir, "entitypairsComplete.csv")
+        pairs.to_csv(pairs_csv, index=False)
+        relationships, seconds = timed(predict_relationships_from_entity_pairs, pairs_csv, complete_csv, rebel_pipeline)
+        stats = relationships.attrs.get("relation_stats", {})
+        stages["relations"] = stage_result(seconds, pairs=len(pairs), generations=stats.get("unique_queries"),
+                                           relations_found=stats.get("relations_found"))
+
+    database = client[f"bench_pipeline_{uuid.uuid4().hex[:8]}"]
+    written = {"entities": 0, "relationships": 0}
+    started = time.perf_counter()
+    for filename in filenames:
+        document = {"file_id": str(uuid.uuid4()), "filename": filename}
+        summary = persist_document(document, entities[entities["File Name"] == filename],
+                                   relationships[relationships["File Name"] == filename],
+                                   database["Entities"], database["Relationships"])
+        for key in written:
+            written[key] += summary[key]
+    stages["persistence"] = stage_result(time.perf_counter() - started, **written)
+    client.drop_database(database.name)
+    return stages
+
+
+def run_upload(corpus, nlp, rebel_pipeline, client, workdir):
+    """POST /upload with every PDF and poll /jobs/<id>; backend state (LocalDB) lives in workdir"""
+    if rebel_pipeline is None:
+        return {"skipped": "torch/transformers not installed"}
+    from resources import registry
+    registry.set("mongo", client)
+    registry.set("ner", nlp)
+    registry.set("rebel", rebel_pipeline)
+    os.environ["WIKIDATA_LINKING"] = "0"  # No network lookups inside the timing
+    os.chdir(workdir)  # backend creates ./LocalDB on import
+    import backend
+    backend.search_index_ready.wait(60)
+    app = backend.app.test_client()
+
+    started = time.perf_counter()
+    handles = [open(path, "rb") for path in corpus["files"]]
+    try:
+        response = app.post("/upload", data={"file": [(handle, os.path.basename(handle.name)) for handle in handles]},
+                            content_type="multipart/form-data")
+    finally:
+        for handle in handles:
+            handle.close()
+    accepted = time.perf_counter() - started
+    job_id = response.get_json()["job_id"]
+    job = {"status": "succeeded"}
+    while job_id:
+        job = app.get(f"/jobs/{job_id}").get_json()["job"]
+        if job["status"] in ("succeeded", "failed") or time.perf_counter() - started > UPLOAD_TIMEOUT:
+            break
+        time.sleep(0.05)
+    return stage_result(time.perf_counter() - started, status=job["status"], http_status=response.status_code,
+                        accepted_seconds=round(accepted, 4), documents=len(corpus["files"]))
+
+
+def compare(results, baseline, tolerance):
+    """{stage: {"seconds", "baseline", "ratio", "regressed"}} for the stages timed in both runs"""
+    comparison = {}
+    for stage, result in results["stages"].items():
+        before = baseline.get("stages", {}).get(stage, {}).get("seconds")
+        if before and "seconds" in result:
+            ratio = result["seconds"] / before
+            comparison[stage] = {"seconds": result["seconds"], "baseline": before, "ratio": round(ratio, 2),
+                                 "regressed": ratio > 1 + tolerance}
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=5)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--entities-per-page", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--model", default="en_core_web_sm")
+    parser.add_argument("--gazetteer", action="store_true")
+    parser.add_argument("--mongo-uri", default=None)
+    parser.add_argument("--output", default=None, help="also write the results to this JSON file")
+    parser.add_argument("--baseline", default=None, help=f"compare against this result file, e.g. {DEFAULT_BASELINE}")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown per stage before failing")
+    parser.add_argument("--save-baseline", action="store_true", help="write the results to --baseline (or the default)")
+    parser.add_argument("--skip-upload", action="store_true")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    corpus = generate_corpus(os.path.join(workdir, "pdfs"), args.documents, args.pages, args.entities_per_page, args.seed)
+    nlp = gazetteer_model(corpus) if args.gazetteer else load_ner_model(args.model)
+    try:
+        rebel_pipeline = standin_rebel_pipeline(corpus)
+    except ImportError:
+        rebel_pipeline = None
+    client = mongo_client(args.mongo_uri)
+
+    results = {
+        "config": {"documents": args.documents, "pages": args.pages, "entities_per_page": args.entities_per_page,
+                   "seed": args.seed, "ner": "gazetteer" if args.gazetteer else args.model,
+                   "mongo": "mongod" if args.mongo_uri else "mongomock"},
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "stages": run_stages(corpus, nlp, rebel_pipeline, client, workdir),
+    }
+    if not args.skip_upload:
+        results["stages"]["upload"] = run_upload(corpus, nlp, rebel_pipeline, client, workdir)
+        os.chdir(SERVER_DIR)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    exit_code = 0
+    baseline_path = args.baseline or DEFAULT_BASELINE
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("config") != results["config"]:
+            print(f"Warning: baseline was recorded with {baseline.get('config')}", file=sys.stderr)
+        results["comparison"] = compare(results, baseline, args.tolerance)
+        exit_code = int(any(stage["regressed"] for stage in results["comparison"].values()))
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    for path in [args.output] + ([baseline_path] if args.save_baseline else []):
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with open(path, "w") as f:
+                f.write(output + "\n")
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,190 @@
+"""Compares the REBEL inference backends (torch fp32, int8, onnx) on the same entity pairs: latency, peak RSS and how
+often each backend extracts the same relation as fp32.
+
+Usage (from server/):
+    python benchmarks/bench_rebel_backends.py [--pairs Dataset/entity_pairs_relationship_fortraining2.csv]
+        [--backends torch int8 onnx] [--model Babelscape/rebel-large] [--batch-size 16] [--output results.json]
+    python benchmarks/bench_rebel_backends.py --standin      # random BART stand-in, no model download
+
+The prompts are the pipeline's relation queries for every pair, with the entity types looked up in
+Dataset/extracted_entities_cleaned_v2.csv. Artifacts are prepared first in a separate process (and cached, see
+rebel_backends.py), then every backend runs in a fresh process of its own, so its peak RSS is that of loading the
+model and predicting, nothing else. Agreement is the share of pairs whose relation (parsed as in predict_relations)
+equals the fp32 one; identical_generations compares the generated text itself.
+
+With --standin the model is a randomly initialised BART with a vocabulary of the prompts: latency and RSS then show
+each backend's relative overhead on a smaller model, and agreement only shows that the export / quantization is
+faithful; relation agreement on real predictions needs rebel-large.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pandas as pd
+from Functions import REBEL_BATCH_SIZE, REBEL_MODEL, build_relation_queries, predict_relations
+from persistence import normalize_name
+from rebel_backends import REBEL_ARTIFACTS, REBEL_BACKENDS, export_artifacts, load_rebel_backend
+
+DEFAULT_PAIRS = os.path.join(SERVER_DIR, "Dataset", "entity_pairs_relationship_fortraining2.csv")
+DEFAULT_ENTITIES = os.path.join(SERVER_DIR, "Dataset", "extracted_entities_cleaned_v2.csv")
+STANDIN_SIZE = {"d_model": 512, "layers": 4, "init_std": 0.2}  # ~1/20 of rebel-large's compute per token
+
+
+def relation_queries(pairs_csv, entities_csv=DEFAULT_ENTITIES):
+    """Relation queries of every pair, Type 1/2 from the entity table (ORG when a name is not in it)"""
+    pairs = pd.read_csv(pairs_csv)
+    entities = pd.read_csv(entities_csv).dropna(subset=["Entity"])
+    labels = dict(zip(entities["Entity"].map(normalize_name), entities["Label"]))
+    for side in ("1", "2"):
+        pairs["Type " + side] = pairs["Entity " + side].map(lambda name: labels.get(normalize_name(name), "ORG"))
+    return build_relation_queries(pairs).tolist()
+
+
+def save_standin(queries, folder):
+    """Random BART stand-in with a word-level vocabulary of the queries, saved as a model folder"""
+    from bench_pipeline import STANDIN_MAX_NEW_TOKENS, standin_rebel_pipeline
+    words = sorted({word for query in queries for word in query.replace("(", " ").replace(")", " ").split()})
+    standin = standin_rebel_pipeline({"people": words, "organisations": []}, **STANDIN_SIZE)
+    standin.model.generation_config.max_new_tokens = STANDIN_MAX_NEW_TOKENS
+    standin.model.save_pretrained(folder)
+    standin.tokenizer.save_pretrained(folder)
+    return folder
+
+
+def current_rss_mb():
+    with open("/proc/self/status", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return round(int(line.split()[1]) / 1024, 1)
+    return None
+
+
+class RecordingPipeline:
+    """Passes calls through to a pipeline and keeps the generated texts"""
+
+    def __init__(self, pipeline):
+        self.pipeline, self.tokenizer, self.outputs = pipeline, pipeline.tokenizer, []
+
+    def __call__(self, texts, **kwargs):
+        outputs = self.pipeline(texts, **kwargs)
+        self.outputs += [(output[0] if isinstance(output, list) else output)["generated_text"] for output in outputs]
+        return outputs
+
+
+def run_backend(backend, model, queries, batch_size, artifacts, pipeline_kwargs):
+    """Worker process: load one backend, predict every query, report timings, RSS and the predictions"""
+    rss_before = current_rss_mb()
+    started = time.perf_counter()
+    rebel = RecordingPipeline(load_rebel_backend(model, backend, artifacts, **pipeline_kwargs))
+    load_seconds = time.perf_counter() - started
+    rss_loaded = current_rss_mb()
+    predict_relations(queries[:batch_size], rebel, batch_size)  # Warm-up batch
+    rebel.outputs = []
+    started = time.perf_counter()
+    relations = predict_relations(queries, rebel, batch_size)
+    seconds = time.perf_counter() - started
+    unique = sorted(set(queries), key=len)  # The order predict_relations generates in
+    return {
+        "backend": backend,
+        "load_seconds": round(load_seconds, 3),
+        "predict_seconds": round(seconds, 3),
+        "ms_per_query": round(1000 * seconds / len(unique), 2),
+        "rss_before_load_mb": rss_before,
+        "rss_loaded_mb": rss_loaded,
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "relations_found": sum(relation is not None for relation in relations.values()),
+        "relations": relations,
+        "generations": dict(zip(unique, rebel.outputs)),
+    }
+
+
+def in_subprocess(*arguments):
+    """Runs this script with arguments in a new process and returns the JSON it prints last"""
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), *arguments], capture_output=True, text=True,
+                            cwd=SERVER_DIR)
+    if result.returncode:
+        raise RuntimeError(f"{' '.join(arguments[:2])} failed:\n{result.stderr[-3000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def agreement(result, reference):
+    queries = list(reference["relations"])
+    same_relation = sum(result["relations"].get(query) == reference["relations"][query] for query in queries)
+    found = [query for query in queries if reference["relations"][query] is not None]
+    same_text = sum(result["generations"].get(query) == reference["generations"].get(query) for query in queries)
+    return {
+        "agreement": round(same_relation / len(queries), 4) if queries else None,
+        "agreement_on_found": round(sum(result["relations"].get(query) == reference["relations"][query]
+                                        for query in found) / len(found), 4) if found else None,
+        "identical_generations": round(same_text / len(queries), 4) if queries else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pairs", default=DEFAULT_PAIRS)
+    parser.add_argument("--backends", nargs="+", choices=REBEL_BACKENDS, default=REBEL_BACKENDS)
+    parser.add_argument("--model", default=REBEL_MODEL, help="Hugging Face model name or local folder")
+    parser.add_argument("--standin", action="store_true", help="benchmark a random BART stand-in instead of --model")
+    parser.add_argument("--artifacts", default=None, help=f"artifact cache (default: {REBEL_ARTIFACTS}, "
+                                                          "a temporary folder with --standin)")
+    parser.add_argument("--batch-size", type=int, default=REBEL_BATCH_SIZE)
+    parser.add_argument("--output", default=None, help="also write the results to this JSON file")
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--prepare", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    queries = relation_queries(args.pairs)
+    pipeline_kwargs = {}
+    if args.standin or args.worker or args.prepare:
+        from bench_pipeline import STANDIN_MAX_NEW_TOKENS
+        if args.standin:
+            pipeline_kwargs = {"max_new_tokens": STANDIN_MAX_NEW_TOKENS}  # The pipeline default (256) overrides the config
+    if args.prepare:
+        started = time.perf_counter()
+        export_artifacts(args.model, args.prepare, args.artifacts)
+        print(json.dumps({"seconds": round(time.perf_counter() - started, 2)}))
+        return
+    if args.worker:
+        print(json.dumps(run_backend(args.worker, args.model, queries, args.batch_size, args.artifacts, pipeline_kwargs)))
+        return
+
+    workdir = tempfile.mkdtemp(prefix="bench_rebel_") if args.standin else None
+    model = save_standin(queries, os.path.join(workdir, "model")) if args.standin else args.model
+    artifacts = args.artifacts or (os.path.join(workdir, "artifacts") if args.standin else REBEL_ARTIFACTS)
+    common = ["--model", model, "--artifacts", artifacts, "--pairs", args.pairs, "--batch-size", str(args.batch_size)]
+    common += ["--standin"] if args.standin else []
+    backends = ["torch"] + [backend for backend in args.backends if backend != "torch"]  # fp32 is the reference
+    results = {}
+    for backend in backends:
+        prepare = in_subprocess("--prepare", backend, *common)["seconds"] if backend != "torch" else None
+        results[backend] = in_subprocess("--worker", backend, *common)
+        results[backend]["prepare_seconds"] = prepare
+        print(f"{backend}: {results[backend]['predict_seconds']}s, peak RSS {results[backend]['peak_rss_mb']} MB",
+              file=sys.stderr)
+    report = {"model": "standin " + json.dumps(STANDIN_SIZE) if args.standin else model, "pairs": len(queries),
+              "unique_queries": len(set(queries)), "batch_size": args.batch_size, "backends": {}}
+    for backend, result in results.items():
+        summary = {key: value for key, value in result.items() if key not in ("relations", "generations", "backend")}
+        summary["speedup"] = round(results["torch"]["predict_seconds"] / result["predict_seconds"], 2)
+        report["backends"][backend] = {**summary, **agreement(result, results["torch"])}
+    if workdir:
+        import shutil
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
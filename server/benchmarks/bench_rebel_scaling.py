@@ -0,0 +1,147 @@
+"""Scaling curve of sharded relation extraction (relation_workers.py): throughput for every workers x threads
+combination on the same entity pairs.
+
+Usage (from server/):
+    python benchmarks/bench_rebel_scaling.py [--pairs Dataset/entity_pairs.csv] [--limit 512]
+        [--workers 1 2 4] [--threads 1 2 4] [--backend torch] [--model Babelscape/rebel-large] [--output results.json]
+    python benchmarks/bench_rebel_scaling.py --standin            # random BART stand-in, no model download
+    python benchmarks/bench_rebel_scaling.py --standin --workers 2 --threads 1 --kill-after 5
+
+Every combination gets a fresh pool: load_seconds is the time until every worker has loaded the model (paid once per
+server process), predict_seconds the sharded prediction itself. speedup and efficiency (speedup / cores used) are
+relative to 1 worker x 1 thread when the grid has it, else to the first combination; combinations that use more
+cores than the machine has are still run, but they only show the oversubscription cost. Every combination must find
+the same relations as the first one.
+
+--kill-after kills one busy worker that many seconds into each prediction, to check that only its shard is retried
+and the results are unchanged (restarts and retried_shards in the report).
+"""
+import argparse
+import json
+import os
+import random
+import signal
+import sys
+import tempfile
+import threading
+import time
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pandas as pd
+from Functions import REBEL_BACKEND, REBEL_BATCH_SIZE, REBEL_MODEL, build_relation_queries
+from bench_rebel_backends import DEFAULT_ENTITIES, save_standin
+from persistence import normalize_name
+from rebel_backends import REBEL_BACKENDS
+from relation_workers import REBEL_SHARD_SIZE, RelationWorkerPool
+
+DEFAULT_PAIRS = os.path.join(SERVER_DIR, "Dataset", "entity_pairs.csv")
+
+
+def pairs_frame(pairs_csv, entities_csv=DEFAULT_ENTITIES, limit=None):
+    """Pairs as predict_relationships_from_entity_pairs sees them, all Unknown, Type 1/2 from the entity table"""
+    pairs = pd.read_csv(pairs_csv).rename(columns={"Entity1": "Entity 1", "Entity2": "Entity 2"})
+    pairs = pairs.dropna(subset=["Entity 1", "Entity 2"]).drop_duplicates(["Entity 1", "Entity 2"])
+    entities = pd.read_csv(entities_csv).dropna(subset=["Entity"])
+    labels = dict(zip(entities["Entity"].map(normalize_name), entities["Label"]))
+    for side in ("1", "2"):
+        pairs["Type " + side] = pairs["Entity " + side].map(lambda name: labels.get(normalize_name(name), "ORG"))
+    pairs["Relationship"] = "Unknown"
+    pairs = pairs[["Entity 1", "Type 1", "Entity 2", "Type 2", "Relationship"]]
+    return pairs.head(limit).reset_index(drop=True) if limit else pairs.reset_index(drop=True)
+
+
+def kill_one_worker(pool, after):
+    """Kills a worker that is predicting a shard, `after` seconds from now"""
+    def kill():
+        time.sleep(after)
+        busy = [worker for worker in list(pool._workers.values()) if worker.shard is not None]
+        if busy:
+            os.kill(random.choice(busy).process.pid, signal.SIGKILL)
+    thread = threading.Thread(target=kill, daemon=True)
+    thread.start()
+    return thread
+
+
+def run(pairs, workers, threads, args, pipeline_kwargs):
+    pool = RelationWorkerPool(workers, threads, args.model, args.backend, pipeline_kwargs, shard_size=args.shard_size)
+    started = time.perf_counter()
+    pool.start()
+    load_seconds = time.perf_counter() - started
+    killer = kill_one_worker(pool, args.kill_after) if args.kill_after is not None else None
+    started = time.perf_counter()
+    found, generations = pool.predict(pairs, args.batch_size)
+    seconds = time.perf_counter() - started
+    if killer:
+        killer.join()
+    pool.close()
+    return {
+        "workers": workers,
+        "threads": threads,
+        "cores_used": workers * threads,
+        "load_seconds": round(load_seconds, 3),
+        "predict_seconds": round(seconds, 3),
+        "pairs_per_second": round(len(pairs) / seconds, 2),
+        "generations": generations,
+        "shards": pool.last_run["shards"],
+        "restarts": pool.restarts,
+        "retried_shards": pool.last_run["retried_shards"],
+    }, found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pairs", default=DEFAULT_PAIRS)
+    parser.add_argument("--limit", type=int, default=512, help="first N distinct pairs (0 = all)")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--backend", choices=REBEL_BACKENDS, default=REBEL_BACKEND)
+    parser.add_argument("--model", default=REBEL_MODEL, help="Hugging Face model name or local folder")
+    parser.add_argument("--standin", action="store_true", help="benchmark a random BART stand-in instead of --model")
+    parser.add_argument("--batch-size", type=int, default=REBEL_BATCH_SIZE)
+    parser.add_argument("--shard-size", type=int, default=REBEL_SHARD_SIZE)
+    parser.add_argument("--kill-after", type=float, default=None, help="kill one busy worker this many seconds in")
+    parser.add_argument("--output", default=None, help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    pairs = pairs_frame(args.pairs, limit=args.limit or None)
+    pipeline_kwargs = {}
+    workdir = None
+    if args.standin:
+        from bench_pipeline import STANDIN_MAX_NEW_TOKENS
+        from bench_rebel_backends import STANDIN_SIZE
+        workdir = tempfile.mkdtemp(prefix="bench_rebel_scaling_")
+        args.model = save_standin(build_relation_queries(pairs).tolist(), os.path.join(workdir, "model"))
+        os.environ["REBEL_ARTIFACTS"] = os.path.join(workdir, "artifacts")  # Read by the workers
+        pipeline_kwargs = {"max_new_tokens": STANDIN_MAX_NEW_TOKENS}
+
+    results, reference = [], None
+    for workers in args.workers:
+        for threads in args.threads:
+            result, found = run(pairs, workers, threads, args, pipeline_kwargs)
+            reference = found.sort_index() if reference is None else reference
+            result["same_relations"] = bool(found.sort_index().equals(reference))
+            results.append(result)
+            print(f"{workers} workers x {threads} threads: {result['predict_seconds']}s "
+                  f"({result['pairs_per_second']} pairs/s)", file=sys.stderr)
+    base = next((result for result in results if result["workers"] == result["threads"] == 1), results[0])
+    for result in results:
+        result["speedup"] = round(base["predict_seconds"] / result["predict_seconds"], 2)
+        result["efficiency"] = round(result["speedup"] * base["cores_used"] / result["cores_used"], 2)
+
+    report = {"model": "standin " + json.dumps(STANDIN_SIZE) if args.standin else args.model, "backend": args.backend,
+              "pairs": len(pairs), "shard_size": args.shard_size, "batch_size": args.batch_size,
+              "cpu_count": os.cpu_count(), "results": results}
+    if workdir:
+        import shutil
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Benchmark: EntitySearchIndex build time and query latency on a synthetic entity set.
+
+Usage (from server/):
+    python benchmarks/bench_search.py [--entities 100000] [--queries 2000] [--seed 0]
+
+Names are recombined from the words in Dataset/extracted_entities_cleaned_v2.csv so the trigram
+distribution resembles real data. Queries mix 1-2 character prefixes, longer prefixes, mid-word
+substrings and misspellings.
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search_index import EntitySearchIndex
+
+DATASET_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Dataset")
+
+
+def synthetic_entities(count, rng):
+    with open(os.path.join(DATASET_DIR, "extracted_entities_cleaned_v2.csv"), encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    words = sorted({word for row in rows for word in row["Entity"].split() if word.isalpha() and len(word) > 2})
+    entries = []
+    for i in range(count):
+        name = " ".join(rng.choice(words) for _ in range(rng.choice((1, 2, 2, 3)))).title()
+        entries.append({"entity": name, "label": rng.choice(("PERSON", "ORG")), "file_id": f"file-{i % 500}",
+                        "frequency": int(rng.paretovariate(1.5))})
+    return entries
+
+
+def make_queries(entries, count, rng):
+    queries = []
+    for _ in range(count):
+        name = rng.choice(entries)["entity"].lower()
+        kind = rng.randrange(4)
+        if kind == 0:
+            queries.append(name[:rng.choice((1, 2))])
+        elif kind == 1:
+            queries.append(name[:rng.randint(3, max(3, len(name)))])
+        elif kind == 2 and len(name) > 6:
+            start = rng.randint(1, len(name) - 4)
+            queries.append(name[start:start + 4])
+        else:
+            position = rng.randrange(len(name))
+            queries.append(name[:position] + rng.choice("aeiou") + name[position + 1:])  # One-character typo
+    return queries
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entities", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    entries = synthetic_entities(args.entities, rng)
+    index = EntitySearchIndex()
+    started = time.perf_counter()
+    index.build(entries)
+    build_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    index.add_entities(entries[:1000])  # Incremental update of a typical ingestion
+    update_seconds = time.perf_counter() - started
+
+    latencies = []
+    for query in make_queries(entries, args.queries, rng):
+        started = time.perf_counter()
+        index.search(query, limit=20)
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    print(json.dumps({
+        "entities": args.entities,
+        "indexed_items": len(index),
+        "build_seconds": round(build_seconds, 2),
+        "incremental_update_1000_ms": round(update_seconds * 1000, 2),
+        "queries": len(latencies),
+        "latency_ms": {
+            "mean": round(statistics.mean(latencies), 3),
+            "p50": round(percentile(latencies, 0.50), 3),
+            "p95": round(percentile(latencies, 0.95), 3),
+            "p99": round(percentile(latencies, 0.99), 3),
+        },
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Load test: read-endpoint throughput of serve.py as the number of gunicorn workers grows.
+
+Usage (from server/):
+    python benchmarks/bench_serve.py [--workers 1 2 4] [--threads 4] [--clients 8] [--seconds 10]
+                                     [--mongo-uri mongodb://localhost:27017 | --mongomock --entities 20000]
+
+For each worker count a server is started on a free port and hammered by --clients client processes with a mix
+of read requests (/api/entities/search, /entities/people?limit=100, /healthz) for --seconds. --mongomock seeds an
+in-memory database in the server master before it forks, for machines without MongoDB.
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+
+import requests
+
+QUERIES = ["a", "jo", "kh", "mar", "smith", "ahmed", "bank", "corp", "min", "al"]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve_child(args):
+    """Runs in the server subprocess: optionally seeds mongomock, then hands over to serve.py"""
+    if args.mongomock:
+        import mongomock
+        from bench_search import synthetic_entities
+        from resources import registry
+        client = mongomock.MongoClient()
+        entries = synthetic_entities(args.entities, random.Random(0))
+        for i, entry in enumerate(entries):
+            entry["_id"] = f"{i:08d}"
+        client["aka_datathon"]["Entities"].insert_many(entries)
+        registry.set("mongo", client)  # Inherited by the forked workers
+    import serve
+    sys.argv = ["serve.py", "--bind", f"127.0.0.1:{args.port}", "--workers", str(args.workers[0]),
+                "--threads", str(args.threads), "--no-preload"]
+    serve.main()
+
+
+def client_loop(base_url, seconds, seed):
+    rng = random.Random(seed)
+    session = requests.Session()
+    done, errors, deadline = 0, 0, time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        kind = rng.randrange(10)
+        if kind < 6:
+            url = f"{base_url}/api/entities/search?query={rng.choice(QUERIES)}&limit=20"
+        elif kind < 9:
+            url = f"{base_url}/entities/people?limit=100"
+        else:
+            url = f"{base_url}/healthz"
+        try:
+            ok = session.get(url, timeout=30).status_code < 400
+        except requests.RequestException:
+            ok = False
+        done += ok
+        errors += not ok
+    return done, errors
+
+
+def wait_ready(base_url, timeout=120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(f"{base_url}/readyz", timeout=5).status_code == 200:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    return False
+
+
+def run(workers, args):
+    port = free_port()
+    command = [sys.executable, os.path.abspath(__file__), "--serve-child", "--port", str(port), "--workers", str(workers),
+               "--threads", str(args.threads), "--entities", str(args.entities)] + (["--mongomock"] if args.mongomock else [])
+    env = {**os.environ, **({"MONGO_URI": args.mongo_uri} if args.mongo_uri else {})}
+    server = subprocess.Popen(command, cwd=SERVER_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        if not wait_ready(base_url):
+            raise RuntimeError(f"server with {workers} workers did not become ready")
+        with ProcessPoolExecutor(max_workers=args.clients) as executor:
+            results = list(executor.map(client_loop, [base_url] * args.clients, [args.seconds] * args.clients,
+                                        range(args.clients)))
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    requests_done = sum(done for done, _ in results)
+    return {"workers": workers, "requests": requests_done, "errors": sum(errors for _, errors in results),
+            "requests_per_second": round(requests_done / args.seconds, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--mongo-uri", default=None)
+    parser.add_argument("--mongomock", action="store_true")
+    parser.add_argument("--entities", type=int, default=20000, help="entities seeded with --mongomock")
+    parser.add_argument("--serve-child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_child:
+        return serve_child(args)
+    results = [run(workers, args) for workers in args.workers]
+    baseline = results[0]["requests_per_second"] or 1
+    for result in results:
+        result["speedup"] = round(result["requests_per_second"] / baseline, 2)
+    print(json.dumps({"cpus": os.cpu_count(), "threads_per_worker": args.threads, "clients": args.clients,
+                      "seconds": args.seconds, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
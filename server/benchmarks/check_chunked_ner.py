@@ -0,0 +1,87 @@
+"""Check: chunked NER and pairing of long documents give the same tables as whole-document NER.
+
+Usage (from server/):
+    python benchmarks/check_chunked_ner.py [--documents 3] [--pages 12] [--chunk-chars 1000] [--seed 0]
+
+Writes synthetic documents (synthetic_pdfs.page_text) in which every third page has no sentence ends at all and one
+page is a single unpunctuated run longer than a chunk, as tables and lists come out of PDFs. Then, per window setting
+and with and without a sentencizer, compares extract_entities_and_pairs_from_text_files on whole documents with the
+same call on chunks of --chunk-chars (overlap a quarter of that), tagging with a gazetteer of the corpus names.
+Prints one line per setting and exits with status 1 if any entities or pairs table differs.
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_pipeline import gazetteer_model
+from canonicalize import AliasIndex
+from Functions import extract_entities_and_pairs_from_text_files
+from synthetic_pdfs import entity_pool, page_text
+
+# (sentence_window, token_window)
+WINDOWS = [(0, 0), (1, 0), (0, 10), (2, 25)]
+
+
+def write_documents(folder, documents, pages, chunk_chars, seed):
+    """Text files with unpunctuated pages and runs; returns the corpus names for the gazetteer"""
+    rng = random.Random(seed)
+    people, organisations = entity_pool(rng)
+    for document in range(documents):
+        texts = []
+        for page in range(pages):
+            text = page_text(rng, people, organisations, 20)
+            if page % 3 == 1:
+                text = text.replace(".", "")  # No sentence ends on the page
+            texts.append(text)
+        run = []
+        while sum(map(len, run)) < 2 * chunk_chars:  # One sentence longer than any chunk
+            run.append(page_text(rng, people, organisations, 20).replace(".", ""))
+        texts.insert(pages // 2, " ".join(run))
+        with open(os.path.join(folder, f"document_{document}.txt"), "w", encoding="utf-8") as f:
+            f.write("\n".join(texts))
+    return {"people": people, "organisations": organisations}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=3)
+    parser.add_argument("--pages", type=int, default=12)
+    parser.add_argument("--chunk-chars", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp(prefix="check_chunked_ner_")
+    failures = 0
+    try:
+        corpus = write_documents(folder, args.documents, args.pages, args.chunk_chars, args.seed)
+        whole_chars = 1 + max(os.path.getsize(os.path.join(folder, name)) for name in os.listdir(folder))
+        for sentences in (True, False):
+            nlp = gazetteer_model(corpus)
+            nlp.max_length = max(nlp.max_length, whole_chars)
+            if not sentences:
+                nlp.remove_pipe("sentencizer")
+            for sentence_window, token_window in WINDOWS:
+                windows = {"sentence_window": sentence_window, "token_window": token_window}
+                whole = extract_entities_and_pairs_from_text_files(folder, nlp=nlp, aliases=AliasIndex(),
+                                                                   chunk_chars=whole_chars, **windows)
+                chunked = extract_entities_and_pairs_from_text_files(folder, nlp=nlp, aliases=AliasIndex(),
+                                                                     chunk_chars=args.chunk_chars,
+                                                                     chunk_overlap=args.chunk_chars // 4, **windows)
+                same = [whole_table.equals(chunked_table) for whole_table, chunked_table in zip(whole, chunked)]
+                failures += not all(same)
+                print(f"{'sentencizer' if sentences else 'no sentences'}, sentence_window={sentence_window}, "
+                      f"token_window={token_window}: {len(whole[0])} entities {'same' if same[0] else 'DIFFER'}, "
+                      f"{len(whole[1])} pairs {'same' if same[1] else 'DIFFER'}")
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
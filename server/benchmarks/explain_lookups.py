@@ -0,0 +1,56 @@
+"""Checks with explain() that the entity and relationship lookups are index scans, not collection scans.
+
+Usage (from server/):
+    python benchmarks/explain_lookups.py [--mongo-uri mongodb://localhost:27017] [--db aka_datathon] [--name "Smith (Jr.)"]
+
+Creates the backend's indexes if they are missing and exits non-zero if any lookup plan uses COLLSCAN.
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+from pymongo import MongoClient
+from persistence import ensure_indexes, entity_name_query, relationships_by_entity_query
+
+
+def plan_stages(plan):
+    """All stage names in a (possibly nested) winning plan"""
+    stages = [plan.get("stage")]
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            stages += plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        stages += plan_stages(child)
+    return [stage for stage in stages if stage]
+
+
+def check(collection, query):
+    explanation = collection.find(query).explain()
+    stages = plan_stages(explanation["queryPlanner"]["winningPlan"])
+    return {"query": query, "stages": stages, "ok": "IXSCAN" in stages and "COLLSCAN" not in stages}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-uri", default=None, help="defaults to MONGO_URI from .env")
+    parser.add_argument("--db", default="aka_datathon")
+    parser.add_argument("--name", default="Smith (Jr.)", help="entity name to look up, special characters included")
+    args = parser.parse_args()
+
+    load_dotenv()
+    db = MongoClient(args.mongo_uri or os.getenv("MONGO_URI"))[args.db]
+    ensure_indexes(db["Entities"], db["Relationships"])
+    results = [
+        check(db["Entities"], entity_name_query(args.name)),
+        check(db["Relationships"], relationships_by_entity_query(args.name)),
+    ]
+    print(json.dumps(results, indent=2))
+    sys.exit(0 if all(result["ok"] for result in results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Report: entity pair candidates from all-pairs combinations vs sentence/token co-occurrence windows.
+
+Usage (from server/):
+    python benchmarks/report_pair_reduction.py [--pdfs Dataset/pdfs] [--model en_core_web_sm | --gazetteer]
+
+Extracts and cleans the text of every PDF, runs NER once per document and counts, per window setting, the
+candidate pairs (= REBEL generations before this change) and the distinct evidence texts (= generations after it).
+--gazetteer tags the names of Dataset/extracted_entities_cleaned_v2.csv with a rule-based matcher instead of a
+statistical model, for environments without en_core_web_sm.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from itertools import combinations
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+import spacy
+from Functions import clean_extracted_text, cooccurring_pairs, extract_text_from_pdf, load_ner_model, normalize_entity
+
+DATASET_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Dataset")
+WINDOWS = [("same sentence", 0, 0), ("±1 sentence", 1, 0), ("±2 sentences", 2, 0), ("same sentence or ≤20 tokens", 0, 20)]
+
+
+def gazetteer_model():
+    nlp = spacy.blank("en")
+    nlp.add_pipe("sentencizer")
+    ruler = nlp.add_pipe("entity_ruler", config={"phrase_matcher_attr": "LOWER"})
+    entities = pd.read_csv(os.path.join(DATASET_DIR, "extracted_entities_cleaned_v2.csv"))
+    entities = entities[entities["Label"].isin(["PERSON", "ORG"])].drop_duplicates(["Entity", "Label"])
+    ruler.add_patterns([{"label": label, "pattern": entity} for entity, label in zip(entities["Entity"], entities["Label"])])
+    return nlp
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdfs", default=os.path.join(DATASET_DIR, "pdfs"))
+    parser.add_argument("--model", default="en_core_web_sm")
+    parser.add_argument("--gazetteer", action="store_true")
+    args = parser.parse_args()
+
+    nlp = gazetteer_model() if args.gazetteer else load_ner_model(args.model)
+    pdf_files = sorted(name for name in os.listdir(args.pdfs) if name.lower().endswith(".pdf"))
+    texts = [clean_extracted_text(extract_text_from_pdf(os.path.join(args.pdfs, name))) for name in pdf_files]
+
+    all_pairs = 0
+    windowed = {name: {"pairs": 0, "evidence_texts": 0, "seconds": 0.0} for name, _, _ in WINDOWS}
+    for doc in nlp.pipe(texts):
+        mentions = []
+        for ent in doc.ents:
+            entity_text = normalize_entity(ent)
+            if entity_text is not None:
+                mentions.append(((entity_text, ent.label_), ent))
+        all_pairs += sum(1 for _ in combinations(dict.fromkeys(key for key, _ in mentions), 2))
+        for name, sentence_window, token_window in WINDOWS:
+            started = time.perf_counter()
+            pairs = cooccurring_pairs(doc, mentions, sentence_window, token_window)
+            windowed[name]["seconds"] += time.perf_counter() - started
+            windowed[name]["pairs"] += len(pairs)
+            windowed[name]["evidence_texts"] += len({evidence for _, evidence in pairs.values()})
+
+    for stats in windowed.values():
+        stats["reduction"] = f"{1 - stats['pairs'] / all_pairs:.1%}" if all_pairs else None
+        stats["seconds"] = round(stats["seconds"], 3)
+    print(json.dumps({"documents": len(pdf_files), "ner": "gazetteer" if args.gazetteer else args.model,
+                      "all_pairs": all_pairs, "windows": windowed}, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
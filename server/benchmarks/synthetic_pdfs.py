@@ -0,0 +1,92 @@
+"""Synthetic PDF corpus for the pipeline benchmarks, written with PyMuPDF.
+
+Usage (from server/):
+    python benchmarks/synthetic_pdfs.py OUTPUT_FOLDER [--documents 5] [--pages 10] [--entities-per-page 20] [--seed 0]
+
+Every page holds news-style sentences mentioning people and organisations from a fixed pool of generated names,
+padded with filler sentences to a realistic amount of text. The same seed always produces the same corpus.
+"""
+import argparse
+import json
+import os
+import random
+import fitz  # PyMuPDF
+
+FIRST_NAMES = ["Ahmad", "Maria", "John", "Wei", "Fatima", "Daniel", "Aisha", "Carlos", "Mei", "Omar", "Elena", "Rahul",
+               "Sarah", "Hassan", "Lina", "Victor", "Nadia", "Peter", "Yusuf", "Grace"]
+SURNAMES = ["Khan", "Santos", "Smith", "Chen", "Rahman", "Novak", "Ibrahim", "Garcia", "Tan", "Haddad", "Petrova", "Gupta",
+            "Jones", "Ali", "Costa", "Moreau", "Karimi", "Walsh", "Demir", "Okafor"]
+ORG_WORDS = ["Apex", "Crescent", "Meridian", "Northwind", "Sable", "Harbor", "Summit", "Vantage", "Orion", "Keystone"]
+ORG_SUFFIXES = ["Holdings", "Logistics", "Bank", "Trading", "Ministry", "Group", "Shipping", "Capital"]
+TEMPLATES = [
+    "{0} met {1} in the capital last week to discuss the contract.",
+    "According to the report, {0} transferred funds to {1} through an intermediary.",
+    "{0} was appointed director of {1} in March.",
+    "Officials said {0} and {1} had been in contact since the election.",
+    "{0} denied any links to {1}.",
+    "The investigation into {0} was opened after a complaint by {1} and {2}.",
+]
+FILLER = [
+    "The documents were obtained by reporters earlier this year.",
+    "No further details were provided by the authorities.",
+    "The meeting took place behind closed doors.",
+    "Several questions remain unanswered about the transaction.",
+    "A spokesperson declined to comment on the allegations.",
+    "The case is expected to be heard later this month.",
+]
+PAGE_RECT = fitz.Rect(50, 50, 545, 792)
+WORDS_PER_PAGE = 350
+
+
+def entity_pool(rng, people=200, organisations=60):
+    """(people, organisations) name lists, deterministic for a given rng"""
+    person_names = sorted({f"{rng.choice(FIRST_NAMES)} {rng.choice(SURNAMES)}" for _ in range(people * 3)})[:people]
+    org_names = sorted({f"{rng.choice(ORG_WORDS)} {rng.choice(ORG_SUFFIXES)}" for _ in range(organisations * 3)})[:organisations]
+    return person_names, org_names
+
+
+def page_text(rng, people, organisations, entities_per_page):
+    sentences, mentions = [], 0
+    while mentions < entities_per_page:
+        template = rng.choice(TEMPLATES)
+        slots = template.count("{")
+        names = [rng.choice(people) if rng.random() < 0.7 else rng.choice(organisations) for _ in range(slots)]
+        sentences.append(template.format(*names))
+        mentions += slots
+    while sum(len(sentence.split()) for sentence in sentences) < WORDS_PER_PAGE:
+        sentences.insert(rng.randrange(len(sentences) + 1), rng.choice(FILLER))
+    return " ".join(sentences)
+
+
+def generate_corpus(folder, documents=5, pages=10, entities_per_page=20, seed=0):
+    """Writes documents PDFs to folder; returns {"files": [...], "people": [...], "organisations": [...]}"""
+    os.makedirs(folder, exist_ok=True)
+    rng = random.Random(seed)
+    people, organisations = entity_pool(rng)
+    files = []
+    for document_number in range(documents):
+        path = os.path.join(folder, f"synthetic_{seed}_{document_number:04d}.pdf")
+        with fitz.open() as pdf:
+            for _ in range(pages):
+                page = pdf.new_page()
+                page.insert_textbox(PAGE_RECT, page_text(rng, people, organisations, entities_per_page), fontsize=9)
+            pdf.save(path)
+        files.append(path)
+    return {"files": files, "people": people, "organisations": organisations}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("output_folder")
+    parser.add_argument("--documents", type=int, default=5)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--entities-per-page", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    corpus = generate_corpus(args.output_folder, args.documents, args.pages, args.entities_per_page, args.seed)
+    print(json.dumps({"files": len(corpus["files"]), "people": len(corpus["people"]),
+                      "organisations": len(corpus["organisations"])}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,426 @@
+"""Alias canonicalization: merges spellings of the same PERSON / ORG across the corpus into one canonical entity.
+
+Usage (from server/):
+    python canonicalize.py --entities Dataset/extracted_entities_cleaned_v2.csv [--pairs Dataset/entity_pairs.csv]
+                           [--output LocalDB/aliases.csv] [--no-save]
+
+Names are only compared within blocks that share a key (surname, initials + surname, Soundex code of the surname;
+for ORG the first word, its Soundex code and the acronym), so the work stays near-linear in the number of names.
+Within a block all names are scored at once with a trigram cosine-similarity matrix. Names are merged when they
+
+- are the same once spaces are removed ("la cresta" / "lacresta")
+- are similar enough (SIMILARITY_THRESHOLD) with the same numbers and surname initial ("john negropont" / "john negroponte")
+- are a bare surname or initials + surname of exactly one full name ("khan", "a. khan" -> "ahmad khan")
+- are the acronym of exactly one ORG name ("undp" -> "united nations development programme")
+
+The CLI writes the mapping (Entity, Label, Canonical ID, Canonical Entity, Rule) and reports how many entities and
+pairs the merge removes. At runtime registry.get("aliases") loads it (see resources.py) and NER maps every mention
+through AliasIndex.canonical(); names the mapping does not know are matched against the known ones the same way and
+recorded in the Aliases collection that all server processes share (the first process to record a name wins), so
+canonical IDs never change once assigned and every process uses the same ones. Re-run the CLI over the stored entity
+tables (LocalDB/cache/*/entities.csv) to re-pick them over the whole corpus.
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import threading
+from collections import Counter
+import numpy as np
+from pymongo import ReturnDocument
+from persistence import ALIAS_SEPARATOR, content_id, normalize_name
+from search_index import trigrams
+
+ALIASES_PATH = os.getenv("ALIASES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "LocalDB", "aliases.csv"))
+CANONICAL_LABELS = ("PERSON", "ORG")
+SIMILARITY_THRESHOLD = float(os.getenv("ALIAS_SIMILARITY_THRESHOLD", 0.8))
+MAX_BLOCK_SIZE = 200  # Larger blocks (very common keys) are too unspecific to be worth comparing pairwise
+TITLES = {"mr", "mrs", "ms", "dr", "sir", "prof", "president", "minister", "ambassador"}
+MAPPING_COLUMNS = ["Entity", "Label", "Canonical ID", "Canonical Entity", "Rule"]
+
+_SOUNDEX_CODES = {char: digit for digit, chars in enumerate(["aeiouy", "bfpv", "cgjkqsxz", "dt", "l", "mn", "r"]) for char in chars}
+
+def soundex(word):
+    """American Soundex, e.g. "negroponte" -> "N216"; characters without a code (digits, accents) are skipped"""
+    letters = [char for char in word if char in _SOUNDEX_CODES or char in "hw"]
+    if not letters:
+        return ""
+    code, previous = letters[0].upper(), _SOUNDEX_CODES.get(letters[0])
+    for char in letters[1:]:
+        if char in "hw":  # h and w do not separate two letters with the same code
+            continue
+        digit = _SOUNDEX_CODES[char]
+        if digit and digit != previous:
+            code += str(digit)
+            if len(code) == 4:
+                break
+        previous = digit
+    return code.ljust(4, "0")
+
+def name_tokens(name, label):
+    """Lowercase words without punctuation, possessives, titles (PERSON) or a leading "the" (ORG),
+    e.g. "Mr. A. Khan's" -> ["a", "khan"]"""
+    words = re.sub(r"[^\w\s]", " ", normalize_name(name).replace("'s ", " ").removesuffix("'s")).split()
+    if label == "PERSON":
+        words = [word for word in words if word not in TITLES] or words
+    elif words[:1] == ["the"] and len(words) > 1:
+        words = words[1:]
+    return words
+
+def _key_tokens(name, label):
+    """Words that identify a name; labels that are not canonicalized keep the whole normalized name"""
+    return name_tokens(name, label) if label in CANONICAL_LABELS else [normalize_name(name)]
+
+def _singular(word):
+    return word[:-1] if len(word) > 4 and word.endswith("s") and not word.endswith("ss") else word
+
+def blocking_keys(tokens, label):
+    if label == "PERSON":
+        surname = tokens[-1]
+        keys = {("surname", surname), ("phonetic", soundex(_singular(surname)))}
+        if len(tokens) > 1:
+            keys.add(("initials", "".join(token[0] for token in tokens[:-1]) + " " + surname))
+        return keys
+    keys = {("first", tokens[0]), ("phonetic", soundex(_singular(tokens[0])))}
+    keys.add(("acronym", "".join(token[0] for token in tokens) if len(tokens) > 1 else tokens[0]))
+    return keys
+
+def trigram_matrix(strings):
+    """Row-normalized binary trigram vectors, so matrix @ matrix.T is the pairwise cosine similarity"""
+    grams = [trigrams(f" {string} ") for string in strings]
+    vocabulary = {gram: i for i, gram in enumerate(set().union(*grams))}
+    matrix = np.zeros((len(strings), len(vocabulary)), dtype=np.float32)
+    for row, string_grams in enumerate(grams):
+        matrix[row, [vocabulary[gram] for gram in string_grams]] = 1
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-9)
+
+def _numbers(tokens):
+    return [token for token in tokens if any(char.isdigit() for char in token)]
+
+def _compatible(a, b, label):
+    """Guards against merging near-identical but different names ("vendor 1" / "vendor 2", "john kerry" / "john terry")"""
+    if _numbers(a) != _numbers(b):
+        return False
+    return label != "PERSON" or a[-1][0] == b[-1][0]
+
+def subset_rule(short, full, label):
+    """Rule under which short is a partial form of full, None if it is not"""
+    if label == "PERSON":
+        if len(short) > len(full) or len(full) == 1 or _numbers(full) or _singular(short[-1]) != _singular(full[-1]):
+            return None
+        if len(short) == 1:
+            return "surname"
+        if short != full and all(len(word) == 1 and word == token[0] for word, token in zip(short[:-1], full)):
+            return "initials"
+        return None
+    if len(short) == 1 and len(full) > 1 and len(short[0]) >= 3 and short[0] == "".join(token[0] for token in full):
+        return "acronym"
+    return None
+
+
+class AliasIndex:
+    """Canonical IDs for (name, label); thread-safe. Only CANONICAL_LABELS are merged, other labels map to themselves.
+
+    store: optional MongoDB collection shared by the processes that assign IDs to new names, see canonical()"""
+
+    def __init__(self, store=None):
+        self.store = store
+        self._lock = threading.Lock()
+        self._nodes = {}  # (token key, label) -> node id
+        self._tokens, self._labels, self._counts, self._spellings = [], [], [], []
+        self._parent = []  # Union-find over nodes
+        self._rules = []  # Why a node joined its cluster
+        self._canonical = {}  # root node -> canonical node
+        self._assigned = {}  # node -> (canonical ID, canonical name) recorded in the store
+        self._blocks = {}  # (label, blocking key) -> node ids
+
+    def __len__(self):
+        return len(self._tokens)
+
+    # Union-find
+    def _find(self, node):
+        while self._parent[node] != node:
+            self._parent[node] = self._parent[self._parent[node]]
+            node = self._parent[node]
+        return node
+
+    def _union(self, a, b, rule):
+        root_a, root_b = self._find(a), self._find(b)
+        if root_a == root_b:
+            return
+        if self._rules[b] is None:
+            self._rules[b] = rule
+        elif self._rules[a] is None:
+            self._rules[a] = rule
+        self._parent[root_b] = root_a
+
+    def _add_node(self, tokens, label, spelling, count):
+        key = (" ".join(tokens), label)
+        node = self._nodes.get(key)
+        if node is None:
+            node = self._nodes[key] = len(self._tokens)
+            self._tokens.append(tokens)
+            self._labels.append(label)
+            self._counts.append(Counter())
+            self._spellings.append(spelling)
+            self._parent.append(node)
+            self._rules.append(None)
+            for block_key in blocking_keys(tokens, label):
+                self._blocks.setdefault((label, block_key), []).append(node)
+        self._counts[node][spelling] += count
+        return node
+
+    def _block_members(self, node):
+        members = set()
+        for block_key in blocking_keys(self._tokens[node], self._labels[node]):
+            block = self._blocks.get((self._labels[node], block_key), ())
+            if len(block) <= MAX_BLOCK_SIZE:
+                members.update(block)
+        members.discard(node)
+        return sorted(members)
+
+    def _similar_pairs(self, nodes):
+        """(a, b) node pairs of one block scoring at least SIMILARITY_THRESHOLD, from one similarity matrix"""
+        matrix = trigram_matrix(["".join(self._tokens[node]) for node in nodes])
+        similarity = matrix @ matrix.T
+        rows, columns = np.nonzero(np.triu(similarity >= SIMILARITY_THRESHOLD, k=1))
+        return [(nodes[i], nodes[j]) for i, j in zip(rows.tolist(), columns.tolist())]
+
+    def _merge_subset(self, short, candidates):
+        """Joins short to the one cluster of full names it is a partial form of; ambiguous short forms stay apart"""
+        matches = {}
+        for full in candidates:
+            rule = subset_rule(self._tokens[short], self._tokens[full], self._labels[short])
+            if rule:
+                matches.setdefault(self._find(full), (full, rule))
+        if len(matches) == 1:
+            full, rule = next(iter(matches.values()))
+            self._union(full, short, rule)
+
+    def _display(self, node):
+        return " ".join(self._spellings[node].split())
+
+    def _pick_canonical(self, members):
+        """Most mentioned full name (for PERSON: more than one word), then the longest"""
+        def rank(node):
+            full = len(self._tokens[node]) > 1 or self._labels[node] != "PERSON"
+            return (full, sum(self._counts[node].values()), len(self._tokens[node]), self._spellings[node])
+        return max(members, key=rank)
+
+    def build(self, entries):
+        """Clusters the whole corpus at once; entries are (name, label, mention count) tuples"""
+        with self._lock:
+            for name, label, count in entries:
+                tokens = _key_tokens(name, label)
+                if tokens and tokens[0]:
+                    self._add_node(tokens, label, name, count)
+            compact = {}
+            for node, tokens in enumerate(self._tokens):
+                if self._labels[node] in CANONICAL_LABELS:
+                    other = compact.setdefault(("".join(tokens), self._labels[node]), node)
+                    if other != node:
+                        self._union(other, node, "exact")
+            for (label, _), block in self._blocks.items():
+                if 1 < len(block) <= MAX_BLOCK_SIZE:
+                    for a, b in self._similar_pairs(block):
+                        if _compatible(self._tokens[a], self._tokens[b], label):
+                            self._union(a, b, "similar")
+            for node in range(len(self)):
+                if self._labels[node] in CANONICAL_LABELS:
+                    self._merge_subset(node, self._block_members(node))
+            clusters = {}
+            for node in range(len(self)):
+                clusters.setdefault(self._find(node), []).append(node)
+            self._canonical = {root: self._pick_canonical(members) for root, members in clusters.items()}
+        return len(clusters)
+
+    def _match_new(self, node):
+        """Online path for a name first seen after build(): joins the best matching known cluster, if any"""
+        label = self._labels[node]
+        candidates = self._block_members(node)
+        if label not in CANONICAL_LABELS or not candidates:
+            return
+        compact = "".join(self._tokens[node])
+        for other in candidates:
+            if "".join(self._tokens[other]) == compact:
+                return self._union(other, node, "exact")
+        matrix = trigram_matrix([compact] + ["".join(self._tokens[other]) for other in candidates])
+        scores = matrix[1:] @ matrix[0]
+        for index in np.argsort(-scores):
+            other = candidates[index]
+            if scores[index] < SIMILARITY_THRESHOLD:
+                break
+            if _compatible(self._tokens[node], self._tokens[other], label):
+                return self._union(other, node, "similar")
+        self._merge_subset(node, candidates)
+        if self._find(node) == node:  # A fuller form of one known partial name joins it, unless it has a full name already
+            roots = {self._find(other) for other in candidates
+                     if subset_rule(self._tokens[other], self._tokens[node], label)}
+            named = {self._find(other) for other in candidates
+                     if len(self._tokens[other]) > 1 and not subset_rule(self._tokens[other], self._tokens[node], label)}
+            if len(roots) == 1 and not roots & named:
+                self._union(roots.pop(), node, "fuller")
+
+    def _record(self, node, name, label):
+        """Records the canonical entity of a new name in the store, unless another process recorded the name first:
+        then its choice is used, so the name gets the same ID in every process"""
+        canonical = self._canonical[self._find(node)]
+        stored = self.store.find_one_and_update(
+            {"_id": content_id(label, " ".join(self._tokens[node]))},
+            {"$setOnInsert": {"entity": name, "label": label,
+                              "canonical_id": content_id(label, " ".join(self._tokens[canonical])),
+                              "canonical_entity": self._display(canonical), "rule": self._rules[node] or ""}},
+            upsert=True, return_document=ReturnDocument.AFTER)
+        self._assigned[node] = (stored["canonical_id"], stored["canonical_entity"])
+
+    def canonical(self, name, label):
+        """(canonical ID, canonical name) for a name; unknown names are matched and remembered (and recorded in the
+        store, if there is one)"""
+        with self._lock:
+            tokens = _key_tokens(name, label)
+            if not tokens or not tokens[0]:
+                return content_id(label, normalize_name(name)), name
+            key = (" ".join(tokens), label)
+            node = self._nodes.get(key)
+            if node is None:
+                node = self._add_node(tokens, label, name, 1)
+                self._match_new(node)
+                self._canonical.setdefault(self._find(node), node)
+                if self.store is not None:
+                    self._record(node, name, label)
+            if node in self._assigned:
+                return self._assigned[node]
+            canonical = self._canonical[self._find(node)]
+            return content_id(label, " ".join(self._tokens[canonical])), self._display(canonical)
+
+    def mapping(self):
+        """[(name, label, canonical ID, canonical name, rule)] for every spelling seen"""
+        with self._lock:
+            rows = []
+            for node in range(len(self)):
+                canonical = self._canonical[self._find(node)]
+                canonical_id, canonical_name = self._assigned.get(node) or (
+                    content_id(self._labels[node], " ".join(self._tokens[canonical])), self._display(canonical))
+                for spelling in self._counts[node]:
+                    rows.append((spelling, self._labels[node], canonical_id, canonical_name,
+                                 self._rules[node] or ("" if node == canonical else "cluster")))
+            return rows
+
+    def save(self, path):
+        """Writes the mapping as CSV (atomically)"""
+        rows = self.mapping()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path + ".tmp", "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(MAPPING_COLUMNS)
+            writer.writerows(rows)
+        os.replace(path + ".tmp", path)
+        return len(rows)
+
+    @classmethod
+    def load(cls, path, store=None):
+        """Index from a saved mapping: every spelling joins the cluster of its canonical entity; empty if path is
+        missing. Names recorded in the store since keep the canonical entity recorded for them."""
+        index = cls(store)
+        rows = []
+        if os.path.exists(path):
+            with open(path, encoding="utf-8", newline="") as f:
+                rows = list(csv.DictReader(f))
+        canonical_nodes = {}
+        for row in rows:
+            label = row["Label"]
+            tokens = _key_tokens(row["Entity"], label)
+            if not tokens or not tokens[0]:
+                continue
+            node = index._add_node(tokens, label, row["Entity"], 1)
+            if " ".join(row["Entity"].split()) == row["Canonical Entity"]:
+                canonical_nodes[row["Canonical ID"]] = node
+        for row in rows:
+            node = index._nodes.get((" ".join(_key_tokens(row["Entity"], row["Label"])), row["Label"]))
+            canonical = canonical_nodes.get(row["Canonical ID"])
+            if node is not None and canonical is not None and node != canonical:
+                index._union(canonical, node, row["Rule"] or "cluster")
+        for root in {index._find(node) for node in range(len(index))}:
+            index._canonical[root] = root
+        for node in canonical_nodes.values():
+            index._canonical[index._find(node)] = node
+        for recorded in store.find() if store is not None else ():
+            tokens = _key_tokens(recorded["entity"], recorded["label"])
+            if tokens and tokens[0]:
+                node = index._add_node(tokens, recorded["label"], recorded["entity"], 1)
+                index._canonical.setdefault(index._find(node), node)
+                index._assigned[node] = (recorded["canonical_id"], recorded["canonical_entity"])
+        return index
+
+
+def reduction_report(entities, index, pairs=None):
+    """Entity and pair counts before and after mapping every name to its canonical entity"""
+    import pandas as pd
+    kept = entities[entities["Label"].isin(CANONICAL_LABELS)]
+    canonical = {(name, label): index.canonical(name, label)[0] for name, label in
+                 kept[["Entity", "Label"]].drop_duplicates().itertuples(index=False, name=None)}
+    kept = kept.assign(canonical=[canonical[key] for key in zip(kept["Entity"], kept["Label"])])
+    report = {"entities": {}, "all_pairs_per_file": {}}
+    for label in CANONICAL_LABELS:
+        rows = kept[kept["Label"] == label]
+        report["entities"][label] = {"before": int(rows[["Entity"]].drop_duplicates().shape[0]),
+                                     "after": int(rows["canonical"].nunique())}
+    before = kept.drop_duplicates(["File Name", "Entity", "Label"]).groupby("File Name").size()
+    after = kept.drop_duplicates(["File Name", "canonical"]).groupby("File Name").size()
+    report["all_pairs_per_file"] = {"before": int((before * (before - 1) // 2).sum()),
+                                    "after": int((after * (after - 1) // 2).sum())}
+    if pairs is not None:
+        by_name = {}
+        for (name, _), canonical_id in canonical.items():
+            by_name.setdefault(name, canonical_id)
+        mapped = pairs.assign(a=pairs["Entity1"].map(by_name).fillna(pairs["Entity1"]),
+                              b=pairs["Entity2"].map(by_name).fillna(pairs["Entity2"]))
+        mapped = mapped[mapped["a"] != mapped["b"]]
+        ends = np.sort(mapped[["a", "b"]].to_numpy(dtype=str), axis=1)
+        mapped = mapped.assign(a=ends[:, 0], b=ends[:, 1]).drop_duplicates(["File Name", "a", "b"])
+        report["entity_pairs"] = {"before": int(pairs.drop_duplicates().shape[0]), "after": len(mapped)}
+    for section in report.values():
+        for counts in section.values() if "before" not in section else [section]:
+            counts["reduction"] = f"{1 - counts['after'] / counts['before']:.1%}" if counts["before"] else None
+    return report
+
+
+def main():
+    import pandas as pd
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entities", nargs="+", required=True, help="entity CSVs (File Name, Entity, Label[, Mentions])")
+    parser.add_argument("--pairs", default=None, help="pair CSV (File Name, Entity1, Entity2) to count pairs before/after")
+    parser.add_argument("--output", default=ALIASES_PATH, help="where to write the mapping (default: ALIASES_PATH)")
+    parser.add_argument("--no-save", action="store_true", help="only report, do not write the mapping")
+    parser.add_argument("--examples", type=int, default=15, help="merged clusters to print")
+    args = parser.parse_args()
+
+    entities = pd.concat([pd.read_csv(path) for path in args.entities], ignore_index=True)
+    entities = entities.dropna(subset=["Entity", "Label"])
+    mentions = entities["Mentions"] if "Mentions" in entities else pd.Series(1, index=entities.index)
+    totals = mentions.groupby([entities["Entity"], entities["Label"]]).sum()
+    if "Aliases" in entities:  # Entity tables written by the pipeline: spellings already merged into Entity
+        spellings = entities.dropna(subset=["Aliases"])
+        extra = [(alias, label) for aliases, label in zip(spellings["Aliases"], spellings["Label"])
+                 for alias in str(aliases).split(ALIAS_SEPARATOR)]
+        totals = pd.concat([totals, pd.Series(1, index=pd.MultiIndex.from_tuples(extra))]).groupby(level=[0, 1]).sum() \
+            if extra else totals
+    index = AliasIndex()
+    index.build((name, label, int(count)) for (name, label), count in totals.items())
+
+    report = reduction_report(entities, index, pd.read_csv(args.pairs) if args.pairs else None)
+    clusters = {}
+    for name, label, canonical_id, canonical_name, _ in index.mapping():
+        if label in CANONICAL_LABELS:
+            clusters.setdefault((label, canonical_name), set()).add(name)
+    merged = sorted(((key, names) for key, names in clusters.items() if len(names) > 1), key=lambda item: -len(item[1]))
+    report["merged_clusters"] = len(merged)
+    report["examples"] = {f"{label}: {name}": sorted(names) for (label, name), names in merged[:args.examples]}
+    if not args.no_save:
+        report["mapping_rows"] = index.save(args.output)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
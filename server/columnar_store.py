@@ -0,0 +1,158 @@
+"""Typed, columnar stage artifacts: the entities, pairs and relationships tables the pipeline stages hand each other.
+
+Every table is stored per source document (LocalDB/cache/<sha256>/<stage>.arrow, see ingestion.py), so a new upload
+only writes its own partitions and a stage reads back only the documents it runs on. The default format is an
+uncompressed Arrow IPC file: readers memory-map it, and the names, labels and other repetitive string columns are
+dictionary-encoded, so each distinct entity is stored once per partition however many pairs it appears in. Parquet
+(smaller on disk, decoded on read) and CSV are read and written the same way, picked by the file extension, so
+artifacts written by older versions still load.
+
+pyarrow is optional: without it (or with ARTIFACT_FORMAT=csv) the stages keep writing CSV.
+
+Usage (from server/):
+    python columnar_store.py convert Dataset/*.csv [--output Dataset/columnar] [--format arrow|parquet]
+
+convert writes every CSV as one partition per "File Name" under <output>/<csv name>/; read_partitions() reads them
+back, all of them or only the documents asked for.
+"""
+import argparse
+import glob
+import importlib.util
+import os
+
+import pandas as pd
+from persistence import content_id
+
+ARTIFACT_FORMATS = {"arrow": ".arrow", "parquet": ".parquet", "csv": ".csv"}
+ARTIFACT_FORMAT = os.getenv("ARTIFACT_FORMAT") or ("arrow" if importlib.util.find_spec("pyarrow") else "csv")
+PARTITION_COLUMN = "File Name"
+# Free text, mostly distinct per row: stored plain. Every other string column is dictionary-encoded
+PLAIN_COLUMNS = {"Evidence", "Sentence", "Aliases"}
+
+
+def artifact_extension(format=None):
+    return ARTIFACT_FORMATS[format or ARTIFACT_FORMAT]
+
+
+def to_arrow(df):
+    """Arrow table of df with its string columns (names, labels, relations, file names) dictionary-encoded"""
+    import pyarrow as pa
+    table = pa.Table.from_pandas(df, preserve_index=False).replace_schema_metadata(None)  # Plain types, no pandas JSON
+    for index, field in enumerate(table.schema):
+        if not (pa.types.is_string(field.type) or pa.types.is_large_string(field.type)):
+            continue
+        column = table.column(index).cast(pa.string())  # 32-bit offsets are plenty for one document
+        if field.name not in PLAIN_COLUMNS:
+            column = column.dictionary_encode()
+            distinct = max((len(chunk.dictionary) for chunk in column.chunks), default=0)
+            # Narrowest index type that fits: one byte per row for labels, two for the names of most documents
+            index_type = pa.int8() if distinct < 2 ** 7 else pa.int16() if distinct < 2 ** 15 else pa.int32()
+            column = column.cast(pa.dictionary(index_type, pa.string()))
+        table = table.set_column(index, field.name, column)
+    return table
+
+
+def from_arrow(table, decode=True):
+    """DataFrame of an Arrow table. decode=True turns dictionary columns back into plain strings, as pd.read_csv
+    returns them (the pipeline assigns new values to them); decode=False keeps them as pandas categoricals."""
+    import pyarrow as pa
+    if decode:
+        for index, field in enumerate(table.schema):
+            if pa.types.is_dictionary(field.type):
+                table = table.set_column(index, field.name, table.column(index).cast(field.type.value_type))
+    return table.to_pandas()
+
+
+def write_table(df, path):
+    """Writes df in the format of the path's extension (.arrow, .parquet or .csv), replacing the file atomically"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    extension = os.path.splitext(path)[1]
+    if extension == ".csv":
+        df.to_csv(temporary, index=False)
+    elif extension == ".arrow":
+        import pyarrow as pa
+        table = to_arrow(df)
+        with pa.OSFile(temporary, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)  # Uncompressed, so readers can memory-map the buffers as they are
+    elif extension == ".parquet":
+        import pyarrow.parquet as pq
+        pq.write_table(to_arrow(df), temporary, compression="zstd")  # Dictionary columns stay dictionary pages
+    else:
+        raise ValueError(f"Unknown artifact format '{extension}' of {path}")
+    os.replace(temporary, path)
+    return path
+
+
+def read_table(path, columns=None, decode=True):
+    """DataFrame of one artifact (only `columns`, if given); .arrow files are memory-mapped, not read"""
+    extension = os.path.splitext(path)[1]
+    if extension == ".csv":
+        return pd.read_csv(path, usecols=columns)
+    if extension == ".arrow":
+        import pyarrow as pa
+        with pa.memory_map(path) as source:
+            table = pa.ipc.open_file(source).read_all()
+        return from_arrow(table.select(columns) if columns else table, decode)
+    if extension == ".parquet":
+        import pyarrow.parquet as pq
+        return from_arrow(pq.read_table(path, columns=columns, memory_map=True), decode)
+    raise ValueError(f"Unknown artifact format '{extension}' of {path}")
+
+
+def partition_path(folder, document, format=None):
+    """File of one document's rows in a partitioned folder"""
+    return os.path.join(folder, content_id(document) + artifact_extension(format))
+
+
+def write_partitions(df, folder, format=None, partition_column=PARTITION_COLUMN):
+    """Writes df as one file per value of partition_column; partitions of other documents are left as they are.
+    Returns {document: path}."""
+    paths = {}
+    for document, rows in df.groupby(partition_column, sort=False, dropna=False):
+        paths[document] = write_table(rows, partition_path(folder, document, format))
+    return paths
+
+
+def read_partitions(folder, documents=None, columns=None, decode=True):
+    """Rows of the given documents (every partition in the folder when None), in one DataFrame; only those
+    partitions' files are opened, whichever format they were written in"""
+    names = ["*"] if documents is None else [content_id(document) for document in documents]
+    paths = sorted(path for name in names for extension in ARTIFACT_FORMATS.values()
+                   for path in glob.glob(os.path.join(folder, name + extension)))
+    frames = [read_table(path, columns, decode) for path in paths]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+
+
+def convert(csv_paths, output, format="arrow"):
+    """Writes each CSV as partitions under output/<csv name>/; returns {csv: {"partitions", "rows", "csv_bytes", "bytes"}}"""
+    report = {}
+    for csv_path in csv_paths:
+        df = pd.read_csv(csv_path)
+        folder = os.path.join(output, os.path.splitext(os.path.basename(csv_path))[0])
+        if PARTITION_COLUMN in df.columns:
+            paths = list(write_partitions(df, folder, format).values())
+        else:
+            paths = [write_table(df, os.path.join(folder, "all" + artifact_extension(format)))]
+        report[csv_path] = {"partitions": len(paths), "rows": len(df), "csv_bytes": os.path.getsize(csv_path),
+                            "bytes": sum(os.path.getsize(path) for path in paths)}
+        print(f"{csv_path}: {len(df)} rows -> {len(paths)} {format} partitions in {folder}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    converter = commands.add_parser("convert", help="write CSV tables as per-document columnar partitions")
+    converter.add_argument("csv", nargs="+")
+    converter.add_argument("--output", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "Dataset", "columnar"))
+    converter.add_argument("--format", choices=["arrow", "parquet"], default="arrow")
+    args = parser.parse_args()
+    report = convert(args.csv, args.output, args.format)
+    csv_bytes = sum(entry["csv_bytes"] for entry in report.values())
+    converted = sum(entry["bytes"] for entry in report.values())
+    print(f"{csv_bytes / 1024:.1f} KiB of CSV -> {converted / 1024:.1f} KiB of {args.format}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""One-off compaction: rewrites the Relationships collection to content-addressed IDs, one document per edge.
+
+Usage (from server/):
+    python compact_relationships.py [--dry-run] [--batch-size 1000]
+
+Old random IDs are mapped to the content hash of (entity_1, type_1, entity_2, type_2, relation), entity
+references are rewritten to the shared IDs and the duplicates are deleted. Prints a report of the storage saved.
+Documents stored before the normalized lookup keys existed get them backfilled.
+"""
+import argparse
+import json
+import os
+from dotenv import load_dotenv
+from pymongo import MongoClient, UpdateOne
+from pymongo.server_api import ServerApi
+from persistence import MONGO_BATCH_SIZE, RELATIONSHIP_FIELDS, backfill_normalized_names, relationship_id, write_in_batches
+
+def collection_stats(db, name):
+    try:
+        stats = db.command("collStats", name)
+        return {"count": stats.get("count"), "size_bytes": stats.get("size"), "storage_bytes": stats.get("storageSize")}
+    except Exception:  # e.g. collStats not supported by the server
+        return {"count": db[name].count_documents({})}
+
+def compact_relationships(db, dry_run=False, batch_size=MONGO_BATCH_SIZE):
+    relationship_collection = db["Relationships"]
+    entities_collection = db["Entities"]
+    before = collection_stats(db, "Relationships")
+
+    # 1. Map every existing ID to its content-addressed ID and upsert one canonical copy per edge
+    id_map = {}
+    canonical = {}
+    for entry in relationship_collection.find({}):
+        new_id = relationship_id(entry)
+        id_map[entry["_id"]] = new_id
+        canonical.setdefault(new_id, {field: entry[field] for field in RELATIONSHIP_FIELDS})
+    stale_ids = [old_id for old_id, new_id in id_map.items() if old_id != new_id]
+
+    # 2. Point entities at the shared IDs (deduplicated, order kept)
+    entity_updates = []
+    for entity in entities_collection.find({"relationships.0": {"$exists": True}}, {"relationships": 1}):
+        relationships = list(dict.fromkeys(id_map.get(old_id, old_id) for old_id in entity["relationships"]))
+        if relationships != entity["relationships"]:
+            entity_updates.append(UpdateOne({"_id": entity["_id"]}, {"$set": {"relationships": relationships}}))
+
+    report = {
+        "relationships_before": len(id_map),
+        "relationships_after": len(canonical),
+        "duplicates_removed": len(id_map) - len(canonical),
+        "entities_updated": len(entity_updates),
+        "dry_run": dry_run,
+        "before": before,
+    }
+    if dry_run:
+        return report
+
+    write_in_batches(relationship_collection,
+                     [UpdateOne({"_id": new_id}, {"$setOnInsert": fields}, upsert=True) for new_id, fields in canonical.items()],
+                     batch_size)
+    write_in_batches(entities_collection, entity_updates, batch_size)
+
+    # 3. Only now drop the old copies, so an interrupted run never leaves dangling references
+    for start in range(0, len(stale_ids), batch_size):
+        relationship_collection.delete_many({"_id": {"$in": stale_ids[start:start + batch_size]}})
+
+    report["normalized_keys_backfilled"] = backfill_normalized_names(entities_collection, relationship_collection, batch_size)
+    report["after"] = collection_stats(db, "Relationships")
+    if report["before"].get("size_bytes") and report["after"].get("size_bytes") is not None:
+        report["bytes_saved"] = report["before"]["size_bytes"] - report["after"]["size_bytes"]
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="only report what would change")
+    parser.add_argument("--batch-size", type=int, default=MONGO_BATCH_SIZE)
+    args = parser.parse_args()
+
+    load_dotenv()
+    client = MongoClient(os.getenv("MONGO_URI"), server_api=ServerApi('1'))
+    report = compact_relationships(client["aka_datathon"], dry_run=args.dry_run, batch_size=args.batch_size)
+    print(json.dumps(report, indent=2, default=str))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Entity linking: resolves entity names to Wikidata IDs with an on-disk cache and concurrent, pooled HTTP lookups.
+
+Names are normalized and deduplicated per batch. Hits come from a SQLite cache with a TTL; names Wikidata
+has no match for are cached as negatives (shorter TTL) so they are not looked up again on every upload.
+Point WIKIDATA_API_URL at a local stub server to run without network access.
+"""
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from metrics import record_cache, record_stage
+from persistence import normalize_name
+
+WIKIDATA_API_URL = os.getenv("WIKIDATA_API_URL", "https://www.wikidata.org/w/api.php")
+WIKIDATA_TIMEOUT = float(os.getenv("WIKIDATA_TIMEOUT", 5))
+WIKIDATA_WORKERS = int(os.getenv("WIKIDATA_WORKERS", 8))
+WIKIDATA_TTL = int(os.getenv("WIKIDATA_TTL", 30 * 24 * 3600))  # Seconds a resolved ID stays valid
+WIKIDATA_NEGATIVE_TTL = int(os.getenv("WIKIDATA_NEGATIVE_TTL", 7 * 24 * 3600))  # Seconds a "no match" stays valid
+USER_AGENT = "AKAprofiler/1.0 (entity linking)"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS wikidata_ids (
+    name_norm TEXT PRIMARY KEY,
+    wikidata_id TEXT,
+    fetched_at REAL NOT NULL
+);
+"""
+
+
+class WikidataLinker:
+    """Thread-safe resolver, one per process; resolve() is the batch entry point."""
+
+    def __init__(self, cache_path, api_url=WIKIDATA_API_URL, timeout=WIKIDATA_TIMEOUT, max_workers=WIKIDATA_WORKERS,
+                 ttl=WIKIDATA_TTL, negative_ttl=WIKIDATA_NEGATIVE_TTL):
+        self.api_url = api_url
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.stats = {"hits": 0, "misses": 0, "errors": 0}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+        # One pooled session shared by the lookup threads, with retries on throttling and server errors
+        self._session = requests.Session()
+        self._session.headers["User-Agent"] = USER_AGENT
+        retries = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=["GET"])
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=retries)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+    def _cached(self, names_norm):
+        """name_norm -> wikidata_id (None for a negative) for every fresh cache entry"""
+        now = time.time()
+        found = {}
+        with self._lock:
+            for start in range(0, len(names_norm), 500):
+                chunk = names_norm[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT name_norm, wikidata_id, fetched_at FROM wikidata_ids WHERE name_norm IN ({','.join('?' * len(chunk))})",
+                    chunk).fetchall()
+                for name_norm, wikidata_id, fetched_at in rows:
+                    if now - fetched_at < (self.ttl if wikidata_id else self.negative_ttl):
+                        found[name_norm] = wikidata_id
+        return found
+
+    def _store(self, resolved):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO wikidata_ids (name_norm, wikidata_id, fetched_at) VALUES (?, ?, ?)",
+                                   [(name_norm, wikidata_id, now) for name_norm, wikidata_id in resolved.items()])
+
+    def _lookup(self, name):
+        """Wikidata ID of the best search match, None when there is none; raises on network errors"""
+        response = self._session.get(self.api_url, timeout=self.timeout, params={
+            "action": "wbsearchentities", "search": name, "language": "en", "format": "json", "limit": 1})
+        response.raise_for_status()
+        results = response.json().get("search", [])
+        return results[0]["id"] if results else None
+
+    def _lookup_safely(self, name):
+        try:
+            return True, self._lookup(name)
+        except (requests.RequestException, ValueError, KeyError) as e:
+            print(f"Wikidata lookup failed for {name!r}: {e}")
+            return False, None
+
+    def resolve(self, names):
+        """{name: wikidata_id or None} for every distinct name; cache misses are looked up concurrently"""
+        started = time.perf_counter()
+        names = [name for name in dict.fromkeys(names) if isinstance(name, str) and name.strip()]
+        by_norm = {}
+        for name in names:
+            by_norm.setdefault(normalize_name(name), name)  # First spelling is the one searched for
+
+        resolved = self._cached(list(by_norm))
+        missing = [name_norm for name_norm in by_norm if name_norm not in resolved]
+        self.stats["hits"] += len(resolved)
+        self.stats["misses"] += len(missing)
+        errors = 0
+        if missing:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                results = list(executor.map(self._lookup_safely, [by_norm[name_norm] for name_norm in missing]))
+            fetched = {name_norm: wikidata_id for name_norm, (ok, wikidata_id) in zip(missing, results) if ok}
+            errors = len(missing) - len(fetched)
+            self.stats["errors"] += errors
+            self._store(fetched)  # Failed lookups are not cached, they are retried next time
+            resolved.update(fetched)
+        record_cache("wikidata", hits=len(by_norm) - len(missing), misses=len(missing))
+        record_stage("wikidata_lookup", time.perf_counter() - started, names=len(by_norm), lookups=len(missing), errors=errors)
+        return {name: resolved.get(normalize_name(name)) for name in names}
+
+    def close(self):
+        self._session.close()
+        with self._lock:
+            self._conn.close()
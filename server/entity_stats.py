@@ -0,0 +1,116 @@
+"""Aggregate entity statistics, updated incrementally with $inc upserts each time a document is stored.
+
+EntityStats has one document per (normalized name, label): mentions, documents, first_seen / last_seen and
+top_cooccurring, the entities it shares a sentence with most often. EntityCooccurrences keeps the exact count per
+(entity, other entity) direction that the top lists are maintained from. Only entity entries that a store newly
+inserted are counted, so storing a document again does not count it twice.
+"""
+import os
+from datetime import datetime
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from persistence import MONGO_BATCH_SIZE, as_count, content_id, normalize_name, write_in_batches
+
+STATS_TOP_COOCCURRING = int(os.getenv("STATS_TOP_COOCCURRING", 10))  # Entries kept in each top_cooccurring list
+
+def stats_id(entity, label):
+    return content_id(normalize_name(entity), label)
+
+def entity_totals(entity_entries):
+    """{stats id: {"entity", "entity_norm", "label", "mentions", "documents"}} for one document's new entity entries;
+    spellings of the same name (e.g. "KHAN" and "Khan") count as one entity"""
+    totals = {}
+    for entry in entity_entries:
+        key = stats_id(entry["entity"], entry["label"])
+        total = totals.setdefault(key, {"entity": entry["entity"], "entity_norm": normalize_name(entry["entity"]),
+                                        "label": entry["label"], "mentions": 0, "documents": 1})
+        total["mentions"] += entry.get("frequency") or 0
+    return totals
+
+def cooccurrence_totals(relationships):
+    """{(stats id, other stats id): (other entity, other label, count)} in both directions, from a document's pairs
+    (the Co-occurrences column, one co-occurrence per pair for pairs extracted before it existed)"""
+    totals = {}
+    for pair in relationships.to_dict(orient="records"):
+        ends = [(pair["Entity 1"], pair["Type 1"]), (pair["Entity 2"], pair["Type 2"])]
+        keys = [stats_id(entity, label) for entity, label in ends]
+        if keys[0] == keys[1]:
+            continue
+        count = as_count(pair.get("Co-occurrences"))
+        for (key, other_key), (other, other_label) in (((keys[0], keys[1]), ends[1]), ((keys[1], keys[0]), ends[0])):
+            previous = totals.get((key, other_key))
+            totals[(key, other_key)] = (other, other_label, count + (previous[2] if previous else 0))
+    return totals
+
+def stats_upserts(totals, seen_at):
+    return [UpdateOne({"_id": key},
+                      {"$inc": {"mentions": total["mentions"], "documents": total["documents"]},
+                       "$min": {"first_seen": seen_at},
+                       "$max": {"last_seen": seen_at},
+                       "$setOnInsert": {"entity": total["entity"], "entity_norm": total["entity_norm"], "label": total["label"],
+                                        "top_cooccurring": []}},
+                      upsert=True)
+            for key, total in totals.items()]
+
+def cooccurrence_upserts(totals):
+    return [UpdateOne({"_id": content_id(key, other_key)},
+                      {"$inc": {"count": count},
+                       "$setOnInsert": {"entity_id": key, "other_id": other_key, "other": other, "other_label": other_label}},
+                      upsert=True)
+            for (key, other_key), (other, other_label, count) in totals.items()]
+
+def _find_in(collection, ids, projection, batch_size):
+    for start in range(0, len(ids), batch_size):
+        yield from collection.find({"_id": {"$in": ids[start:start + batch_size]}}, projection)
+
+def refresh_top_cooccurring(stats_collection, cooccurrence_collection, pair_keys, batch_size=MONGO_BATCH_SIZE,
+                            top=STATS_TOP_COOCCURRING):
+    """Re-ranks the top lists of the entities whose co-occurrence counts just grew.
+
+    Counts only ever increase, so an entity's new top list is its old one merged with the new totals of the pairs
+    that changed: a pair that did not change cannot overtake the old top entries. Other stores (ingestion threads,
+    server processes) may refresh the same entity meanwhile, so a list is only written over the one it was merged
+    from (top_version, a new token per write); the entities another store wrote first are merged again with its list."""
+    updated = {}  # entity stats id -> {other stats id: entry}
+    for pair in _find_in(cooccurrence_collection, [content_id(*key) for key in pair_keys], None, batch_size):
+        updated.setdefault(pair["entity_id"], {})[pair["other_id"]] = {
+            "id": pair["other_id"], "entity": pair["other"], "label": pair["other_label"], "count": pair["count"]}
+    pending, written = list(updated), 0
+    while pending:
+        token, merged, operations = ObjectId(), [], []
+        for stats in _find_in(stats_collection, pending, {"top_cooccurring": 1, "top_version": 1}, batch_size):
+            candidates = {entry["id"]: entry for entry in stats.get("top_cooccurring") or []}
+            for other_id, entry in updated[stats["_id"]].items():
+                if other_id not in candidates or candidates[other_id]["count"] < entry["count"]:
+                    candidates[other_id] = entry  # The other store may have read a later count
+            ranked = sorted(candidates.values(), key=lambda entry: (-entry["count"], entry["entity"]))[:top]
+            merged.append(stats["_id"])
+            operations.append(UpdateOne({"_id": stats["_id"], "top_version": stats.get("top_version")},
+                                        {"$set": {"top_cooccurring": ranked, "top_version": token}}))
+        written += write_in_batches(stats_collection, operations, batch_size)
+        pending = [stats["_id"] for stats in _find_in(stats_collection, merged, {"top_version": 1}, batch_size)
+                   if stats.get("top_version") != token]
+    return written
+
+def update_entity_stats(new_entity_entries, relationships, stats_collection, cooccurrence_collection, seen_at=None,
+                        batch_size=MONGO_BATCH_SIZE):
+    """Adds one stored document to the aggregate stats; new_entity_entries are the entity entries the store inserted
+    (see persist_entries), nothing is counted when there are none"""
+    if not new_entity_entries:
+        return {"entities": 0, "cooccurrences": 0}
+    seen_at = seen_at or datetime.now()
+    totals = entity_totals(new_entity_entries)
+    pairs = cooccurrence_totals(relationships)
+    summary = {
+        "entities": write_in_batches(stats_collection, stats_upserts(totals, seen_at), batch_size),
+        "cooccurrences": write_in_batches(cooccurrence_collection, cooccurrence_upserts(pairs), batch_size),
+    }
+    refresh_top_cooccurring(stats_collection, cooccurrence_collection, list(pairs), batch_size)
+    return summary
+
+def ensure_stats_indexes(stats_collection, cooccurrence_collection):
+    """Indexes behind the frequency-sorted lists and the per-entity lookups"""
+    stats_collection.create_index([("label", ASCENDING), ("mentions", DESCENDING), ("_id", ASCENDING)], name="label_mentions")
+    stats_collection.create_index([("mentions", DESCENDING), ("_id", ASCENDING)], name="mentions")
+    stats_collection.create_index([("entity_norm", ASCENDING)], name="entity_norm")
+    cooccurrence_collection.create_index([("entity_id", ASCENDING), ("count", DESCENDING)], name="entity_count")
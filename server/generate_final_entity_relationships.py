@@ -1,7 +1,7 @@
 from __future__ import annotations
 import spacy
 import pandas as pd
-import requests
+import os
 import torch
 import re
 import hashlib
@@ -16,6 +16,7 @@ from sklearn.metrics import accuracy_score
 from typing import List
 import re
 from typing import List, Dict
+from entity_linking import WikidataLinker
 
 # Define DEVICE variable
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
@@ -27,16 +28,17 @@ rebel_pipeline = pipeline("text2text-generation", model="Babelscape/rebel-large"
 if not Doc.has_extension("rel"):
     Doc.set_extension("rel", default={})
 
-def call_wiki_api(item):
-    """Fetches Wikidata ID for an entity."""
-    try:
-        url = f"https://www.wikidata.org/w/api.php?action=wbsearchentities&search={item}&language=en&format=json"
-        data = requests.get(url).json()
-        return data['search'][0]['id']
-    except:
-        return 'id-less'
+# Paths relative to this script, so it runs from any working directory
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+DATASET_DIR = os.path.join(SERVER_DIR, "Dataset")
+BASE_DIR = os.path.join(SERVER_DIR, "LocalDB")
+
+# Shared Wikidata resolver (cached on disk, same cache as the backend)
+os.makedirs(BASE_DIR, exist_ok=True)
+wikidata_linker = WikidataLinker(os.path.join(BASE_DIR, "wikidata_cache.sqlite3"))
 
 def set_annotations(doc: Doc, triplets: List[dict]):
+    wiki_ids = wikidata_linker.resolve([name for triplet in triplets for name in (triplet['head'], triplet['tail'])])
     for triplet in triplets:
         if triplet['head'] == triplet['tail']:
             continue  # Remove self-loops
@@ -50,8 +52,8 @@ def set_annotations(doc: Doc, triplets: List[dict]):
         if index not in doc._.rel:
             doc._.rel[index] = {
                 "relation": triplet["type"],
-                "head_span": {'text': triplet['head'], 'id': call_wiki_api(triplet['head'])},
-                "tail_span": {'text': triplet['tail'], 'id': call_wiki_api(triplet['tail'])}
+                "head_span": {'text': triplet['head'], 'id': wiki_ids.get(triplet['head']) or 'id-less'},
+                "tail_span": {'text': triplet['tail'], 'id': wiki_ids.get(triplet['tail']) or 'id-less'}
             }
 
 # Load spaCy model
@@ -97,13 +99,16 @@ def load_csv(file_path):
     return df
 
 def extract_relationships(df):
-    """Uses Rebel to extract relationships for given entity pairs."""
+    """Uses Rebel to extract relationships for given entity pairs, and adds the Wikidata IDs of both entities."""
+    # Resolve the Wikidata IDs of every distinct entity in one concurrent batch instead of two requests per row
+    wiki_ids = wikidata_linker.resolve(pd.concat([df["Entity1"], df["Entity2"]]))
+    print(f"Resolved {sum(1 for wiki_id in wiki_ids.values() if wiki_id)}/{len(wiki_ids)} Wikidata IDs {wikidata_linker.stats}")
+    df["Wikidata1"] = df["Entity1"].map(wiki_ids)
+    df["Wikidata2"] = df["Entity2"].map(wiki_ids)
+
     for index, row in df.iterrows():
         entity1, entity2, relationship = row["Entity1"], row["Entity2"], row["Relationship"]
         if relationship == "Unknown":
-            wiki_id1 = call_wiki_api(entity1)
-            wiki_id2 = call_wiki_api(entity2)
-            
             query_text = f"{entity1} and {entity2} relationship"
             doc = nlp(query_text)
             
@@ -113,9 +118,9 @@ def extract_relationships(df):
     return df
 
 # Load data and process relationships
-df = load_csv("./server/Dataset/entity_pairs_relationship_fortraining2.csv")
+df = load_csv(os.path.join(DATASET_DIR, "entity_pairs_relationship_fortraining2.csv"))
 df = extract_relationships(df)
 print(df.head())
 
 # Save updated data
-df.to_csv("./server/Dataset/updated_relationships.csv", index=False)
+df.to_csv(os.path.join(DATASET_DIR, "updated_relationships.csv"), index=False)
@@ -0,0 +1,336 @@
+"""In-memory relationship graph: entity names interned to integer IDs, adjacency in CSR arrays.
+
+Built from the Relationships collection and updated after each ingestion. Edges are undirected (REBEL's
+direction is not reliable) and one CSR entry is kept per (entity, neighbour, relationship type):
+
+    offsets[i]:offsets[i + 1]   slice of node i's entries in neighbors / edge_types
+    neighbors                   int32 node IDs, sorted per node
+    edge_types                  int32 IDs into the interned relationship names
+
+Edges added after a build go to a small per-node delta and are merged into the CSR arrays once the delta
+reaches COMPACT_THRESHOLD entries, so updates stay cheap without rebuilding on every ingestion.
+"""
+import threading
+import numpy as np
+from persistence import normalize_name
+
+COMPACT_THRESHOLD = 50000  # Delta entries (two per edge) before they are merged into the CSR arrays
+PAGERANK_DAMPING = 0.85
+PAGERANK_ITERATIONS = 50
+PAGERANK_TOLERANCE = 1e-8
+LABELS = ["PERSON", "ORG"]  # Other labels are interned after these
+
+_EMPTY = np.zeros(0, dtype=np.int32)
+
+
+class RelationshipGraph:
+    """Thread-safe; readers and the ingestion thread share one instance."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._ids = {}  # normalized name -> node ID
+        self._names = []  # node ID -> display name (first spelling seen)
+        self._labels = []  # node ID -> label ID
+        self._label_ids = {label: i for i, label in enumerate(LABELS)}
+        self._label_names = list(LABELS)
+        self._type_ids = {}  # relationship -> edge type ID
+        self._type_names = []
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._neighbors = _EMPTY
+        self._edge_types = _EMPTY
+        self._degree = np.zeros(0, dtype=np.int32)  # Distinct neighbours per node, CSR and delta together
+        self._delta = {}  # node ID -> [(neighbor, edge type)] not merged into the CSR arrays yet
+        self._delta_size = 0
+        self.version = 0  # Bumped on every change, for caches derived from the graph
+        self._pagerank = None  # (version, scores)
+
+    # Interning
+    def _node(self, name, label):
+        norm = normalize_name(name)
+        node = self._ids.get(norm)
+        if node is None:
+            node = self._ids[norm] = len(self._names)
+            self._names.append(name)
+            self._labels.append(self._intern_label(label))
+        return node
+
+    def _intern_label(self, label):
+        if label not in self._label_ids:
+            self._label_ids[label] = len(self._label_names)
+            self._label_names.append(label)
+        return self._label_ids[label]
+
+    def _edge_type(self, relationship):
+        edge_type = self._type_ids.get(relationship)
+        if edge_type is None:
+            edge_type = self._type_ids[relationship] = len(self._type_names)
+            self._type_names.append(relationship)
+        return edge_type
+
+    def _intern_edges(self, relationships):
+        """(sources, targets, types) int lists for Relationships documents, self-loops dropped"""
+        sources, targets, types = [], [], []
+        for relation in relationships:
+            source = self._node(relation["entity_1_name"], relation.get("entity_1_type"))
+            target = self._node(relation["entity_2_name"], relation.get("entity_2_type"))
+            if source != target:
+                sources.append(source)
+                targets.append(target)
+                types.append(self._edge_type(relation.get("relationship")))
+        return sources, targets, types
+
+    # Building
+    def _set_csr(self, sources, targets, types):
+        """Replaces the CSR arrays with the given directed entries, deduplicated and sorted by (source, target)"""
+        count = len(self._names)
+        if len(sources):
+            entries = np.unique(np.stack([sources, targets, types], axis=1), axis=0)  # Sorted by source, target, type
+            sources, targets, types = entries[:, 0], entries[:, 1], entries[:, 2]
+        new_pair = np.ones(len(sources), dtype=bool)
+        new_pair[1:] = (sources[1:] != sources[:-1]) | (targets[1:] != targets[:-1])
+        self._offsets = np.zeros(count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=count), out=self._offsets[1:])
+        self._neighbors = np.ascontiguousarray(targets, dtype=np.int32)
+        self._edge_types = np.ascontiguousarray(types, dtype=np.int32)
+        self._degree = np.bincount(sources[new_pair], minlength=count).astype(np.int32)
+        self._delta, self._delta_size = {}, 0
+
+    def build(self, relationships):
+        """Bulk load from Relationships documents (entity_1_name, entity_1_type, entity_2_name, entity_2_type, relationship)"""
+        with self._lock:
+            sources, targets, types = (np.asarray(values, dtype=np.int64) for values in self._intern_edges(relationships))
+            # Both directions of every edge
+            self._set_csr(np.concatenate([sources, targets]), np.concatenate([targets, sources]), np.concatenate([types, types]))
+            self.version += 1
+            return self.edge_count()
+
+    def _compact(self):
+        """Merges the delta into the CSR arrays"""
+        csr_sources = np.repeat(np.arange(len(self._offsets) - 1, dtype=np.int64), np.diff(self._offsets))
+        delta_sources = [source for source, entries in self._delta.items() for _ in entries]
+        delta_targets = [target for entries in self._delta.values() for target, _ in entries]
+        delta_types = [edge_type for entries in self._delta.values() for _, edge_type in entries]
+        self._set_csr(np.concatenate([csr_sources, np.asarray(delta_sources, dtype=np.int64)]),
+                      np.concatenate([self._neighbors.astype(np.int64), np.asarray(delta_targets, dtype=np.int64)]),
+                      np.concatenate([self._edge_types.astype(np.int64), np.asarray(delta_types, dtype=np.int64)]))
+
+    # Incremental updates
+    def _csr_slice(self, node):
+        if node + 1 >= len(self._offsets):
+            return _EMPTY, _EMPTY
+        start, stop = self._offsets[node], self._offsets[node + 1]
+        return self._neighbors[start:stop], self._edge_types[start:stop]
+
+    def _has_entry(self, source, target, edge_type=None):
+        neighbors, edge_types = self._csr_slice(source)
+        position = np.searchsorted(neighbors, target)  # Neighbours are sorted per node
+        while position < len(neighbors) and neighbors[position] == target:
+            if edge_type is None or edge_types[position] == edge_type:
+                return True
+            position += 1
+        return any(neighbor == target and (edge_type is None or delta_type == edge_type)
+                   for neighbor, delta_type in self._delta.get(source, ()))
+
+    def add_relationships(self, relationships):
+        """Incremental update after an ingestion; returns the number of new edges"""
+        with self._lock:
+            added = 0
+            edges = self._intern_edges(relationships)
+            if len(self._degree) < len(self._names):  # Room for the newly interned entities
+                self._degree = np.concatenate([self._degree, np.zeros(len(self._names) - len(self._degree), dtype=np.int32)])
+            for source, target, edge_type in zip(*edges):
+                if self._has_entry(source, target, edge_type):
+                    continue
+                if not self._has_entry(source, target):
+                    self._degree[source] += 1
+                    self._degree[target] += 1
+                self._delta.setdefault(source, []).append((target, edge_type))
+                self._delta.setdefault(target, []).append((source, edge_type))
+                self._delta_size += 2
+                added += 1
+            if self._delta_size >= COMPACT_THRESHOLD:
+                self._compact()
+            if added:
+                self.version += 1
+            return added
+
+    # Queries
+    def __len__(self):
+        return len(self._names)
+
+    def edge_count(self):
+        """Distinct (entity, neighbour, relationship) edges"""
+        return (len(self._neighbors) + self._delta_size) // 2
+
+    def node_id(self, name):
+        return self._ids.get(normalize_name(name))
+
+    def node(self, node):
+        return {"entity": self._names[node], "label": self._label_names[self._labels[node]], "degree": int(self._degree[node])}
+
+    def name(self, node):
+        return self._names[node]
+
+    def label(self, node):
+        return self._label_names[self._labels[node]]
+
+    def label_mask(self, labels):
+        """Boolean mask over node IDs: True where the entity has one of the labels"""
+        label_ids = [self._label_ids[label] for label in labels if label in self._label_ids]
+        return np.isin(np.asarray(self._labels, dtype=np.int32), label_ids)
+
+    def degrees(self, nodes):
+        """Distinct-neighbour degrees of an array of node IDs"""
+        return self._degree[nodes]
+
+    def relationship_name(self, edge_type):
+        return self._type_names[edge_type]
+
+    def weighted_neighbors(self, node):
+        """(distinct neighbour IDs, number of relationship types linking each to the node)"""
+        neighbors, _ = self.neighbors(node)
+        return np.unique(neighbors, return_counts=True)
+
+    def neighbors(self, node):
+        """(neighbour IDs, edge type IDs) of a node, one entry per relationship type"""
+        neighbors, edge_types = self._csr_slice(node)
+        delta = self._delta.get(node)
+        if delta:
+            neighbors = np.concatenate([neighbors, np.fromiter((target for target, _ in delta), dtype=np.int32, count=len(delta))])
+            edge_types = np.concatenate([edge_types, np.fromiter((edge_type for _, edge_type in delta), dtype=np.int32, count=len(delta))])
+        return neighbors, edge_types
+
+    def _edges_within(self, nodes):
+        """[{source, target, relationship}] among a list of node IDs, each undirected edge once"""
+        inside = np.zeros(len(self._names), dtype=bool)
+        inside[nodes] = True
+        sources, targets, edge_types = [], [], []
+        for source in nodes:
+            neighbors, types = self.neighbors(source)
+            keep = inside[neighbors] & (neighbors > source)
+            sources.append(np.full(int(keep.sum()), source, dtype=np.int32))
+            targets.append(neighbors[keep])
+            edge_types.append(types[keep])
+        if not sources:
+            return []
+        names, type_names = self._names, self._type_names
+        return [{"source": names[source], "target": names[target], "relationship": type_names[edge_type]}
+                for source, target, edge_type in zip(np.concatenate(sources).tolist(), np.concatenate(targets).tolist(),
+                                                     np.concatenate(edge_types).tolist())]
+
+    def k_hop(self, name, hops=1, limit=200):
+        """Entities within `hops` edges of `name` (closest first, at most `limit` of them) and the edges among them"""
+        with self._lock:
+            start = self.node_id(name)
+            if start is None:
+                return None
+            visited = np.zeros(len(self._names), dtype=bool)
+            visited[start] = True
+            reached = [(start, 0)]
+            frontier = np.array([start], dtype=np.int32)
+            for hop in range(1, hops + 1):
+                if not len(frontier) or len(reached) >= limit:
+                    break
+                candidates = np.unique(np.concatenate([self.neighbors(node)[0] for node in frontier.tolist()]))
+                candidates = candidates[~visited[candidates]]
+                # Highest-degree entities first when the limit cuts a hop short
+                frontier = candidates[np.argsort(-self._degree[candidates], kind="stable")][:limit - len(reached)]
+                visited[frontier] = True
+                reached += [(node, hop) for node in frontier.tolist()]
+            nodes = [dict(self.node(node), hops=hop) for node, hop in reached]
+            return {"nodes": nodes, "edges": self._edges_within([node for node, _ in reached])}
+
+    def shortest_path(self, source_name, target_name, max_hops=6):
+        """Fewest-edge path between two entities (bidirectional BFS), None when they are not connected within max_hops"""
+        with self._lock:
+            source, target = self.node_id(source_name), self.node_id(target_name)
+            if source is None or target is None:
+                return None
+            if source == target:
+                return {"hops": 0, "path": [self.node(source)], "edges": []}
+            parents = ({source: None}, {target: None})  # Search from each end
+            frontiers = ([source], [target])
+            meeting = None
+            for _ in range(max_hops):
+                side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1  # Expand the smaller frontier
+                next_frontier = []
+                for node in frontiers[side]:
+                    for neighbor in self.neighbors(node)[0].tolist():
+                        if neighbor in parents[side]:
+                            continue
+                        parents[side][neighbor] = node
+                        if neighbor in parents[1 - side]:
+                            meeting = neighbor
+                            break
+                        next_frontier.append(neighbor)
+                    if meeting is not None:
+                        break
+                if meeting is not None or not next_frontier:
+                    break
+                frontiers = (next_frontier, frontiers[1]) if side == 0 else (frontiers[0], next_frontier)
+            if meeting is None:
+                return None
+
+            path = [meeting]
+            while parents[0][path[0]] is not None:
+                path.insert(0, parents[0][path[0]])
+            while parents[1][path[-1]] is not None:
+                path.append(parents[1][path[-1]])
+            edges = []
+            for a, b in zip(path, path[1:]):
+                neighbors, edge_types = self.neighbors(a)
+                relationships = sorted({self._type_names[edge_type] for neighbor, edge_type
+                                        in zip(neighbors.tolist(), edge_types.tolist()) if neighbor == b})
+                edges.append({"source": self._names[a], "target": self._names[b], "relationships": relationships})
+            return {"hops": len(path) - 1, "path": [self.node(node) for node in path], "edges": edges}
+
+    def pagerank(self):
+        """PageRank over distinct neighbour pairs, computed with NumPy power iteration and cached per graph version"""
+        with self._lock:
+            if self._pagerank and self._pagerank[0] == self.version:
+                return self._pagerank[1]
+            if self._delta:
+                self._compact()
+            count = len(self._names)
+            if not count:
+                return np.zeros(0)
+            sources = np.repeat(np.arange(count, dtype=np.int64), np.diff(self._offsets))
+            first = np.ones(len(sources), dtype=bool)
+            first[1:] = (sources[1:] != sources[:-1]) | (self._neighbors[1:] != self._neighbors[:-1])
+            sources, targets = sources[first], self._neighbors[first]
+            out_degree = self._degree.astype(np.float64)
+            dangling = out_degree == 0
+            scores = np.full(count, 1.0 / count)
+            for _ in range(PAGERANK_ITERATIONS):
+                contributions = np.bincount(targets, weights=scores[sources] / out_degree[sources], minlength=count)
+                updated = (1 - PAGERANK_DAMPING) / count + PAGERANK_DAMPING * (contributions + scores[dangling].sum() / count)
+                converged = np.abs(updated - scores).sum() < PAGERANK_TOLERANCE
+                scores = updated
+                if converged:
+                    break
+            self._pagerank = (self.version, scores)
+            return scores
+
+    def ranking(self, by="degree", label=None, limit=20, offset=0):
+        """Entities ranked by degree or PageRank, optionally only one label"""
+        with self._lock:
+            scores = self.pagerank() if by == "pagerank" else self._degree.astype(np.float64)
+            candidates = np.arange(len(scores))
+            if label is not None:
+                label_id = self._label_ids.get(label)
+                candidates = candidates[np.asarray(self._labels, dtype=np.int32) == label_id] if label_id is not None else candidates[:0]
+            needed = min(offset + limit, len(candidates))
+            if not needed:
+                return []
+            top = candidates[np.argpartition(-scores[candidates], needed - 1)[:needed]] if needed < len(candidates) else candidates
+            top = top[np.lexsort((top, -scores[top]))][offset:needed]  # Ties by node ID, so pages are stable
+            return [dict(self.node(node), score=round(float(scores[node]), 8)) for node in top.tolist()]
+
+    def stats(self):
+        with self._lock:
+            return {"entities": len(self), "edges": self.edge_count(), "relationship_types": len(self._type_names),
+                    "pending_delta": self._delta_size // 2, "bytes": self.nbytes()}
+
+    def nbytes(self):
+        """Size of the CSR arrays (names and interning dicts not included)"""
+        return int(self._offsets.nbytes + self._neighbors.nbytes + self._edge_types.nbytes + self._degree.nbytes)
@@ -0,0 +1,183 @@
+"""Bounded, pre-laid-out subgraphs of the relationship graph for the network view.
+
+select_view picks the entities around one or more focus entities (top-k per hop by degree or edge weight,
+label/file filters) and collapses leaves (entities with no other relationship) into one aggregate node per
+parent and label. force_layout computes Fruchterman-Reingold coordinates in NumPy, so the browser only has to
+draw. ViewCache keeps finished views per query; the backend clears it whenever an ingestion changes the data.
+"""
+import threading
+from collections import OrderedDict
+import numpy as np
+from metrics import record_cache
+
+LAYOUT_ITERATIONS = 150
+LAYOUT_COOLING = 0.97
+MIN_AGGREGATE = 2  # Fewer leaves than this are shown as ordinary nodes
+VIEW_CACHE_SIZE = 256
+
+
+def _allowed_mask(graph, labels=None, allowed_nodes=None):
+    """Boolean mask of the entities that pass the label and file filters"""
+    mask = np.ones(len(graph), dtype=bool)
+    if labels:
+        mask &= graph.label_mask(labels)
+    if allowed_nodes is not None:
+        files_mask = np.zeros(len(graph), dtype=bool)
+        files_mask[list(allowed_nodes)] = True
+        mask &= files_mask
+    return mask
+
+
+def select_view(graph, focus, hops=1, max_nodes=150, rank_by="degree", labels=None, allowed_nodes=None, leaf_degree=1):
+    """Returns (selected {node: hop}, aggregates {(parent, label): [leaf nodes]}, truncated).
+
+    Each hop ranks the unselected neighbours of the previous hop by degree, or by weight (number of relationship
+    types linking them to it), and keeps the best until max_nodes entities are selected. Neighbours with at most
+    leaf_degree relationships are grouped per parent instead of using up the budget."""
+    allowed = _allowed_mask(graph, labels, allowed_nodes)
+    chosen = np.zeros(len(graph), dtype=bool)
+    chosen[list(focus)] = True
+    selected = {node: 0 for node in focus}
+    aggregates = {}
+    truncated = False
+    frontier = list(focus)
+    for hop in range(1, hops + 1):
+        if not frontier or len(selected) >= max_nodes:
+            truncated = truncated or bool(frontier)
+            break
+        lists = [graph.weighted_neighbors(node) for node in frontier]
+        neighbors = np.concatenate([neighbor_ids for neighbor_ids, _ in lists])
+        weights = np.concatenate([counts for _, counts in lists])
+        parents = np.repeat(np.asarray(frontier), [len(neighbor_ids) for neighbor_ids, _ in lists])
+        keep = allowed[neighbors] & ~chosen[neighbors]
+        candidates, first, inverse = np.unique(neighbors[keep], return_index=True, return_inverse=True)
+        if not len(candidates):
+            break
+        candidate_weights = np.bincount(inverse, weights=weights[keep])
+        candidate_parents = parents[keep][first]
+        degrees = graph.degrees(candidates)
+
+        # Leaves hanging off the same parent become one aggregate node
+        is_leaf = degrees <= leaf_degree
+        groups = {}
+        for node, parent in zip(candidates[is_leaf].tolist(), candidate_parents[is_leaf].tolist()):
+            groups.setdefault((parent, graph.label(node)), []).append(node)
+        for key, nodes in groups.items():
+            if len(nodes) >= MIN_AGGREGATE:
+                aggregates[key] = nodes
+                chosen[nodes] = True
+            else:
+                is_leaf[np.searchsorted(candidates, nodes)] = False  # Too few to aggregate, ranked like the rest
+
+        ranked = np.flatnonzero(~is_leaf)
+        score = degrees[ranked] if rank_by == "degree" else candidate_weights[ranked]
+        ranked = ranked[np.lexsort((candidates[ranked], -degrees[ranked], -score))]
+        budget = max_nodes - len(selected)
+        truncated = truncated or len(ranked) > budget
+        frontier = candidates[ranked[:budget]].tolist()
+        chosen[frontier] = True
+        for node in frontier:
+            selected[node] = hop
+    return selected, aggregates, truncated
+
+
+def force_layout(count, edges, seed=0, iterations=LAYOUT_ITERATIONS):
+    """Fruchterman-Reingold positions in [0, 1] x [0, 1] for nodes 0..count-1 and (a, b, weight) edges; deterministic"""
+    if count == 0:
+        return np.zeros((0, 2))
+    if count == 1:
+        return np.full((1, 2), 0.5)
+    rng = np.random.default_rng(seed)
+    angles = np.linspace(0, 2 * np.pi, count, endpoint=False)
+    positions = np.stack([np.cos(angles), np.sin(angles)], axis=1) * 0.5 + rng.normal(0, 0.01, (count, 2))
+    k = np.sqrt(1.0 / count)  # Ideal edge length
+    temperature = 0.1
+    sources = np.array([a for a, _, _ in edges], dtype=np.int64)
+    targets = np.array([b for _, b, _ in edges], dtype=np.int64)
+    strength = np.log1p(np.array([weight for _, _, weight in edges], dtype=np.float64))  # Aggregates pull, not crush
+    for _ in range(iterations):
+        dx = positions[:, 0, None] - positions[None, :, 0]
+        dy = positions[:, 1, None] - positions[None, :, 1]
+        repulsion = k * k / np.maximum(dx * dx + dy * dy, 1e-6)  # Every pair repels
+        displacement = np.stack([(repulsion * dx).sum(axis=1), (repulsion * dy).sum(axis=1)], axis=1)
+        if len(sources):
+            edge_delta = positions[sources] - positions[targets]
+            edge_distance = np.sqrt((edge_delta * edge_delta).sum(axis=1))
+            pull = edge_delta * (edge_distance * strength / k)[:, None]  # Connected pairs attract
+            for axis in (0, 1):
+                displacement[:, axis] += (np.bincount(targets, weights=pull[:, axis], minlength=count) -
+                                          np.bincount(sources, weights=pull[:, axis], minlength=count))
+        length = np.maximum(np.sqrt((displacement * displacement).sum(axis=1)), 1e-9)
+        positions += displacement * (np.minimum(length, temperature) / length)[:, None]
+        temperature *= LAYOUT_COOLING
+    low, high = positions.min(axis=0), positions.max(axis=0)
+    return 0.05 + 0.9 * (positions - low) / np.maximum(high - low, 1e-9)
+
+
+def build_view(graph, focus, hops=1, max_nodes=150, rank_by="degree", labels=None, allowed_nodes=None, leaf_degree=1):
+    """{nodes, edges, truncated} with x/y coordinates on every node"""
+    selected, aggregates, truncated = select_view(graph, focus, hops, max_nodes, rank_by, labels, allowed_nodes, leaf_degree)
+    order = list(selected)
+    index = {node: i for i, node in enumerate(order)}
+    nodes = [{"id": graph.name(node), "entity": graph.name(node), "label": graph.label(node),
+              "degree": int(graph.degrees(node)), "hops": hop, "focus": hop == 0} for node, hop in selected.items()]
+
+    edges, layout_edges = [], []
+    for node in order:
+        neighbors, edge_types = graph.neighbors(node)
+        relationships = {}
+        for neighbor, edge_type in zip(neighbors.tolist(), edge_types.tolist()):
+            if neighbor > node and neighbor in index:
+                relationships.setdefault(neighbor, []).append(graph.relationship_name(edge_type))
+        for neighbor, names in relationships.items():
+            edges.append({"source": graph.name(node), "target": graph.name(neighbor), "weight": len(names),
+                          "relationships": sorted(names)})
+            layout_edges.append((index[node], index[neighbor], len(names)))
+
+    for (parent, label), leaves in aggregates.items():
+        if parent not in index:
+            continue
+        aggregate_id = f"{graph.name(parent)}::{label}"
+        nodes.append({"id": aggregate_id, "entity": f"{len(leaves)} more {label}", "label": label, "degree": 1,
+                      "hops": selected[parent] + 1, "focus": False, "aggregate": True, "count": len(leaves),
+                      "members": sorted(graph.name(leaf) for leaf in leaves)[:50]})
+        edges.append({"source": graph.name(parent), "target": aggregate_id, "weight": len(leaves), "relationships": []})
+        layout_edges.append((index[parent], len(nodes) - 1, len(leaves)))
+
+    positions = force_layout(len(nodes), layout_edges)
+    for node, (x, y) in zip(nodes, positions.tolist()):
+        node["x"], node["y"] = round(x, 4), round(y, 4)
+    return {"nodes": nodes, "edges": edges, "truncated": truncated}
+
+
+class ViewCache:
+    """Thread-safe LRU of finished views; clear() after every change to the underlying data."""
+
+    def __init__(self, max_entries=VIEW_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            view = self._entries.get(key)
+            if view is None:
+                self.misses += 1
+                record_cache("graph_view", misses=1)
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            record_cache("graph_view", hits=1)
+            return view
+
+    def put(self, key, view):
+        with self._lock:
+            self._entries[key] = view
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
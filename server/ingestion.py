@@ -0,0 +1,120 @@
+"""Incremental upload pipeline: each document only runs the stages the manifest has not recorded for it yet."""
+import os
+import threading
+import time
+import pandas as pd
+from columnar_store import artifact_extension, read_table, write_table
+from metrics import record_cache, trace
+from Functions import extract_text_from_directory, extract_entities_and_pairs_from_text_files, predict_relationships_from_entity_pairs
+
+# spaCy pipelines are not guaranteed to be thread-safe, concurrent jobs take turns on the shared NER model
+_ner_lock = threading.Lock()
+
+def _no_progress(stage, status, **details):
+    pass
+
+def text_file_name(document):
+    return f"{os.path.splitext(os.path.basename(document['pdf_path']))[0]}.txt"
+
+def stage_artifact_path(cache_folder, document, stage):
+    """Per-document table written by a stage, e.g. LocalDB/cache/<sha256>/entities.arrow (see columnar_store.py)"""
+    return os.path.join(cache_folder, document["sha256"], stage + artifact_extension())
+
+def _pending(documents, manifest, *stages):
+    """Documents still missing one of the stages; the others count as hits of the per-document stage cache"""
+    pending = [document for document in documents if not set(stages) <= manifest.completed_stages(document["sha256"])]
+    record_cache("stage_results", hits=len(documents) - len(pending), misses=len(pending))
+    return pending
+
+def _save_per_document(df, documents, manifest, cache_folder, stage, seconds):
+    for document in documents:
+        path = write_table(df[df["File Name"] == text_file_name(document)], stage_artifact_path(cache_folder, document, stage))
+        manifest.mark_stage_done(document["sha256"], stage, artifact=path, seconds=seconds)
+
+def run_ingestion(documents, manifest, folders, store_document, nlp=None, progress=None):
+    """Runs text -> entities/pairs -> relationships -> stored for the documents that still need it. The stages hand
+    each other per-document tables in the cache folder, a stage reads back only the documents it runs on.
+
+    documents: manifest rows (sha256, file_id, filename, pdf_path)
+    folders: dict with the "uploads", "output_txt" and "cache" folders
+    store_document: callback(document, entities_df, relationships_df) that persists one document
+    progress: optional callback(stage, status, **details) fed "running" / "done" / "skipped" per stage
+    Returns {filename: {"ran": [...], "skipped": [...]}}
+    """
+    progress = progress or _no_progress
+    summary = {document["filename"]: {"ran": [], "skipped": []} for document in documents}
+    for document in documents:
+        summary[document["filename"]]["skipped"] = sorted(manifest.completed_stages(document["sha256"]))
+
+    # 1. Text extraction for documents without a valid text file
+    todo = _pending(documents, manifest, "text")
+    if todo:
+        progress("text", "running", documents=len(todo))
+        timings = extract_text_from_directory(folders["uploads"], folders["output_txt"],
+                                              pdf_files=[os.path.basename(document["pdf_path"]) for document in todo])
+        seconds = {timing["file"]: timing["seconds"] for timing in timings}
+        for document in todo:
+            pdf_file = os.path.basename(document["pdf_path"])
+            text_path = os.path.join(folders["output_txt"], text_file_name(document))
+            manifest.mark_stage_done(document["sha256"], "text", artifact=text_path, seconds=seconds.get(pdf_file))
+            summary[document["filename"]]["ran"].append("text")
+        progress("text", "done", pages=sum(timing["pages"] for timing in timings), files=timings)
+    else:
+        progress("text", "skipped")
+
+    # 2. Entities and pairs from one batched NER pass over the documents that need either
+    todo = _pending(documents, manifest, "entities", "pairs")
+    if todo:
+        progress("entities", "running", documents=len(todo))
+        progress("pairs", "running", documents=len(todo))
+        started = time.perf_counter()
+        with _ner_lock:
+            entities, pairs = extract_entities_and_pairs_from_text_files(
+                folders["output_txt"], filenames=[text_file_name(document) for document in todo], nlp=nlp)
+        seconds = round(time.perf_counter() - started, 4)
+        _save_per_document(entities, todo, manifest, folders["cache"], "entities", seconds)
+        _save_per_document(pairs, todo, manifest, folders["cache"], "pairs", seconds)
+        for document in todo:
+            summary[document["filename"]]["ran"] += ["entities", "pairs"]
+        progress("entities", "done", entities=len(entities))
+        progress("pairs", "done", pairs=len(pairs))
+    else:
+        progress("entities", "skipped")
+        progress("pairs", "skipped")
+
+    # 3. Relationships, one REBEL run over the pairs of every document that needs it
+    todo = _pending(documents, manifest, "relationships")
+    if todo:
+        progress("relationships", "running", documents=len(todo))
+        started = time.perf_counter()
+        pairs = pd.concat([read_table(manifest.stage_artifact(document["sha256"], "pairs")) for document in todo],
+                          ignore_index=True)
+        if len(pairs):
+            relationships = predict_relationships_from_entity_pairs(pairs)
+        else:
+            relationships = pairs  # Nothing to predict, skip loading the model
+        _save_per_document(relationships, todo, manifest, folders["cache"], "relationships",
+                           round(time.perf_counter() - started, 4))
+        for document in todo:
+            summary[document["filename"]]["ran"].append("relationships")
+        progress("relationships", "done", **{"pairs": len(pairs), **relationships.attrs.get("relation_stats", {})})
+    else:
+        progress("relationships", "skipped")
+
+    # 4. Persist each document that is not stored yet
+    todo = _pending(documents, manifest, "stored")
+    progress("stored", "running" if todo else "skipped", documents=len(todo))
+    for document in todo:
+        started = time.perf_counter()
+        entities = read_table(manifest.stage_artifact(document["sha256"], "entities"))
+        relationships = read_table(manifest.stage_artifact(document["sha256"], "relationships"))
+        store_document(document, entities, relationships)
+        seconds = round(time.perf_counter() - started, 4)
+        manifest.mark_stage_done(document["sha256"], "stored", seconds=seconds)
+        trace("document_stage", stage="stored", file=text_file_name(document), entities=len(entities),
+              relationships=len(relationships), seconds=seconds)
+        summary[document["filename"]]["ran"].append("stored")
+    if todo:
+        progress("stored", "done")
+
+    return summary
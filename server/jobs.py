@@ -0,0 +1,161 @@
+"""In-process background job queue used to run ingestion outside the Flask request thread.
+
+With a state_folder, every job change is also written to <state_folder>/<job_id>.json so that other server
+worker processes can answer status requests for jobs they did not run.
+"""
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from metrics import JOB_SECONDS, trace, trace_context
+
+# Job and stage states
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+PENDING, DONE, SKIPPED = "pending", "done", "skipped"
+
+
+class JobQueue:
+    """Runs submitted functions on a bounded worker pool and keeps per-stage progress for each job."""
+
+    def __init__(self, max_workers=2, max_history=200, state_folder=None):
+        self.max_workers = max_workers
+        self.max_history = max_history
+        self.state_folder = state_folder
+        if state_folder:
+            os.makedirs(state_folder, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingestion")
+        self._jobs = OrderedDict()  # job_id -> job dict, oldest first
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, stages=(), metadata=None, **kwargs):
+        """Queues fn(*args, progress=callback, **kwargs) and returns the job ID straight away."""
+        job_id = str(uuid.uuid4())
+        job = {
+            "job_id": job_id,
+            "status": QUEUED,
+            "created_at": datetime.now().isoformat(),
+            "started_at": None,
+            "finished_at": None,
+            "seconds": None,
+            "metadata": metadata or {},
+            "stages": OrderedDict((stage, {"status": PENDING, "seconds": None, "error": None}) for stage in stages),
+            "result": None,
+            "error": None,
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+            self._trim_history()
+            self._save(job)
+        self._executor.submit(self._run, job_id, fn, args, kwargs)
+        return job_id
+
+    def _run(self, job_id, fn, args, kwargs):
+        started = time.perf_counter()
+        status = FAILED
+        self._update(job_id, status=RUNNING, started_at=datetime.now().isoformat())
+        try:
+            with trace_context(job_id=job_id):  # Trace lines written by the job carry its ID
+                result = fn(*args, progress=lambda stage, status, **details: self._progress(job_id, stage, status, details), **kwargs)
+            status = SUCCEEDED
+            self._update(job_id, status=SUCCEEDED, result=result)
+        except Exception as e:
+            traceback.print_exc()
+            self._update(job_id, status=FAILED, error=f"{type(e).__name__}: {e}")
+            with self._lock:  # Whatever stage was running when the job died failed with it
+                for stage in self._jobs[job_id]["stages"].values():
+                    if stage["status"] == RUNNING:
+                        stage["status"], stage["error"] = FAILED, str(e)
+                self._save(self._jobs[job_id])
+        finally:
+            seconds = round(time.perf_counter() - started, 4)
+            self._update(job_id, finished_at=datetime.now().isoformat(), seconds=seconds)
+            JOB_SECONDS.observe(seconds, status=status)
+            trace("job", job_id=job_id, status=status, seconds=seconds)
+
+    def _progress(self, job_id, stage, status, details):
+        """Progress callback handed to the job function, e.g. progress("text", "running", documents=3)"""
+        with self._lock:
+            stages = self._jobs[job_id]["stages"]
+            entry = stages.setdefault(stage, {"status": PENDING, "seconds": None, "error": None})
+            if status == RUNNING:
+                entry["_started"] = time.perf_counter()
+            elif "_started" in entry:
+                entry["seconds"] = round(time.perf_counter() - entry.pop("_started"), 4)
+            entry["status"] = status
+            entry.update(details)
+            self._save(self._jobs[job_id])
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+            self._save(self._jobs[job_id])
+
+    def _state_path(self, job_id):
+        return os.path.join(self.state_folder, f"{job_id}.json")
+
+    def _save(self, job):
+        """Writes the job's snapshot for other processes (atomically, readers never see half a file)"""
+        if not self.state_folder:
+            return
+        path = self._state_path(job["job_id"])
+        try:
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(_snapshot(job), f, default=str)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            print(f"Could not save job state {path}: {e}")
+
+    def _load(self, job_id):
+        if not self.state_folder:
+            return None
+        try:
+            with open(self._state_path(job_id), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _trim_history(self):
+        """Drops the oldest finished jobs once more than max_history are kept"""
+        finished = [job_id for job_id, job in self._jobs.items() if job["status"] in (SUCCEEDED, FAILED)]
+        for job_id in finished[:max(0, len(self._jobs) - self.max_history)]:
+            del self._jobs[job_id]
+            if self.state_folder:
+                try:
+                    os.remove(self._state_path(job_id))
+                except OSError:
+                    pass
+
+    def get(self, job_id):
+        """Snapshot of a job of this process, else of another process sharing the state folder"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job:
+                return _snapshot(job)
+        if "/" in job_id or "\\" in job_id or job_id.startswith("."):
+            return None
+        return self._load(job_id)
+
+    def list(self, status=None):
+        with self._lock:
+            jobs = [_snapshot(job) for job in reversed(self._jobs.values())]
+        if self.state_folder:  # Jobs run by other worker processes
+            known = {job["job_id"] for job in jobs}
+            others = [self._load(name[:-5]) for name in os.listdir(self.state_folder)
+                      if name.endswith(".json") and name[:-5] not in known]
+            jobs += sorted((job for job in others if job), key=lambda job: job["created_at"], reverse=True)
+        return [job for job in jobs if status is None or job["status"] == status]
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+def _snapshot(job):
+    """Copy of a job that is safe to serialise outside the lock"""
+    snapshot = dict(job)
+    snapshot["stages"] = {name: {k: v for k, v in stage.items() if not k.startswith("_")} for name, stage in job["stages"].items()}
+    return snapshot
@@ -0,0 +1,101 @@
+"""Ingestion manifest: which pipeline stages are finished for each uploaded PDF, keyed by the SHA-256 of its bytes."""
+import hashlib
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+# Pipeline stages in the order they run
+STAGES = ["text", "entities", "pairs", "relationships", "stored"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    sha256 TEXT PRIMARY KEY,
+    file_id TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    pdf_path TEXT NOT NULL,
+    pages INTEGER,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stages (
+    sha256 TEXT NOT NULL REFERENCES documents(sha256) ON DELETE CASCADE,
+    stage TEXT NOT NULL,
+    artifact TEXT,
+    seconds REAL,
+    finished_at TEXT NOT NULL,
+    PRIMARY KEY (sha256, stage)
+);
+CREATE INDEX IF NOT EXISTS documents_filename ON documents(filename);
+"""
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class IngestionManifest:
+    """SQLite-backed manifest, safe to share between request and worker threads."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(SCHEMA)
+
+    def get_document(self, sha256):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM documents WHERE sha256 = ?", (sha256,)).fetchone()
+        return dict(row) if row else None
+
+    def find_by_filename(self, filename):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM documents WHERE filename = ?", (filename,)).fetchone()
+        return dict(row) if row else None
+
+    def register_document(self, sha256, file_id, filename, pdf_path, pages):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO documents (sha256, file_id, filename, pdf_path, pages, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (sha256, file_id, filename, os.path.abspath(pdf_path), pages, datetime.now().isoformat()),
+            )
+        return self.get_document(sha256)
+
+    def completed_stages(self, sha256):
+        """Stages recorded as finished whose artifact (if any) is still on disk."""
+        with self._lock:
+            rows = self._conn.execute("SELECT stage, artifact FROM stages WHERE sha256 = ?", (sha256,)).fetchall()
+        return {row["stage"] for row in rows if row["artifact"] is None or os.path.exists(row["artifact"])}
+
+    def is_complete(self, sha256):
+        return set(STAGES) <= self.completed_stages(sha256)
+
+    def stage_artifact(self, sha256, stage):
+        with self._lock:
+            row = self._conn.execute("SELECT artifact FROM stages WHERE sha256 = ? AND stage = ?", (sha256, stage)).fetchone()
+        return row["artifact"] if row else None
+
+    def mark_stage_done(self, sha256, stage, artifact=None, seconds=None):
+        if stage not in STAGES:
+            raise ValueError(f"Unknown stage '{stage}'")
+        artifact = os.path.abspath(artifact) if artifact else None
+        with self._lock, self._conn:
+            if artifact:
+                # An artifact path belongs to one document only, a newer document writing it invalidates the old entry
+                self._conn.execute("DELETE FROM stages WHERE artifact = ? AND sha256 != ?", (artifact, sha256))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO stages (sha256, stage, artifact, seconds, finished_at) VALUES (?, ?, ?, ?, ?)",
+                (sha256, stage, artifact, seconds, datetime.now().isoformat()),
+            )
+
+    def valid_paths(self):
+        """Absolute paths of every uploaded PDF and stage artifact the manifest still relies on."""
+        with self._lock:
+            pdfs = self._conn.execute("SELECT pdf_path FROM documents").fetchall()
+            artifacts = self._conn.execute("SELECT artifact FROM stages WHERE artifact IS NOT NULL").fetchall()
+        return {row[0] for row in pdfs + artifacts if os.path.exists(row[0])}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,307 @@
+"""Pipeline and API instrumentation: counters and histograms rendered in the Prometheus text format, plus an
+optional JSON-lines trace log.
+
+Stage functions call record_stage(stage, seconds, documents=..., pages=...); caches call record_cache(cache, hits,
+misses). backend.py adds per-route request latency and serves render() on /metrics.
+
+With share(folder) every process writes its values to <folder>/<pid>.json every few seconds (and when it exits)
+and render() adds up the files of all live processes, so a scrape of any gunicorn worker reports the whole server.
+The values of processes that have exited are added to <folder>/dead.json before their files are removed, so the
+totals never go down when a worker is recycled.
+
+Set TRACE_LOG=<path> to also append one JSON line per document and stage (with the job it ran in) to that file;
+trace_report.py summarizes it per job and document.
+"""
+import atexit
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", 5))
+TRACE_LOG = os.getenv("TRACE_LOG")  # Path of the JSON-lines trace log, unset = no tracing
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEAD_SNAPSHOT = "dead.json"  # Accumulated values of the processes that have exited
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process development server
+    fcntl = None
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if value != float("inf") else "+Inf"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name, self.documentation, self.labelnames = name, documentation, tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def values(self):
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def merge(value, other):
+        return value + other
+
+    def lines(self, values):
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(dict(zip(self.labelnames, key)))} {_format_value(value)}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=STAGE_BUCKETS):
+        self.name, self.documentation, self.labelnames = name, documentation, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [count per bucket (not cumulative) ..., count above the last bucket, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    def values(self):
+        with self._lock:
+            return {key: list(state) for key, state in self._values.items()}
+
+    @staticmethod
+    def merge(value, other):
+        return [a + b for a, b in zip(value, other)]
+
+    def lines(self, values):
+        for key, state in sorted(values.items()):
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state[:-1]):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels({**labels, 'le': _format_value(bound)})} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(labels)} {_format_value(state[-1])}"
+            yield f"{self.name}_count{_format_labels(labels)} {cumulative}"
+
+
+class MetricsRegistry:
+    """Named metrics of this process; share() adds up the values of all server processes."""
+
+    def __init__(self):
+        self._metrics = OrderedDict()
+        self._folder = None
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._add(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=STAGE_BUCKETS):
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def share(self, folder, interval=METRICS_FLUSH_SECONDS):
+        """Publishes this process' values in folder (now and every interval seconds) and merges the others' on render"""
+        os.makedirs(folder, exist_ok=True)
+        self._folder = folder
+        self._flush()
+
+        def flush_periodically():
+            while True:
+                time.sleep(interval)
+                self._flush()
+
+        threading.Thread(target=flush_periodically, name="metrics-flush", daemon=True).start()
+        atexit.register(self._flush)  # What was counted since the last flush still reaches dead.json
+
+    def _local(self):
+        return {name: metric.values() for name, metric in self._metrics.items()}
+
+    def _flush(self):
+        path = os.path.join(self._folder, f"{os.getpid()}.json")
+        snapshot = {name: [[list(key), value] for key, value in values.items()] for name, values in self._local().items()}
+        try:
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(snapshot, f)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            print(f"Could not save metrics {path}: {e}")
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _fold(self, dead, snapshot):
+        """Adds a snapshot to the accumulated values of exited processes (both in the file format)"""
+        for name, entries in snapshot.items():
+            metric = self._metrics.get(name)
+            if metric is None:
+                continue  # Not a metric of this version, collect() would skip it too
+            values = {tuple(key): value for key, value in dead.get(name, [])}
+            for key, value in entries:
+                key = tuple(key)
+                values[key] = metric.merge(values[key], value) if key in values else value
+            dead[name] = [[list(key), value] for key, value in values.items()]
+
+    def _others(self):
+        """Snapshots of the other live processes plus the accumulated ones of exited processes. Runs under a lock
+        shared by all processes, so a process is never counted both in its own file and in dead.json."""
+        with self._lock, open(os.path.join(self._folder, "dead.lock"), "a") as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)  # Released on close
+            dead_path = os.path.join(self._folder, DEAD_SNAPSHOT)
+            dead = self._read(dead_path) or {}
+            snapshots, exited = [], []
+            for name in os.listdir(self._folder):
+                if not name.endswith(".json") or name in (f"{os.getpid()}.json", DEAD_SNAPSHOT):
+                    continue
+                path = os.path.join(self._folder, name)
+                snapshot = self._read(path)
+                if snapshot is None:
+                    continue
+                try:
+                    os.kill(int(name[:-5]), 0)
+                except ProcessLookupError:
+                    self._fold(dead, snapshot)
+                    exited.append(path)
+                    continue
+                except (ValueError, PermissionError):
+                    pass
+                snapshots.append(snapshot)
+            if exited:
+                try:
+                    with open(dead_path + ".tmp", "w", encoding="utf-8") as f:
+                        json.dump(dead, f)
+                    os.replace(dead_path + ".tmp", dead_path)
+                    for path in exited:  # Only once their values are in dead.json
+                        os.remove(path)
+                except OSError as e:
+                    print(f"Could not save metrics {dead_path}: {e}")
+            return snapshots + [dead]
+
+    def collect(self):
+        """{metric name: {label values: value}} over this process and, when shared, the others"""
+        merged = self._local()
+        for snapshot in self._others() if self._folder else ():
+            for name, entries in snapshot.items():
+                metric = self._metrics.get(name)
+                if metric is None:
+                    continue
+                values = merged.setdefault(name, {})
+                for key, value in entries:
+                    key = tuple(key)
+                    values[key] = metric.merge(values[key], value) if key in values else value
+        return merged
+
+    def render(self):
+        """Prometheus text exposition of every metric, plus the hit ratio of each cache"""
+        values = self.collect()
+        lines = []
+        for name, metric in self._metrics.items():
+            lines += [f"# HELP {name} {metric.documentation}", f"# TYPE {name} {metric.kind}"]
+            lines += metric.lines(values.get(name, {}))
+        lines += ["# HELP aka_cache_hit_ratio Hits / (hits + misses) per cache since the server started",
+                  "# TYPE aka_cache_hit_ratio gauge"]
+        lookups = {}
+        for (cache, result), count in values.get(CACHE_REQUESTS.name, {}).items():
+            lookups.setdefault(cache, {}).setdefault(result, 0)
+            lookups[cache][result] += count
+        for cache, counts in sorted(lookups.items()):
+            total = counts.get("hit", 0) + counts.get("miss", 0)
+            if total:
+                lines.append(f"aka_cache_hit_ratio{_format_labels({'cache': cache})} {_format_value(counts.get('hit', 0) / total)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram("aka_stage_seconds", "Seconds per call of a pipeline stage", ["stage"])
+STAGE_ITEMS = registry.counter("aka_stage_items_total", "Items (documents, pages, entities, pairs, ...) processed per stage",
+                               ["stage", "item"])
+CACHE_REQUESTS = registry.counter("aka_cache_requests_total", "Cache lookups by cache and result (hit/miss)", ["cache", "result"])
+REQUEST_SECONDS = registry.histogram("aka_http_request_seconds", "Request latency per route", ["method", "route", "status"],
+                                     buckets=REQUEST_BUCKETS)
+JOB_SECONDS = registry.histogram("aka_job_seconds", "Ingestion job duration by final status", ["status"])
+
+
+def record_items(stage, **items):
+    """Items a stage processed, e.g. record_items("ner", documents=3, entities=120)"""
+    for item, count in items.items():
+        if count:
+            STAGE_ITEMS.inc(count, stage=stage, item=item)
+
+
+def record_stage(stage, seconds, **items):
+    """One call of a stage: its duration and how many of each item it processed"""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    record_items(stage, **items)
+
+
+def record_cache(cache, hits=0, misses=0):
+    if hits:
+        CACHE_REQUESTS.inc(hits, cache=cache, result="hit")
+    if misses:
+        CACHE_REQUESTS.inc(misses, cache=cache, result="miss")
+
+
+# Trace log
+_trace_context = contextvars.ContextVar("trace_context", default={})
+_trace_lock = threading.Lock()
+
+
+@contextmanager
+def trace_context(**fields):
+    """Adds fields (e.g. job_id) to every trace() line written inside the block, in this thread"""
+    token = _trace_context.set({**_trace_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _trace_context.reset(token)
+
+
+def tracing():
+    """True when TRACE_LOG is set, for callers that would otherwise compute trace fields for nothing"""
+    return bool(TRACE_LOG)
+
+
+def trace(event, **fields):
+    """Appends {"time", "pid", "event", <context>, <fields>} to TRACE_LOG; no-op when it is not set"""
+    if not TRACE_LOG:
+        return
+    line = json.dumps({"time": datetime.now().isoformat(), "pid": os.getpid(), "event": event,
+                       **_trace_context.get(), **fields}, default=str)
+    with _trace_lock:
+        with open(TRACE_LOG, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
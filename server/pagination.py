@@ -0,0 +1,100 @@
+"""Cursor-paginated and streamed responses for the bulk list endpoints.
+
+Query parameters shared by the list routes:
+    after=<_id>      only documents sorted after this _id (the next_after of the previous page)
+    limit=<n>        page size, at most MAX_PAGE_SIZE
+    fields=a,b       only return these fields
+    format=ndjson    stream one JSON document per line (also chosen by Accept: application/x-ndjson)
+
+Without after/limit the full list is streamed in the original {"<key>": [...]} shape, straight from the
+cursor, so memory stays flat however large the collection is.
+
+Lists sorted by a numeric field (e.g. mentions, highest first) page with "<value>:<_id>" after tokens, so the
+next page is an index range scan on (field, _id) as well.
+"""
+from flask import Response, current_app, jsonify, request, stream_with_context
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+CURSOR_BATCH_SIZE = 500
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+def parse_list_args(args):
+    """Returns (after, limit, fields, ndjson); raises ValueError on bad input"""
+    after = args.get("after")
+    limit = args.get("limit")
+    if limit is not None:
+        limit = int(limit)
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    elif after is not None:
+        limit = DEFAULT_PAGE_SIZE
+    fields = [field.strip() for field in args.get("fields", "").split(",") if field.strip()]
+    ndjson = args.get("format") == "ndjson" or NDJSON_MIMETYPE in request.headers.get("Accept", "")
+    return after, limit, fields, ndjson
+
+def _projection(fields, excluded_fields, sort_field=None):
+    if fields:
+        projection = {field: 1 for field in fields if field not in excluded_fields}
+        projection["_id"] = 1  # Needed for next_after, stripped from the output
+        if sort_field:
+            projection[sort_field] = 1
+        return projection
+    return {field: 0 for field in excluded_fields} or None
+
+def _after_query(after, sort_field):
+    """Documents after the given token: _id > after, or (sort_field, _id) after "<value>:<_id>" in descending order"""
+    if not sort_field:
+        return {"_id": {"$gt": after}}
+    value, separator, after_id = after.partition(":")
+    if not separator:
+        raise ValueError("after must be a next_after token of this list")
+    value = float(value) if "." in value else int(value)
+    return {"$or": [{sort_field: {"$lt": value}}, {sort_field: value, "_id": {"$gt": after_id}}]}
+
+def _after_token(document, sort_field):
+    return f"{document.get(sort_field, 0)}:{document['_id']}" if sort_field else document["_id"]
+
+def list_response(collection, query, key, excluded_fields=(), sort_field=None):
+    """Flask response listing collection.find(query) sorted by _id (or by sort_field, highest first, then _id),
+    paginated and/or streamed"""
+    try:
+        after, limit, fields, ndjson = parse_list_args(request.args)
+        if after is not None:
+            after_query = _after_query(after, sort_field)
+            query = {"$and": [query, after_query]} if query else after_query
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    sort = [(sort_field, -1), ("_id", 1)] if sort_field else [("_id", 1)]
+    cursor = collection.find(query, _projection(fields, excluded_fields, sort_field)).sort(sort).batch_size(CURSOR_BATCH_SIZE)
+    dumps = current_app.json.dumps
+    hidden = {"_id"} | ({sort_field} if fields and sort_field not in fields else set())
+
+    def strip(document):
+        for field in hidden:
+            document.pop(field, None)
+        return document
+
+    if ndjson:
+        if limit is not None:
+            cursor = cursor.limit(limit)
+
+        def generate_lines():
+            for document in cursor:
+                yield dumps(strip(document)) + "\n"
+        return Response(stream_with_context(generate_lines()), mimetype=NDJSON_MIMETYPE)
+
+    if limit is None:
+        def generate_json():
+            yield f'{{"{key}": ['
+            for index, document in enumerate(cursor):
+                yield ("," if index else "") + dumps(strip(document))
+            yield "]}"
+        return Response(stream_with_context(generate_json()), mimetype="application/json")
+
+    documents = list(cursor.limit(limit + 1))  # One extra to know whether there is a next page
+    has_more = len(documents) > limit
+    documents = documents[:limit]
+    next_after = _after_token(documents[-1], sort_field) if has_more else None
+    return jsonify({key: [strip(document) for document in documents], "limit": limit, "next_after": next_after})
@@ -0,0 +1,158 @@
+"""Persistence stage: links a document's entities to its relationships and upserts both into MongoDB in batches."""
+import hashlib
+import os
+import time
+from collections import defaultdict
+from pymongo import ASCENDING, UpdateOne
+from metrics import record_stage
+
+MONGO_BATCH_SIZE = int(os.getenv("MONGO_BATCH_SIZE", 1000))
+RELATIONSHIP_FIELDS = ["entity_1_name", "entity_1_type", "entity_2_name", "entity_2_type", "relationship"]
+ALIAS_SEPARATOR = "; "  # Joins the other spellings of an entity in the Aliases column of entity tables
+
+# Indexes the lookup routes rely on, created at backend startup
+ENTITY_INDEXES = ["entity_norm", "label", "file_id"]
+RELATIONSHIP_INDEXES = ["entity_1_norm", "entity_2_norm"]
+
+def normalize_name(name):
+    """Lookup key for entity names: casefolded with whitespace collapsed, e.g. "  Smith  (JR.)" -> "smith (jr.)" """
+    return " ".join(str(name).casefold().split())
+
+def entity_name_query(entity_name):
+    """Exact, case-insensitive entity lookup served by the entity_norm index"""
+    return {"entity_norm": normalize_name(entity_name)}
+
+def relationships_by_entity_query(entity_name):
+    """Relationships with the entity on either end, each branch served by its own index"""
+    entity_norm = normalize_name(entity_name)
+    return {"$or": [{"entity_1_norm": entity_norm}, {"entity_2_norm": entity_norm}]}
+
+def content_id(*values):
+    """Stable 16-hex-character ID derived from the given values"""
+    return hashlib.sha256("\x1f".join(str(value) for value in values).encode("utf-8")).hexdigest()[:16]
+
+def relationship_id(entry):
+    """Content-addressed ID of a relationship: the same edge always gets the same ID"""
+    return content_id(*(entry[field] for field in RELATIONSHIP_FIELDS))
+
+def entity_id(file_id, entity, label):
+    return content_id(file_id, entity, label)
+
+def index_relationships_by_entity(relationships_list):
+    """Entity name -> relationships it takes part in (as Entity 1 or Entity 2), built in one pass"""
+    by_entity = defaultdict(list)
+    for relation in relationships_list:
+        by_entity[relation["Entity 1"]].append(relation)
+        if relation["Entity 2"] != relation["Entity 1"]:
+            by_entity[relation["Entity 2"]].append(relation)
+    return by_entity
+
+def as_count(value):
+    """int(value), or 1 when it is missing (rows extracted before the Mentions/Co-occurrences columns existed)"""
+    return int(value) if value is not None and value == value else 1
+
+def link_entities_and_relationships(document, entities, relationships, wikidata_ids=None):
+    """Builds the Entities and (deduplicated) Relationships documents for one source document in O(E + R + matches);
+    wikidata_ids (entity name -> Wikidata ID or None) adds a wikidata_id field to each entity"""
+    # Convert DataFrames to lists of dictionaries for easier processing
+    entities_list = entities.to_dict(orient="records")
+    by_entity = index_relationships_by_entity(relationships.to_dict(orient="records"))
+
+    entity_entries = []
+    relationship_entries = {}  # relationship ID -> entry, each edge once even if both endpoints match
+    for entity in entities_list:
+        relationship_ids = []
+        for relation in by_entity.get(entity["Entity"], ()):
+            relationship_entry = {
+                "entity_1_name": relation["Entity 1"],
+                "entity_1_type": relation["Type 1"],
+                "entity_2_name": relation["Entity 2"],
+                "entity_2_type": relation["Type 2"],
+                "relationship": relation["Relationship"]
+            }
+            relationship_entry["_id"] = relationship_id(relationship_entry)
+            relationship_entry["entity_1_norm"] = normalize_name(relation["Entity 1"])
+            relationship_entry["entity_2_norm"] = normalize_name(relation["Entity 2"])
+            if relationship_entry["_id"] not in relationship_ids:
+                relationship_ids.append(relationship_entry["_id"])
+            relationship_entries[relationship_entry["_id"]] = relationship_entry
+        entity_entries.append({
+            "_id": entity_id(document["file_id"], entity["Entity"], entity["Label"]),
+            "file_id": document["file_id"],
+            "file_name": entity["File Name"],
+            "entity": entity["Entity"],
+            "entity_norm": normalize_name(entity["Entity"]),
+            "label": entity["Label"],
+            "frequency": as_count(entity.get("Mentions")),  # Mentions in this file
+            "relationships": relationship_ids  # Array of relationship IDs
+        })
+        if isinstance(entity.get("Canonical ID"), str):  # Entity tables from before canonicalization have none
+            entity_entries[-1]["canonical_id"] = entity["Canonical ID"]
+            aliases = entity.get("Aliases")
+            entity_entries[-1]["aliases"] = aliases.split(ALIAS_SEPARATOR) if isinstance(aliases, str) and aliases else []
+        if wikidata_ids is not None:
+            entity_entries[-1]["wikidata_id"] = wikidata_ids.get(entity["Entity"])
+    return entity_entries, list(relationship_entries.values())
+
+def write_in_batches(collection, operations, batch_size=MONGO_BATCH_SIZE, upserted_ids=None):
+    """One unordered bulk_write round trip per batch_size operations; upserted_ids (a set) collects inserted _ids"""
+    started = time.perf_counter()
+    for start in range(0, len(operations), batch_size):
+        result = collection.bulk_write(operations[start:start + batch_size], ordered=False)
+        if upserted_ids is not None:
+            upserted_ids.update(result.upserted_ids.values())
+    record_stage("mongo_write", time.perf_counter() - started, operations=len(operations),
+                 batches=-(-len(operations) // batch_size))
+    return len(operations)
+
+def relationship_upserts(relationship_entries):
+    """Inserts each edge the first time it is seen, existing copies only get their lookup keys refreshed"""
+    return [UpdateOne({"_id": entry["_id"]},
+                      {"$setOnInsert": {field: entry[field] for field in RELATIONSHIP_FIELDS},
+                       "$set": {"entity_1_norm": entry["entity_1_norm"], "entity_2_norm": entry["entity_2_norm"]}},
+                      upsert=True)
+            for entry in relationship_entries]
+
+def entity_upserts(entity_entries):
+    """Re-storing a document replaces its entity entries instead of duplicating them"""
+    return [UpdateOne({"_id": entry["_id"]},
+                      {"$set": {key: value for key, value in entry.items() if key != "_id"}},
+                      upsert=True)
+            for entry in entity_entries]
+
+def persist_document(document, entities, relationships, entities_collection, relationship_collection, batch_size=MONGO_BATCH_SIZE,
+                     wikidata_ids=None):
+    """Upserts one document's entities and relationships, relationships first so entity references resolve"""
+    entity_entries, relationship_entries = link_entities_and_relationships(document, entities, relationships, wikidata_ids)
+    return persist_entries(entity_entries, relationship_entries, entities_collection, relationship_collection, batch_size)
+
+def persist_entries(entity_entries, relationship_entries, entities_collection, relationship_collection, batch_size=MONGO_BATCH_SIZE,
+                    new_entity_ids=None):
+    """Upserts already linked entries (see link_entities_and_relationships); new_entity_ids (a set) collects the
+    _ids of entity entries that did not exist before"""
+    return {
+        "relationships": write_in_batches(relationship_collection, relationship_upserts(relationship_entries), batch_size),
+        "entities": write_in_batches(entities_collection, entity_upserts(entity_entries), batch_size, new_entity_ids),
+    }
+
+def ensure_indexes(entities_collection, relationship_collection):
+    """Creates the single-field indexes used by the exact-match lookups (no-op when they already exist)"""
+    for field in ENTITY_INDEXES:
+        entities_collection.create_index([(field, ASCENDING)], name=field)
+    for field in RELATIONSHIP_INDEXES:
+        relationship_collection.create_index([(field, ASCENDING)], name=field)
+
+def backfill_normalized_names(entities_collection, relationship_collection, batch_size=MONGO_BATCH_SIZE):
+    """Adds the normalized lookup keys to documents stored before they existed"""
+    entity_updates = [UpdateOne({"_id": entity["_id"]}, {"$set": {"entity_norm": normalize_name(entity["entity"])}})
+                      for entity in entities_collection.find({"entity_norm": {"$exists": False}, "entity": {"$exists": True}},
+                                                             {"entity": 1})]
+    relationship_updates = [UpdateOne({"_id": relation["_id"]},
+                                      {"$set": {"entity_1_norm": normalize_name(relation["entity_1_name"]),
+                                                "entity_2_norm": normalize_name(relation["entity_2_name"])}})
+                            for relation in relationship_collection.find({"entity_1_norm": {"$exists": False}},
+                                                                         {"entity_1_name": 1, "entity_2_name": 1})]
+    return {
+        "entities": write_in_batches(entities_collection, entity_updates, batch_size),
+        "relationships": write_in_batches(relationship_collection, relationship_updates, batch_size),
+    }
@@ -0,0 +1,310 @@
+"""CPU inference backends for the REBEL relation model.
+
+REBEL_BACKEND (see Functions.py) selects how registry.get("rebel") runs the model:
+- "torch": the published fp32 PyTorch model (default)
+- "int8": the same model with every nn.Linear dynamic-quantized to int8 weights
+- "onnx": the model exported to ONNX and run by ONNX Runtime, with one session for the encoder and two for the
+  decoder (first step, then every later step from the key/value cache), created once per process
+
+Every backend is a text2text-generation pipeline, so predict_relations / predict_triplets and the generation settings
+(beams, lengths) stay the same; only the forward passes differ.
+
+int8 and onnx load from artifacts that are prepared once and cached under REBEL_ARTIFACTS/<model>/<backend>/, so a
+server process neither re-quantizes nor re-exports, and the int8 backend never holds the fp32 weights. Prepare them
+ahead of time with
+
+    python rebel_backends.py --backend int8 [--model Babelscape/rebel-large] [--force]
+
+or let the first load do it: artifacts that are missing or were made with other torch / transformers versions are
+prepared again. benchmarks/bench_rebel_backends.py compares the backends.
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import warnings
+from datetime import datetime
+
+REBEL_BACKENDS = ["torch", "int8", "onnx"]
+REBEL_ARTIFACTS = os.getenv("REBEL_ARTIFACTS", os.path.join("LocalDB", "models"))
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", 0))  # Intra-op threads per ONNX Runtime session, 0 = its default
+ONNX_OPSET = 17
+ARTIFACT_FILE = "artifact.json"
+
+
+def artifact_dir(model_name, backend, root=REBEL_ARTIFACTS):
+    return os.path.join(root, re.sub(r"[^\w.-]+", "--", model_name.strip("/\\")), backend)
+
+
+def _versions():
+    import torch
+    import transformers
+    return {"torch": torch.__version__, "transformers": transformers.__version__}
+
+
+def _is_current(folder):
+    """True when folder holds finished artifacts made with the installed library versions"""
+    try:
+        with open(os.path.join(folder, ARTIFACT_FILE), encoding="utf-8") as f:
+            return json.load(f).get("versions") == _versions()
+    except (OSError, ValueError):
+        return False
+
+
+def _load_fp32(model_name, **kwargs):
+    from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+    return AutoTokenizer.from_pretrained(model_name), AutoModelForSeq2SeqLM.from_pretrained(model_name, **kwargs).eval()
+
+
+def _quantize(model, folder):
+    import torch
+    quantized = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    torch.save(quantized, os.path.join(folder, "model.pt"))  # The whole module, so loading needs no fp32 copy
+
+
+def _cache_names(layers):
+    """ONNX input/output names of the per-layer key/value tensors: self-attention, cross-attention"""
+    return ([f"self_{layer}_{kind}" for layer in range(layers) for kind in ("key", "value")],
+            [f"cross_{layer}_{kind}" for layer in range(layers) for kind in ("key", "value")])
+
+
+def _decoder_modules():
+    """Traceable wrappers around a BART-style decoder + LM head. The first decoding step returns the logits and the
+    self- and cross-attention keys/values of every layer, [batch, heads, length, head size] each; later steps take
+    them back and return the self-attention ones grown by one position. One tensor per layer and key/value keeps each
+    step from copying the whole cache."""
+    import torch
+    from transformers.cache_utils import DynamicCache, EncoderDecoderCache
+
+    def flat(legacy, start):
+        return [tensor for layer in legacy for tensor in layer[start:start + 2]]
+
+    class DecoderInit(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.decoder, self.lm_head = model.get_decoder(), model.lm_head
+            self.register_buffer("logits_bias", getattr(model, "final_logits_bias", torch.zeros(1)))
+
+        def logits(self, hidden_state):
+            return self.lm_head(hidden_state) + self.logits_bias
+
+        def forward(self, decoder_input_ids, encoder_hidden_states, encoder_attention_mask):
+            output = self.decoder(input_ids=decoder_input_ids, encoder_hidden_states=encoder_hidden_states,
+                                  encoder_attention_mask=encoder_attention_mask, use_cache=True,
+                                  past_key_values=EncoderDecoderCache(DynamicCache(), DynamicCache()))
+            legacy = output.past_key_values.to_legacy_cache()
+            return (self.logits(output.last_hidden_state), *flat(legacy, 0), *flat(legacy, 2))
+
+    class DecoderStep(DecoderInit):
+        def forward(self, decoder_input_ids, encoder_attention_mask, *cache):
+            half = len(cache) // 2
+            past = EncoderDecoderCache.from_legacy_cache(tuple(
+                (cache[i], cache[i + 1], cache[half + i], cache[half + i + 1]) for i in range(0, half, 2)))
+            # Cross-attention reads its keys/values from the cache, but only runs when encoder states are passed
+            placeholder = encoder_attention_mask.unsqueeze(-1).expand(-1, -1, self.lm_head.in_features).to(cache[0].dtype)
+            output = self.decoder(input_ids=decoder_input_ids, encoder_hidden_states=placeholder,
+                                  encoder_attention_mask=encoder_attention_mask, use_cache=True, past_key_values=past)
+            return (self.logits(output.last_hidden_state), *flat(output.past_key_values.to_legacy_cache(), 0))
+
+    class Encoder(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.encoder = model.get_encoder()
+
+        def forward(self, input_ids, attention_mask):
+            return self.encoder(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+
+    return Encoder, DecoderInit, DecoderStep
+
+
+def _export_onnx(model, folder):
+    import torch
+    Encoder, DecoderInit, DecoderStep = _decoder_modules()
+    input_ids = torch.full((2, 8), model.config.pad_token_id + 1, dtype=torch.long)
+    attention_mask = torch.ones_like(input_ids)
+    decoder_input_ids = torch.full((2, 1), model.config.decoder_start_token_id, dtype=torch.long)
+    encoder, decoder_init, decoder_step = Encoder(model).eval(), DecoderInit(model).eval(), DecoderStep(model).eval()
+    self_names, cross_names = _cache_names(model.config.decoder_layers)
+    present_names = ["present_" + name for name in self_names]
+    batch, length, source = {0: "batch"}, {0: "batch", 1: "length"}, {0: "batch", 1: "source"}
+    self_axes = {name: {0: "batch", 2: "length"} for name in self_names}
+    cross_axes = {name: {0: "batch", 2: "source"} for name in cross_names}
+    with torch.no_grad(), warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # Tracer warnings about Python-side shape checks
+        hidden_state = encoder(input_ids, attention_mask)
+        _, *cache = decoder_init(decoder_input_ids, hidden_state, attention_mask)
+        exports = [
+            (encoder, (input_ids, attention_mask), "encoder.onnx", ["input_ids", "attention_mask"], ["last_hidden_state"],
+             {"input_ids": length, "attention_mask": length, "last_hidden_state": length}),
+            (decoder_init, (decoder_input_ids, hidden_state, attention_mask), "decoder_init.onnx",
+             ["decoder_input_ids", "encoder_hidden_states", "encoder_attention_mask"], ["logits", *self_names, *cross_names],
+             {"decoder_input_ids": length, "encoder_hidden_states": source, "encoder_attention_mask": source,
+              "logits": length, **self_axes, **cross_axes}),
+            (decoder_step, (decoder_input_ids, attention_mask, *cache), "decoder_step.onnx",
+             ["decoder_input_ids", "encoder_attention_mask", *self_names, *cross_names], ["logits", *present_names],
+             {"decoder_input_ids": batch, "encoder_attention_mask": source, "logits": batch, **self_axes, **cross_axes,
+              **{name: {0: "batch", 2: "present_length"} for name in present_names}}),
+        ]
+        for module, args, name, input_names, output_names, dynamic_axes in exports:
+            torch.onnx.export(module, args, os.path.join(folder, name), input_names=input_names,
+                              output_names=output_names, dynamic_axes=dynamic_axes, opset_version=ONNX_OPSET, dynamo=False)
+
+
+def export_artifacts(model_name, backend, root=REBEL_ARTIFACTS, force=False):
+    """Prepares the int8 / onnx artifacts of a model once and returns their folder. They are written to a staging
+    folder and moved in place at the end, so a concurrent load never sees half-written artifacts."""
+    if backend not in ("int8", "onnx"):
+        raise ValueError(f"The {backend!r} backend has no artifacts")
+    folder = artifact_dir(model_name, backend, root)
+    if not force and _is_current(folder):
+        return folder
+    os.makedirs(os.path.dirname(folder), exist_ok=True)
+    staging = tempfile.mkdtemp(dir=os.path.dirname(folder), prefix=f".{backend}-")
+    started = time.perf_counter()
+    try:
+        # The exported graphs use plain attention ops, the fused SDPA path traces shape checks into constants
+        tokenizer, model = _load_fp32(model_name, **({"attn_implementation": "eager"} if backend == "onnx" else {}))
+        (_quantize if backend == "int8" else _export_onnx)(model, staging)
+        tokenizer.save_pretrained(staging)
+        model.config.save_pretrained(staging)
+        model.generation_config.save_pretrained(staging)
+        with open(os.path.join(staging, ARTIFACT_FILE), "w", encoding="utf-8") as f:
+            json.dump({"model": model_name, "backend": backend, "versions": _versions(),
+                       "created": datetime.now().isoformat(), "seconds": round(time.perf_counter() - started, 2)}, f, indent=2)
+        if os.path.isdir(folder):
+            shutil.rmtree(folder)  # Stale artifacts
+        os.replace(staging, folder)
+    except OSError:
+        shutil.rmtree(staging, ignore_errors=True)
+        if _is_current(folder):  # Another process finished the same export first
+            return folder
+        raise
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    print(f"Prepared {backend} artifacts of {model_name} in {folder} ({time.perf_counter() - started:.1f}s)")
+    return folder
+
+
+def _onnx_model_class():
+    import numpy as np
+    import torch
+    from transformers import AutoConfig, GenerationConfig, GenerationMixin, PreTrainedModel
+    from transformers.modeling_outputs import BaseModelOutput, Seq2SeqLMOutput
+
+    class OrtEncoder(torch.nn.Module):
+        main_input_name = "input_ids"
+
+        def __init__(self, session):
+            super().__init__()
+            self.session = session
+
+        def forward(self, input_ids, attention_mask, **kwargs):
+            hidden_state, = self.session.run(None, {"input_ids": input_ids.numpy(), "attention_mask": attention_mask.numpy()})
+            return BaseModelOutput(last_hidden_state=torch.from_numpy(hidden_state))
+
+    class OrtSeq2SeqModel(PreTrainedModel, GenerationMixin):
+        """Exported encoder/decoder sessions behind the model interface generate() drives. The key/value cache is
+        kept as the ONNX Runtime outputs, ([self-attention arrays], [cross-attention arrays]), reordered between
+        beam steps."""
+        config_class = AutoConfig
+        main_input_name = "input_ids"
+
+        def __init__(self, folder, threads=ONNX_THREADS):
+            import onnxruntime
+            super().__init__(AutoConfig.from_pretrained(folder))
+            self.generation_config = GenerationConfig.from_pretrained(folder)
+            options = onnxruntime.SessionOptions()
+            if threads:
+                options.intra_op_num_threads = threads
+
+            def session(name):
+                return onnxruntime.InferenceSession(os.path.join(folder, name), options, providers=["CPUExecutionProvider"])
+
+            self.encoder = OrtEncoder(session("encoder.onnx"))
+            self.decoder_init, self.decoder_step = session("decoder_init.onnx"), session("decoder_step.onnx")
+            self.self_names, self.cross_names = _cache_names(self.config.decoder_layers)
+            # model.device / model.dtype, which generate() and the pipeline read from the first parameter
+            self.device_anchor = torch.nn.Parameter(torch.zeros(0), requires_grad=False)
+
+        @classmethod
+        def _supports_default_dynamic_cache(cls):
+            return False  # The cache is ONNX Runtime arrays, not a transformers Cache
+
+        def get_encoder(self):
+            return self.encoder
+
+        def prepare_inputs_for_generation(self, decoder_input_ids, past_key_values=None, attention_mask=None,
+                                          encoder_outputs=None, **kwargs):
+            return {"decoder_input_ids": decoder_input_ids, "past_key_values": past_key_values,
+                    "attention_mask": attention_mask, "encoder_outputs": encoder_outputs}
+
+        def forward(self, input_ids=None, attention_mask=None, decoder_input_ids=None, encoder_outputs=None,
+                    past_key_values=None, **kwargs):
+            if encoder_outputs is None:
+                encoder_outputs = self.encoder(input_ids, attention_mask)
+            attention_mask = attention_mask.numpy()
+            if past_key_values is None:
+                logits, *cache = self.decoder_init.run(None, {
+                    "decoder_input_ids": decoder_input_ids.numpy(),
+                    "encoder_hidden_states": encoder_outputs.last_hidden_state.numpy(),
+                    "encoder_attention_mask": attention_mask})
+                self_kv, cross_kv = cache[:len(self.self_names)], cache[len(self.self_names):]
+            else:
+                self_kv, cross_kv = past_key_values
+                logits, *self_kv = self.decoder_step.run(None, {
+                    "decoder_input_ids": decoder_input_ids[:, -1:].numpy(), "encoder_attention_mask": attention_mask,
+                    **dict(zip(self.self_names, self_kv)), **dict(zip(self.cross_names, cross_kv))})
+            return Seq2SeqLMOutput(logits=torch.from_numpy(logits), past_key_values=(self_kv, cross_kv))
+
+        def _reorder_cache(self, past_key_values, beam_idx):
+            beams = beam_idx.numpy()
+            return tuple([tensor[beams] for tensor in tensors] for tensors in past_key_values)
+
+    return OrtSeq2SeqModel
+
+
+def load_rebel_backend(model_name, backend, root=REBEL_ARTIFACTS, **pipeline_kwargs):
+    """text2text-generation pipeline running model_name on the given backend; pipeline_kwargs (e.g. max_new_tokens)
+    go to every backend's pipeline alike"""
+    if backend not in REBEL_BACKENDS:
+        raise ValueError(f"Unknown REBEL backend {backend!r}, expected one of {REBEL_BACKENDS}")
+    import torch
+    from transformers import AutoTokenizer, pipeline
+    if backend == "torch":
+        return pipeline("text2text-generation", model=model_name, device=0 if torch.cuda.is_available() else -1,
+                        **pipeline_kwargs)
+    folder = export_artifacts(model_name, backend, root)
+    if backend == "int8":
+        model = torch.load(os.path.join(folder, "model.pt"), weights_only=False)  # Artifacts this module wrote
+        return pipeline("text2text-generation", model=model, tokenizer=AutoTokenizer.from_pretrained(folder), device=-1,
+                        **pipeline_kwargs)
+    from transformers.utils import logging
+    verbosity = logging.get_verbosity()
+    logging.set_verbosity(logging.CRITICAL)  # The pipeline logs an error for model classes it does not list
+    try:
+        return pipeline("text2text-generation", model=_onnx_model_class()(folder),
+                        tokenizer=AutoTokenizer.from_pretrained(folder), device=-1, **pipeline_kwargs)
+    finally:
+        logging.set_verbosity(verbosity)
+
+
+def main():
+    from Functions import REBEL_MODEL
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["int8", "onnx"], nargs="+", required=True)
+    parser.add_argument("--model", default=REBEL_MODEL, help="Hugging Face model name or local folder")
+    parser.add_argument("--artifacts", default=REBEL_ARTIFACTS)
+    parser.add_argument("--force", action="store_true", help="prepare again even if current artifacts exist")
+    args = parser.parse_args()
+    for backend in args.backend:
+        folder = export_artifacts(args.model, backend, args.artifacts, force=args.force)
+        size = sum(os.path.getsize(os.path.join(folder, name)) for name in os.listdir(folder))
+        print(json.dumps({"backend": backend, "folder": folder, "megabytes": round(size / 2 ** 20, 1)}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""Sharded relation extraction: REBEL on a pool of worker processes, each with its own model and pinned thread count.
+
+predict_relationships_from_entity_pairs uses it when REBEL_WORKERS > 1. The Unknown pairs are split into shards
+(pairs that would generate from the same text stay in one shard, so nothing is generated twice), the shards are handed
+to whichever worker is idle and the results are merged back in shard order. The pool, registry.get("rebel_workers"),
+starts on first use and is kept, so every worker loads the model once per server process.
+
+Workers are fresh interpreters running this file, not forks: they import only what relation extraction needs, and
+torch / OpenMP see their thread count (REBEL_THREADS, default cores / REBEL_WORKERS) before they start. Each worker
+has its own pipe, so when one dies (killed, out of memory, crash in native code) the pool knows which shard it held:
+it starts a replacement and retries only that shard, up to REBEL_SHARD_RETRIES times, while the others keep going.
+An exception raised by the prediction itself is not retried, it would fail again.
+
+    pool = RelationWorkerPool(workers=4, threads=1)
+    found, generations = pool.predict(pairs_df)
+"""
+import atexit
+import os
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from multiprocessing.connection import Connection, wait
+
+import pandas as pd
+
+REBEL_SHARD_SIZE = int(os.getenv("REBEL_SHARD_SIZE", 128))  # Distinct generations per shard (at most)
+REBEL_SHARD_RETRIES = int(os.getenv("REBEL_SHARD_RETRIES", 1))  # Retries of a shard whose worker died
+WORKER_START_TIMEOUT = int(os.getenv("REBEL_WORKER_START_TIMEOUT", 600))  # Seconds a worker may take to load the model
+
+
+def default_threads(workers):
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+def plan_shards(df, shard_size=REBEL_SHARD_SIZE, workers=1):
+    """Row labels of the Unknown pairs per shard. Pairs are grouped by the text they generate from (their evidence
+    sentence or synthetic query) so one shard holds all of a text's pairs, and there are at least as many shards as
+    workers when there are enough texts."""
+    from Functions import relation_inputs
+    unknown, has_evidence, queries = relation_inputs(df)
+    texts = queries.reindex(df.index)
+    if "Evidence" in df.columns:
+        texts = texts.fillna(df["Evidence"].where(has_evidence))
+    texts = texts[unknown]
+    codes, uniques = pd.factorize(texts)
+    if not len(uniques):
+        return []
+    per_shard = max(1, min(shard_size, -(-len(uniques) // max(1, workers))))
+    groups = texts.index.groupby(codes // per_shard)
+    return [groups[shard] for shard in sorted(groups)]
+
+
+class _Worker:
+    """One worker process and its two pipe ends"""
+
+    def __init__(self, slot, threads, config):
+        to_worker = os.pipe()
+        from_worker = os.pipe()
+        env = dict(os.environ, OMP_NUM_THREADS=str(threads), MKL_NUM_THREADS=str(threads), ONNX_THREADS=str(threads),
+                   TOKENIZERS_PARALLELISM="false")
+        self.slot = slot
+        self.process = subprocess.Popen([sys.executable, os.path.abspath(__file__), str(to_worker[0]), str(from_worker[1])],
+                                        pass_fds=(to_worker[0], from_worker[1]), env=env)
+        os.close(to_worker[0])
+        os.close(from_worker[1])
+        self.requests = Connection(to_worker[1], readable=False)
+        self.replies = Connection(from_worker[0], writable=False)
+        self.requests.send({**config, "threads": threads})
+        self.started = time.perf_counter()
+        self.ready = False
+        self.shard = None  # Shard the worker is predicting, None while idle
+
+    def stop(self, timeout=5):
+        try:
+            self.requests.send(None)
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.requests.close()
+        self.replies.close()
+
+
+class RelationWorkerPool:
+    """A fixed number of REBEL worker processes; predict() shards a pairs DataFrame across them"""
+
+    def __init__(self, workers, threads=0, model_name=None, backend=None, pipeline_kwargs=None,
+                 shard_size=REBEL_SHARD_SIZE, retries=REBEL_SHARD_RETRIES):
+        from Functions import REBEL_BACKEND, REBEL_MODEL
+        self.workers = max(1, workers)
+        self.threads = threads or default_threads(self.workers)
+        self.shard_size = shard_size
+        self.retries = retries
+        self._config = {"model_name": model_name or REBEL_MODEL, "backend": backend or REBEL_BACKEND,
+                        "pipeline_kwargs": pipeline_kwargs or {}}
+        self._workers = {}
+        self._lock = threading.Lock()  # One predict() at a time: shards of two jobs must not interleave
+        self.load_seconds = {}  # slot -> seconds the slot's current worker took to load the model
+        self.restarts = 0
+        self.last_run = {}  # Shards and retried shards of the latest predict()
+
+    def start(self):
+        """Starts the missing workers and waits until all of them have loaded the model"""
+        with self._lock:
+            self._start()
+            while not all(worker.ready for worker in self._workers.values()):
+                self._handle(self._wait(), {}, None)
+        return self
+
+    def _start(self):
+        for slot in range(self.workers):
+            if slot not in self._workers:
+                self._workers[slot] = _Worker(slot, self.threads, self._config)
+
+    def _wait(self):
+        """Workers with a reply (or that died) since the last call"""
+        by_pipe = {worker.replies: worker for worker in self._workers.values()}
+        timeout = None
+        starting = [worker for worker in self._workers.values() if not worker.ready]
+        if starting:
+            timeout = max(0, min(worker.started for worker in starting) + WORKER_START_TIMEOUT - time.perf_counter())
+        ready = wait(list(by_pipe), timeout)
+        if not ready:
+            raise RuntimeError(f"REBEL worker did not load the model within {WORKER_START_TIMEOUT}s")
+        return [by_pipe[pipe] for pipe in ready]
+
+    def _handle(self, workers, results, pending, attempts=None):
+        """Processes one round of replies: stores results, replaces dead workers and requeues their shard"""
+        for worker in workers:
+            try:
+                kind, shard, payload = worker.replies.recv()
+            except (EOFError, OSError):
+                kind, shard, payload = "died", worker.shard, None
+            if kind == "ready":
+                worker.ready = True
+                self.load_seconds[worker.slot] = payload
+            elif kind == "done":
+                results[shard] = payload
+                worker.shard = None
+            elif kind == "error":
+                raise RuntimeError(f"REBEL shard {shard} failed in worker {worker.process.pid}:\n{payload}")
+            elif kind == "failed":
+                raise RuntimeError(f"REBEL worker {worker.process.pid} could not load the model:\n{payload}")
+            else:
+                self._replace(worker, pending, attempts)
+
+    def _replace(self, worker, pending, attempts):
+        worker.stop(timeout=1)
+        code = worker.process.returncode
+        if not worker.ready:
+            raise RuntimeError(f"REBEL worker {worker.process.pid} exited with code {code} while loading the model")
+        self.restarts += 1
+        self._workers[worker.slot] = _Worker(worker.slot, self.threads, self._config)
+        if worker.shard is None:
+            return
+        attempts[worker.shard] = attempts.get(worker.shard, 0) + 1
+        if attempts[worker.shard] > self.retries:
+            raise RuntimeError(f"REBEL shard {worker.shard} failed {attempts[worker.shard]} times, "
+                               f"worker {worker.process.pid} exited with code {code}")
+        print(f"REBEL worker {worker.process.pid} exited with code {code}, retrying shard {worker.shard}")
+        pending.appendleft(worker.shard)
+
+    def predict(self, df, batch_size=None):
+        """(relations found, number of distinct generations) for the Unknown pairs of df, as predict_unknown_relations
+        returns them, with the shards predicted in parallel"""
+        from Functions import PAIR_COLUMNS, REBEL_BATCH_SIZE
+        from metrics import record_items, record_stage, trace
+        batch_size = batch_size or REBEL_BATCH_SIZE
+        shards = plan_shards(df, self.shard_size, self.workers)
+        columns = [column for column in PAIR_COLUMNS if column in df.columns and column != "Co-occurrences"]
+        results, attempts, pending = {}, {}, deque(range(len(shards)))
+        with self._lock:
+            try:
+                self._start()
+                while len(results) < len(shards):
+                    for worker in self._workers.values():
+                        if pending and worker.ready and worker.shard is None:
+                            worker.shard = pending.popleft()
+                            worker.requests.send((worker.shard, df.loc[shards[worker.shard], columns], batch_size))
+                    self._handle(self._wait(), results, pending, attempts)
+            except BaseException:
+                self.close()  # Workers may still be busy with shards of this call, start over next time
+                raise
+        found = [results[shard][0] for shard in range(len(shards))]
+        for shard, (relations, generations, seconds, pid) in sorted(results.items()):
+            record_stage("rebel", seconds, generations=generations)  # The workers' own metrics stay in their process
+            trace("rebel_shard", shard=shard, worker=pid, pairs=len(shards[shard]), generations=generations,
+                  seconds=round(seconds, 4), attempts=attempts.get(shard, 0) + 1)
+        record_items("rebel_workers", shards=len(shards), retried_shards=len(attempts))
+        self.last_run = {"shards": len(shards), "retried_shards": len(attempts)}
+        found = pd.concat(found) if found else pd.Series(dtype=object)
+        return found, sum(result[1] for result in results.values())
+
+    def close(self):
+        for worker in self._workers.values():
+            worker.stop()
+        self._workers = {}
+
+
+def load_worker_pool():
+    """The pool predict_relationships_from_entity_pairs shards across (REBEL_WORKERS x REBEL_THREADS)"""
+    from Functions import REBEL_THREADS, REBEL_WORKERS
+    pool = RelationWorkerPool(REBEL_WORKERS, REBEL_THREADS)
+    atexit.register(pool.close)
+    return pool
+
+
+def serve(requests, replies):
+    """Worker process: load the model once with the configured threads, then predict shards until told to stop"""
+    config = requests.recv()
+    try:
+        import torch
+        torch.set_num_threads(config["threads"])
+        torch.set_num_interop_threads(1)
+        from Functions import predict_unknown_relations
+        from rebel_backends import load_rebel_backend
+        started = time.perf_counter()
+        rebel = load_rebel_backend(config["model_name"], config["backend"], **config["pipeline_kwargs"])
+        replies.send(("ready", None, round(time.perf_counter() - started, 3)))
+    except Exception:
+        replies.send(("failed", None, traceback.format_exc()))
+        return
+    while True:
+        try:
+            request = requests.recv()
+        except EOFError:  # The parent is gone
+            return
+        if request is None:
+            return
+        shard, pairs, batch_size = request
+        started = time.perf_counter()
+        try:
+            found, generations = predict_unknown_relations(pairs, rebel, batch_size)
+        except Exception:
+            replies.send(("error", shard, traceback.format_exc()))
+            continue
+        replies.send(("done", shard, (found, generations, time.perf_counter() - started, os.getpid())))
+
+
+if __name__ == "__main__":
+    serve(Connection(int(sys.argv[1]), writable=False), Connection(int(sys.argv[2]), readable=False))
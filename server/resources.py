@@ -0,0 +1,106 @@
+"""Process-wide registry of heavy resources (NLP models, database clients).
+
+Each resource is created on first use and then shared, so a model is loaded at most once per process.
+preload() creates them up front instead, e.g. before a server forks its workers.
+
+    from resources import registry
+    nlp = registry.get("ner")
+"""
+import os
+import threading
+import time
+
+
+class ResourceRegistry:
+    """name -> factory; get() builds the resource once (thread-safe) and caches it."""
+
+    def __init__(self):
+        self._factories = {}
+        self._instances = {}
+        self._load_seconds = {}
+        self._locks = {}
+        self._registry_lock = threading.Lock()
+
+    def register(self, name, factory):
+        """Registers (or replaces, dropping any loaded instance) the zero-argument factory of a resource"""
+        with self._registry_lock:
+            self._factories[name] = factory
+            self._instances.pop(name, None)
+            self._load_seconds.pop(name, None)
+            self._locks.setdefault(name, threading.Lock())
+
+    def get(self, name):
+        if name in self._instances:
+            return self._instances[name]
+        if name not in self._factories:
+            raise KeyError(f"Unknown resource: {name}")
+        with self._locks[name]:  # Concurrent first uses wait for one load instead of loading twice
+            if name not in self._instances:
+                started = time.perf_counter()
+                self._instances[name] = self._factories[name]()
+                self._load_seconds[name] = round(time.perf_counter() - started, 3)
+                print(f"Loaded {name} in {self._load_seconds[name]}s")
+        return self._instances[name]
+
+    def set(self, name, instance):
+        """Injects an already built resource (tests, benchmarks, callers with their own model)"""
+        with self._registry_lock:
+            self._locks.setdefault(name, threading.Lock())
+            self._factories.setdefault(name, lambda: instance)
+            self._instances[name] = instance
+
+    def discard(self, name):
+        """Drops the loaded instance (a broken one), the next get() builds a new one"""
+        with self._registry_lock:
+            self._instances.pop(name, None)
+            self._load_seconds.pop(name, None)
+
+    def is_loaded(self, name):
+        return name in self._instances
+
+    def preload(self, names=None):
+        """Loads the given resources (default: all registered) now instead of on first use"""
+        for name in names or list(self._factories):
+            self.get(name)
+        return dict(self._load_seconds)
+
+    def status(self):
+        """{name: load seconds, or None while not loaded yet}"""
+        return {name: self._load_seconds.get(name) for name in self._factories}
+
+
+def _load_ner():
+    from Functions import load_ner_model
+    return load_ner_model()
+
+def _load_rebel():
+    from Functions import load_rebel_pipeline
+    return load_rebel_pipeline()
+
+def _load_rebel_workers():
+    from relation_workers import load_worker_pool
+    return load_worker_pool()
+
+def _load_pdf_workers():
+    from Functions import PDF_WORKERS, pdf_process_pool
+    return pdf_process_pool(PDF_WORKERS)
+
+def _load_aliases():
+    from canonicalize import ALIASES_PATH, AliasIndex
+    # Names first seen at runtime go to a collection all server processes share, not to the CSV
+    return AliasIndex.load(ALIASES_PATH, store=registry.get("mongo")["aka_datathon"]["Aliases"])
+
+def _load_mongo():
+    from pymongo import MongoClient
+    from pymongo.server_api import ServerApi
+    # Connects in the background, does not block; MONGO_MAX_POOL_SIZE caps the connections of this process
+    return MongoClient(os.getenv("MONGO_URI"), server_api=ServerApi('1'), maxPoolSize=int(os.getenv("MONGO_MAX_POOL_SIZE", 100)))
+
+
+registry = ResourceRegistry()
+registry.register("ner", _load_ner)
+registry.register("rebel", _load_rebel)
+registry.register("rebel_workers", _load_rebel_workers)  # REBEL_WORKERS > 1: model processes, not preloaded before fork
+registry.register("pdf_workers", _load_pdf_workers)  # PDF_WORKERS > 1: text extraction processes, not preloaded before fork
+registry.register("mongo", _load_mongo)
+registry.register("aliases", _load_aliases)
@@ -0,0 +1,149 @@
+"""Versioned cache of the read routes' responses, with ETags and conditional GETs.
+
+DataVersion keeps counters of changes to the stored data ("documents" after an ingestion stored a document,
+"files" after an upload added a file) in a small JSON file that every server process reads, so a change made by
+the process that ran the ingestion is seen by all of them.
+
+ResponseCache keeps serialized responses in an LRU bounded by their total size, keyed on the route, its path and
+query arguments and the data version: a new version makes every older entry unreachable (they are dropped on the
+next lookup), so nothing has to be invalidated route by route. Each payload is serialized once, when it is first
+requested; repeat requests are answered from the bytes without touching MongoDB. Responses carry an ETag (a hash
+of the body, so it is the same whichever process produced it) and Cache-Control: no-cache, and a request whose
+If-None-Match still matches gets an empty 304. Streamed responses (the unpaginated and NDJSON lists of
+pagination.py) are passed through uncached, so their memory stays flat.
+
+    @app.route("/entities")
+    @response_cache.cached
+    def get_entities(): ...
+"""
+import functools
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from flask import Response, current_app, request
+from metrics import record_cache
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process development server, the thread lock is enough
+    fcntl = None
+
+RESPONSE_CACHE_MB = float(os.getenv("RESPONSE_CACHE_MB", 64))  # Total size of the cached bodies, per process
+RESPONSE_CACHE_ENTRY_MB = float(os.getenv("RESPONSE_CACHE_ENTRY_MB", 8))  # Larger responses are sent, not cached
+CACHED_STATUSES = (200, 404)  # "Not found" also only changes with the data
+
+
+class DataVersion:
+    """Change counters shared by the server processes through a JSON file"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def current(self):
+        """{counter: value}, {} until the first change"""
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def bump(self, counter):
+        """Increments one counter; returns (previous, new) value"""
+        with self._lock, open(self.path + ".lock", "a") as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)  # Other processes bump under the same lock, released on close
+            counters = self.current()
+            previous = counters.get(counter, 0)
+            counters[counter] = previous + 1
+            with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(counters, f)
+            os.replace(self.path + ".tmp", self.path)
+            return previous, previous + 1
+
+
+class ResponseCache:
+    """Thread-safe LRU of serialized responses of one data version, bounded by the bytes of their bodies"""
+
+    def __init__(self, version, max_bytes=RESPONSE_CACHE_MB * 2 ** 20, max_entry_bytes=RESPONSE_CACHE_ENTRY_MB * 2 ** 20):
+        self.version = version
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.size = 0
+        self.hits = self.misses = 0
+        self._entries = OrderedDict()  # key -> (body, status, mimetype, etag)
+        self._entries_version = (-1, ())
+        self._lock = threading.Lock()
+
+    def get(self, version, key):
+        with self._lock:
+            if version > self._entries_version:  # The data changed, every entry is stale
+                self._entries.clear()
+                self.size = 0
+                self._entries_version = version
+            # An older version comes from a request that read it just before a change: never served from the cache
+            entry = self._entries.get(key) if version == self._entries_version else None
+            if entry is None:
+                self.misses += 1
+                record_cache("responses", misses=1)
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            record_cache("responses", hits=1)
+            return entry
+
+    def put(self, version, key, entry):
+        with self._lock:
+            if version != self._entries_version:
+                return  # The data changed while the response was built
+            previous = self._entries.pop(key, None)
+            self.size += len(entry[0]) - (len(previous[0]) if previous else 0)
+            self._entries[key] = entry
+            while self.size > self.max_bytes:
+                _, (body, _, _, _) = self._entries.popitem(last=False)
+                self.size -= len(body)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self.size, "hits": self.hits, "misses": self.misses}
+
+    def _serialize(self, response):
+        """(body, status, mimetype, etag) of a response, or (None, response to send instead) when it is not cached"""
+        # Streamed (unpaginated or NDJSON) lists go out as they are read from the cursor, never held in memory
+        if response.status_code not in CACHED_STATUSES or response.is_streamed:
+            return None, response
+        body = response.get_data()
+        if len(body) > self.max_entry_bytes:
+            return None, response
+        return (body, response.status_code, response.mimetype, hashlib.blake2b(body, digest_size=12).hexdigest()), None
+
+    def cached(self, view):
+        """Route decorator: answers from the cache (or 304) and caches what the view returns"""
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            counters = self.version.current()
+            version = (sum(counters.values()), tuple(sorted(counters.items())))  # Ordered: counters only grow
+            key = (request.path, tuple(sorted(request.args.items(multi=True))), request.headers.get("Accept", ""))
+            entry = self.get(version, key)
+            hit = entry is not None
+            if not hit:
+                entry, uncached = self._serialize(current_app.make_response(view(*args, **kwargs)))
+                if entry is None:
+                    return uncached
+                self.put(version, key, entry)
+            body, status, mimetype, etag = entry
+            response = Response(body, status=status, mimetype=mimetype)
+            response.headers["Cache-Control"] = "no-cache"  # Revalidate every time, with If-None-Match
+            response.headers["X-Cache"] = "hit" if hit else "miss"
+            if status != 200:
+                return response
+            response.set_etag(etag)
+            return response.make_conditional(request)
+        return wrapper
@@ -0,0 +1,301 @@
+"""In-memory search index for entity names, built from the Entities collection and updated after each ingestion.
+
+- a prefix trie over every word start, each node keeping its best-ranked entities, answers keystroke autocomplete
+- a trigram inverted index answers substring queries ("mad kh" -> "Ahmad Khan")
+- a delete-neighbourhood word index answers one-typo-per-word queries ("ahmed kahn" -> "Ahmad Khan")
+"""
+import heapq
+import threading
+from persistence import normalize_name
+
+TRIE_MAX_DEPTH = 8  # Longer prefixes are answered from the trigram index
+TRIE_TOP_K = 50  # Best-ranked entities kept on every trie node
+FUZZY_MIN_WORD_LENGTH = 4  # Shorter query words must match exactly, one edit is too loose for them
+LABEL_RANK = {"PERSON": 0, "ORG": 1}
+MATCH_TIERS = ["exact", "prefix", "word_prefix", "substring", "fuzzy"]
+SORT_ORDERS = ["relevance", "frequency"]
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def deletes(word):
+    """The word and every variant with one character removed"""
+    return {word} | {word[:i] + word[i + 1:] for i in range(len(word))}
+
+def within_one_edit(a, b):
+    """True when a and b differ by at most one insertion, deletion, substitution or adjacent transposition"""
+    if a == b:
+        return True
+    if abs(len(a) - len(b)) > 1:
+        return False
+    prefix = 0
+    while prefix < min(len(a), len(b)) and a[prefix] == b[prefix]:
+        prefix += 1
+    if len(a) == len(b):
+        return (a[prefix + 1:] == b[prefix + 1:] or
+                (a[prefix:prefix + 2] == b[prefix:prefix + 2][::-1] and a[prefix + 2:] == b[prefix + 2:]))
+    shorter, longer = (a, b) if len(a) < len(b) else (b, a)
+    return shorter[prefix:] == longer[prefix + 1:]
+
+
+class _TrieNode:
+    __slots__ = ("children", "ids", "first_ids", "top", "top_first")
+
+    def __init__(self):
+        self.children = {}
+        self.ids = []  # Entities with a (truncated) word suffix ending here
+        self.first_ids = []  # Entities whose whole (truncated) name ends here
+        self.top = []  # Best TRIE_TOP_K entities with a word starting with this prefix
+        self.top_first = []  # Best TRIE_TOP_K entities whose name starts with this prefix
+
+
+class EntitySearchIndex:
+    """One searchable item per (normalized name, label); thread-safe for concurrent searches and updates."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._ids = {}  # (norm, label) -> item id
+        self._exact = {}  # norm -> item ids (one per label)
+        self._names, self._norms, self._labels = [], [], []
+        self._frequency, self._files = [], []
+        self._ranks = []  # Cached _rank_key per item, refreshed whenever frequency or documents change
+        self._postings = {}  # trigram -> set of item ids
+        self._word_items = {}  # word -> set of item ids
+        self._word_deletes = {}  # word or one-deletion variant -> set of words
+        self._trie = _TrieNode()
+
+    def __len__(self):
+        return len(self._norms)
+
+    def _rank_key(self, item_id):
+        """Higher frequency, then more documents, then PERSON before ORG"""
+        return (-self._frequency[item_id], -len(self._files[item_id]),
+                LABEL_RANK.get(self._labels[item_id], len(LABEL_RANK)), self._norms[item_id])
+
+    def _rank(self, item_id):
+        return self._ranks[item_id]
+
+    def _trie_paths(self, norm):
+        """Trie nodes for every word start of the name, e.g. "ahmad khan" -> "ahmad kh" (whole name), "khan" """
+        starts = [0] + [i + 1 for i, char in enumerate(norm) if char == " "]
+        for start in starts:
+            node, path = self._trie, [self._trie]
+            for char in norm[start:start + TRIE_MAX_DEPTH]:
+                node = node.children.setdefault(char, _TrieNode())
+                path.append(node)
+            yield start == 0, path
+
+    def _promote(self, top, item_id):
+        """Re-ranks item_id inside a node's top list after its rank improved"""
+        if item_id not in top:
+            if len(top) >= TRIE_TOP_K and self._ranks[item_id] >= self._ranks[top[-1]]:
+                return
+            top.append(item_id)
+        top.sort(key=self._rank)
+        del top[TRIE_TOP_K:]
+
+    def _index_new_item(self, item_id, norm):
+        for gram in trigrams(f" {norm} "):
+            self._postings.setdefault(gram, set()).add(item_id)
+        for word in set(norm.split()):
+            if word not in self._word_items:
+                self._word_items[word] = set()
+                if len(word) >= FUZZY_MIN_WORD_LENGTH:
+                    for variant in deletes(word):
+                        self._word_deletes.setdefault(variant, set()).add(word)
+            self._word_items[word].add(item_id)
+
+    def _add_one(self, entity, label, file_id, frequency, update_tops):
+        norm = normalize_name(entity)
+        if not norm:
+            return
+        key = (norm, label)
+        item_id = self._ids.get(key)
+        is_new = item_id is None
+        if is_new:
+            item_id = len(self._norms)
+            self._ids[key] = item_id
+            self._exact.setdefault(norm, []).append(item_id)
+            self._names.append(entity)
+            self._norms.append(norm)
+            self._labels.append(label)
+            self._frequency.append(0)
+            self._files.append(set())
+            self._ranks.append(None)
+            self._index_new_item(item_id, norm)
+        self._frequency[item_id] += frequency or 0
+        if file_id is not None:
+            self._files[item_id].add(file_id)
+        self._ranks[item_id] = self._rank_key(item_id)
+
+        for first, path in self._trie_paths(norm):
+            if is_new:
+                path[-1].ids.append(item_id)
+                if first:
+                    path[-1].first_ids.append(item_id)
+            if update_tops:  # The item's rank only improves, so it can only enter or move up in a top list
+                for node in path:
+                    self._promote(node.top, item_id)
+                    if first:
+                        self._promote(node.top_first, item_id)
+
+    def _rebuild_tops(self, node):
+        candidates, first_candidates = set(node.ids), set(node.first_ids)
+        for child in node.children.values():
+            self._rebuild_tops(child)
+            candidates.update(child.top)
+            first_candidates.update(child.top_first)
+        node.top = heapq.nsmallest(TRIE_TOP_K, candidates, key=self._rank)
+        node.top_first = heapq.nsmallest(TRIE_TOP_K, first_candidates, key=self._rank)
+
+    def build(self, entries):
+        """Bulk load from Entities documents (entity, label, file_id, frequency), computing trie tops once at the end"""
+        with self._lock:
+            for entry in entries:
+                self._add_one(entry.get("entity"), entry.get("label"), entry.get("file_id"), entry.get("frequency"), False)
+            self._rebuild_tops(self._trie)
+        return len(self)
+
+    def add_entities(self, entries):
+        """Incremental update after an ingestion"""
+        with self._lock:
+            for entry in entries:
+                self._add_one(entry.get("entity"), entry.get("label"), entry.get("file_id"), entry.get("frequency"), True)
+
+    def _tier(self, item_id, query):
+        norm = self._norms[item_id]
+        if norm == query:
+            return 0
+        if norm.startswith(query):
+            return 1
+        if f" {query}" in f" {norm}":
+            return 2
+        if query in norm:
+            return 3
+        return 4
+
+    def _trie_node(self, query):
+        node = self._trie
+        for char in query[:TRIE_MAX_DEPTH]:
+            node = node.children.get(char)
+            if node is None:
+                return None
+        return node
+
+    def _ranked_from_trie(self, query, needed):
+        """Fast path for autocomplete: exact, then prefix, then word-prefix matches straight from the trie top lists,
+        topped up with substring matches. Needs needed <= TRIE_TOP_K and a query no deeper than the trie."""
+        node = self._trie_node(query)
+        ranked = sorted(self._exact.get(query, ()), key=self._rank)
+        seen = set(ranked)
+        for item_id in (node.top_first + node.top) if node else ():
+            if item_id not in seen:
+                seen.add(item_id)
+                ranked.append(item_id)
+        if len(ranked) < needed and len(query) >= 3:
+            # The top lists were shorter than TRIE_TOP_K, so they held every prefix match; the rest are substrings
+            ranked += heapq.nsmallest(needed - len(ranked), self._substring_candidates(query) - seen, key=self._rank)
+        return ranked[:needed]
+
+    def _prefix_candidates(self, query):
+        node = self._trie_node(query)
+        if node is None:
+            return set()
+        found, stack = set(), [node]  # Deep pagination or filtering: walk the whole subtree
+        while stack:
+            current = stack.pop()
+            found.update(current.ids)
+            stack.extend(current.children.values())
+        return found
+
+    def _substring_candidates(self, query):
+        postings = sorted((self._postings.get(gram, set()) for gram in trigrams(query)), key=len)
+        if not postings or not postings[0]:
+            return set()
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates &= posting
+            if not candidates:
+                break
+        return {item_id for item_id in candidates if query in self._norms[item_id]}
+
+    def _fuzzy_candidates(self, query, exclude):
+        """Items containing, for every query word, that word or one within one edit; returns item -> edit count"""
+        items = None
+        for word in query.split():
+            if word in self._word_items:
+                matches = {word: 0}
+            else:
+                matches = {}
+            if len(word) >= FUZZY_MIN_WORD_LENGTH:
+                for variant in deletes(word):
+                    for candidate in self._word_deletes.get(variant, ()):
+                        if candidate not in matches and within_one_edit(word, candidate):
+                            matches[candidate] = 1
+            word_items = {}
+            for candidate, edits in matches.items():
+                for item_id in self._word_items[candidate]:
+                    word_items[item_id] = min(edits, word_items.get(item_id, edits))
+            if items is None:
+                items = word_items
+            else:
+                items = {item_id: items[item_id] + edits for item_id, edits in word_items.items() if item_id in items}
+            if not items:
+                return {}
+        return {item_id: edits for item_id, edits in (items or {}).items() if edits and item_id not in exclude}
+
+    def search(self, query, limit=20, offset=0, label=None, sort="relevance"):
+        """Ranked matches: exact, prefix, word prefix, substring, then fuzzy; each tier by frequency and label.
+        sort="frequency" ranks every match (typos included) by frequency alone"""
+        query = normalize_name(query)
+        if not query:
+            return []
+        needed = offset + limit
+        with self._lock:
+            if sort == "frequency":
+                return self._search_by_frequency(query, needed, offset, label)
+            if not label and needed <= TRIE_TOP_K and len(query) <= TRIE_MAX_DEPTH:
+                ranked = self._ranked_from_trie(query, needed)
+                candidates = set(ranked)
+            else:
+                candidates = set()
+                if len(query) <= TRIE_MAX_DEPTH:
+                    candidates |= self._prefix_candidates(query)
+                if len(query) >= 3:
+                    candidates |= self._substring_candidates(query)
+                if label:
+                    candidates = {item_id for item_id in candidates if self._labels[item_id] == label}
+                ranked = heapq.nsmallest(needed, candidates,
+                                         key=lambda item_id: (self._tier(item_id, query), self._rank(item_id)))
+
+            edits = {}
+            if len(ranked) < needed:  # Not enough direct matches, allow typos
+                edits = self._fuzzy_candidates(query, candidates)
+                if label:
+                    edits = {item_id: count for item_id, count in edits.items() if self._labels[item_id] == label}
+                ranked += heapq.nsmallest(needed - len(ranked), edits, key=lambda item_id: (edits[item_id], self._rank(item_id)))
+
+            return [self._result(item_id, query, edits.get(item_id)) for item_id in ranked[offset:needed]]
+
+    def _search_by_frequency(self, query, needed, offset, label):
+        candidates = set()
+        if len(query) <= TRIE_MAX_DEPTH:
+            candidates |= self._prefix_candidates(query)
+        if len(query) >= 3:
+            candidates |= self._substring_candidates(query)
+        edits = self._fuzzy_candidates(query, candidates)
+        candidates |= set(edits)
+        if label:
+            candidates = {item_id for item_id in candidates if self._labels[item_id] == label}
+        ranked = heapq.nsmallest(needed, candidates, key=self._rank)
+        return [self._result(item_id, query, edits.get(item_id)) for item_id in ranked[offset:needed]]
+
+    def _result(self, item_id, query, edits):
+        return {
+            "entity": self._names[item_id],
+            "label": self._labels[item_id],
+            "frequency": self._frequency[item_id],
+            "documents": len(self._files[item_id]),
+            "file_ids": sorted(self._files[item_id]),
+            "match": MATCH_TIERS[4] if edits else MATCH_TIERS[self._tier(item_id, query)],
+        }
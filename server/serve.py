@@ -0,0 +1,76 @@
+"""Production server: gunicorn with preforked workers sharing preloaded models.
+
+Usage (from server/):
+    python serve.py [--bind 0.0.0.0:5000] [--workers 4] [--threads 4] [--torch-threads 1] [--mongo-pool-size 20]
+                    [--no-preload]
+
+The spaCy and REBEL models are loaded once in the master process before it forks, so the workers share the
+weights copy-on-write instead of each loading its own copy. The app itself (and with it the MongoClient, which
+must not cross a fork) is imported in every worker after the fork. Every option can also be set through the
+environment variable named in its help text. `python backend.py` remains the development server.
+"""
+import argparse
+import os
+import sys
+from gunicorn.app.base import BaseApplication
+from resources import registry
+
+# With REBEL_WORKERS > 1 REBEL runs in each worker's own model processes (relation_workers.py), not in the server
+PRELOADED_MODELS = ["ner"] if int(os.getenv("REBEL_WORKERS", 1)) > 1 else ["ner", "rebel"]
+
+
+def limit_torch_threads(torch_threads):
+    """Intra-op threads per worker: workers x torch threads should not exceed the cores"""
+    if torch_threads and "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(torch_threads)
+
+
+class ServerApplication(BaseApplication):
+    def __init__(self, options, torch_threads):
+        self.options = options
+        self.torch_threads = torch_threads
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+        self.cfg.set("post_fork", lambda server, worker: limit_torch_threads(self.torch_threads))
+
+    def load(self):
+        from backend import app  # Runs in each worker, after the fork
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bind", default=os.getenv("SERVE_BIND", "0.0.0.0:5000"), help="SERVE_BIND")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("SERVE_WORKERS", 2)), help="SERVE_WORKERS")
+    parser.add_argument("--threads", type=int, default=int(os.getenv("SERVE_THREADS", 4)), help="SERVE_THREADS, request threads per worker")
+    parser.add_argument("--torch-threads", type=int, default=int(os.getenv("TORCH_THREADS", 1)), help="TORCH_THREADS, per worker")
+    parser.add_argument("--mongo-pool-size", type=int, default=int(os.getenv("MONGO_MAX_POOL_SIZE", 20)),
+                        help="MONGO_MAX_POOL_SIZE, connections per worker")
+    parser.add_argument("--timeout", type=int, default=int(os.getenv("SERVE_TIMEOUT", 120)), help="SERVE_TIMEOUT, seconds")
+    parser.add_argument("--no-preload", action="store_true", help="load the models lazily in each worker instead")
+    args = parser.parse_args()
+
+    # Read by the workers when they import the app
+    os.environ["MONGO_MAX_POOL_SIZE"] = str(args.mongo_pool_size)
+    os.environ["PRELOAD_MODELS"] = "" if args.no_preload else ",".join(PRELOADED_MODELS)
+
+    if not args.no_preload:
+        os.environ.setdefault("OMP_NUM_THREADS", str(args.torch_threads))  # Before torch is first imported
+        registry.preload(PRELOADED_MODELS)
+        limit_torch_threads(args.torch_threads)
+
+    ServerApplication({
+        "bind": args.bind,
+        "workers": args.workers,
+        "threads": args.threads,
+        "worker_class": "gthread",
+        "timeout": args.timeout,
+        "preload_app": False,
+    }, args.torch_threads).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Summarizes a TRACE_LOG file: per job, which documents took the most time in which stage.
+
+Usage (from server/):
+    python trace_report.py TRACE_LOG [--job JOB_ID] [--top 10]
+
+Without --job the most recent job in the log is reported. Documents are ranked by their total traced seconds
+(extraction, cleaning, pair generation, storage); pages, tokens, entities, pairs and REBEL generations are shown
+alongside, since NER and REBEL run batched across documents and are only timed per job.
+"""
+import argparse
+import json
+import os
+from collections import OrderedDict
+
+COUNTS = ["pages", "tokens", "entities", "pairs", "generations", "relationships"]
+
+
+def read_trace(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue  # A line cut short by a crash
+
+
+def summarize(events, job_id=None):
+    """{"job_id", "job", "documents": [{"file", "seconds", "stages": {stage: seconds}, <counts>}, ...]} slowest first"""
+    jobs = OrderedDict()
+    for event in events:
+        if event.get("job_id"):
+            jobs.setdefault(event["job_id"], []).append(event)
+    if not jobs:
+        return None
+    job_id = job_id or next(reversed(jobs))
+    documents = {}
+    job = None
+    for event in jobs.get(job_id, []):
+        if event["event"] == "job":
+            job = {key: event[key] for key in ("status", "seconds")}
+            continue
+        if event["event"] != "document_stage":
+            continue
+        name = os.path.splitext(event["file"])[0]  # Stages name the PDF or its text file
+        document = documents.setdefault(name, {"file": name, "seconds": 0.0, "stages": {}})
+        if event.get("seconds") is not None:
+            document["stages"][event["stage"]] = round(document["stages"].get(event["stage"], 0) + event["seconds"], 4)
+            document["seconds"] = round(document["seconds"] + event["seconds"], 4)
+        for count in COUNTS:  # Several stages report the same count (e.g. pairs), keep the largest
+            if count in event:
+                document[count] = max(document.get(count, 0), event[count])
+    ranked = sorted(documents.values(), key=lambda document: document["seconds"], reverse=True)
+    return {"job_id": job_id, "job": job, "documents": ranked}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("trace_log")
+    parser.add_argument("--job", default=None)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+    report = summarize(read_trace(args.trace_log), args.job)
+    if report is None:
+        print("No job events in the trace log.")
+        return
+    report["documents"] = report["documents"][:args.top]
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()